@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+快速 Base58（比特币字母表）编解码，以及上游内容格式嗅探。
+
+常见的 Base58 实现逐个字符做 decimal = decimal * 58 + digit，每一步都是一次大整数运算，
+整体耗时随输入长度近似平方增长。这里的解码分两步：
+1. 每 10 个字符为一组（58^10 < 2^64），借助 64 位"通道"一次性算出所有组的值：
+   把各组第 j 位数字放进一个按 8 字节对齐的大整数，乘以 58 的幂后累加，全程在 C 层完成；
+2. 再把各组的值两两合并（hi * B + lo，B 每轮平方），大整数乘法使用 Karatsuba，整体为次平方复杂度。
+编码则按 58 的幂次递归二分（大数除法用牛顿迭代求倒数后做 Barrett 约减，避免内置 divmod 的平方复杂度），
+最后用两位一组的查表把每组转换为字符。
+
+安装了 gmpy2 时直接使用 GMP 的进制转换，数 MB 的内容也能在一秒内完成。
+
+用法: python base58_codec.py encode config.json -o config.b58
+      python base58_codec.py decode config.b58 -o config.json
+"""
+import argparse
+import re
+import sys
+from array import array
+from typing import List, Tuple
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+# 每组字符数：58^10 < 2^64，保证每组的值放得进一个 64 位通道
+_GROUP = 10
+_GROUP_BASE = 58 ** _GROUP
+_INVALID = 0xFF
+
+# ASCII 字符 -> 数字值的转换表，非字母表字符映射为 0xFF
+_DECODE_TABLE = bytes(ALPHABET.find(chr(i)) if chr(i) in ALPHABET else _INVALID for i in range(256))
+# 0..3363 -> 两位 Base58 字符
+_PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+_BASE58_RE = re.compile(r'[1-9A-HJ-NP-Za-km-z]+')
+# GMP 在 58 进制下使用的数字字符，与比特币字母表互相转换
+_GMP_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuv'
+_TO_GMP = bytes.maketrans(ALPHABET.encode('ascii'), _GMP_DIGITS.encode('ascii'))
+_FROM_GMP = str.maketrans(_GMP_DIGITS, ALPHABET)
+# 除数位数不超过该值时直接使用内置 divmod
+_BARRETT_THRESHOLD = 4096
+
+
+def sniff_format(content: str) -> str:
+    """
+    根据内容特征判断格式：'json'（以 { 或 [ 开头）、'base58'（只包含 Base58 字符）或 'unknown'
+    """
+    stripped = content.lstrip()
+    if not stripped:
+        return 'unknown'
+    if stripped[0] in '{[':
+        return 'json'
+    if _BASE58_RE.fullmatch(stripped.rstrip()):
+        return 'base58'
+    return 'unknown'
+
+
+def _group_values(digits: bytes) -> List[int]:
+    """
+    把数字序列（长度为 _GROUP 的整数倍）按组换算为整数，高位组在前
+    """
+    count = len(digits) // _GROUP
+    total = 0
+    lanes = bytearray(8 * count)
+    for j in range(_GROUP):
+        # 第 j 位数字放入每个 8 字节通道的最低字节（大端序）
+        lanes[7::8] = digits[j::_GROUP]
+        total = total * 58 + int.from_bytes(lanes, 'big')
+    # 以小端序导出后按 64 位整数切分，再翻转为高位组在前
+    groups = array('Q', total.to_bytes(8 * count, 'little'))
+    if sys.byteorder == 'big':
+        groups.byteswap()
+    values = groups.tolist()
+    values.reverse()
+    return values
+
+
+def b58decode(value) -> bytes:
+    """
+    Base58 解码，value 可以是 str 或 bytes，含非法字符时抛出 ValueError
+    """
+    if isinstance(value, str):
+        try:
+            value = value.encode('ascii')
+        except UnicodeEncodeError:
+            raise ValueError("Base58 内容包含非 ASCII 字符")
+    value = value.strip()
+    digits = value.translate(_DECODE_TABLE)
+    if _INVALID in digits:
+        raise ValueError("Base58 内容包含非法字符")
+
+    leading_zeros = len(digits) - len(digits.lstrip(b'\x00'))
+    digits = digits[leading_zeros:]
+    if not digits:
+        return b'\x00' * leading_zeros
+
+    if gmpy2 is not None:
+        number = int(gmpy2.mpz(value[leading_zeros:].translate(_TO_GMP).decode('ascii'), 58))
+    else:
+        padding = -len(digits) % _GROUP
+        values = _group_values(b'\x00' * padding + digits)
+        base = _GROUP_BASE
+        while len(values) > 1:
+            if len(values) % 2:
+                values.insert(0, 0)
+            values = [hi * base + lo for hi, lo in zip(values[0::2], values[1::2])]
+            if len(values) > 1:
+                base *= base
+        number = values[0]
+    return b'\x00' * leading_zeros + number.to_bytes((number.bit_length() + 7) // 8, 'big')
+
+
+def _inverse(divisor: int, bits: int) -> int:
+    """
+    牛顿迭代近似计算 floor(2^(2*bits) / divisor)，divisor 恰好为 bits 位；
+    结果可能相差几个单位，由 _divmod 的修正步骤兜底
+    """
+    if bits <= _BARRETT_THRESHOLD:
+        return (1 << (2 * bits)) // divisor
+    half = (bits + 1) // 2
+    x = _inverse(divisor >> (bits - half), half) << (bits - half)
+    return x + ((x * ((1 << (2 * bits)) - divisor * x)) >> (2 * bits))
+
+
+def _divmod(number: int, power: Tuple[int, int, int]) -> Tuple[int, int]:
+    """
+    number < divisor^2 时的快速 divmod：Barrett 约减，只用乘法
+    """
+    divisor, bits, inverse = power
+    if inverse is None:
+        return divmod(number, divisor)
+    quotient = ((number >> (bits - 1)) * inverse) >> (bits + 1)
+    remainder = number - quotient * divisor
+    while remainder < 0:
+        quotient -= 1
+        remainder += divisor
+    while remainder >= divisor:
+        quotient += 1
+        remainder -= divisor
+    return quotient, remainder
+
+
+def _encode_groups(number: int, powers: List[Tuple[int, int, int]], level: int, out: List[str]) -> None:
+    """
+    把 number 按 58^(_GROUP * 2^level) 递归二分，依次输出每组 _GROUP 个字符
+    """
+    if level == 0:
+        chars = []
+        for _ in range(_GROUP // 2):
+            number, pair = divmod(number, 3364)
+            chars.append(_PAIRS[pair])
+        out.append(''.join(reversed(chars)))
+        return
+    hi, lo = _divmod(number, powers[level - 1])
+    _encode_groups(hi, powers, level - 1, out)
+    _encode_groups(lo, powers, level - 1, out)
+
+
+def b58encode(data: bytes) -> str:
+    """
+    Base58 编码
+    """
+    leading_zeros = len(data) - len(data.lstrip(b'\x00'))
+    number = int.from_bytes(data, 'big')
+    if number == 0:
+        return '1' * leading_zeros
+    if gmpy2 is not None:
+        return '1' * leading_zeros + gmpy2.digits(gmpy2.mpz(number), 58).translate(_FROM_GMP)
+
+    # powers[i] = (58^(_GROUP * 2^i), 位数, Barrett 倒数或 None)，直到 number < powers[-1]^2
+    powers = []
+    divisor = _GROUP_BASE
+    while True:
+        bits = divisor.bit_length()
+        powers.append((divisor, bits, _inverse(divisor, bits) if bits > _BARRETT_THRESHOLD else None))
+        if divisor.bit_length() * 2 > number.bit_length() + 1 and divisor * divisor > number:
+            break
+        divisor *= divisor
+    out: List[str] = []
+    _encode_groups(number, powers, len(powers), out)
+    return '1' * leading_zeros + ''.join(out).lstrip('1')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Base58 编解码配置文件。")
+    parser.add_argument('action', choices=['encode', 'decode'], help="encode: JSON -> Base58，decode: Base58 -> JSON")
+    parser.add_argument('input', help="输入文件路径")
+    parser.add_argument('-o', '--output', help="输出文件路径（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    if args.action == 'encode':
+        with open(args.input, 'rb') as f:
+            result = b58encode(f.read())
+    else:
+        with open(args.input, 'r', encoding='ascii') as f:
+            result = b58decode(f.read()).decode('utf-8')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(result)
+        print(f"已写入 {args.output}")
+    else:
+        sys.stdout.write(result)
+
+
+if __name__ == "__main__":
+    main()
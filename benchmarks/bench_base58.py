@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Base58 编解码微基准：对比 base58_codec 与 PyPI 上的 base58 库（逐字符大整数实现）。
+
+base58 库耗时随长度近似平方增长，100 KB 就需要十几秒，因此只在 --reference-limit
+以内的大小上运行对照组。安装了 gmpy2 时 base58_codec 默认使用 GMP，--pure 强制使用纯 Python 实现。
+
+用法: python benchmarks/bench_base58.py --sizes 10K,100K,1M,10M
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base58_codec  # noqa: E402
+from base58_codec import b58decode, b58encode, sniff_format  # noqa: E402
+
+try:
+    import base58 as reference
+except ImportError:
+    reference = None
+
+
+def parse_size(text: str) -> int:
+    units = {'K': 1024, 'M': 1024 * 1024}
+    text = text.strip().upper()
+    return int(float(text[:-1]) * units[text[-1]]) if text[-1] in units else int(text)
+
+
+def make_payload(size: int) -> bytes:
+    """
+    构造接近真实上游的 JSON 源列表，截取到指定字节数
+    """
+    sites = {}
+    index = 0
+    while True:
+        sites[f"site{index}"] = {"api": f"https://api{index}.example.com/api.php/provide/vod", "name": f"资源{index}"}
+        index += 1
+        if index % 1000 == 0 and len(json.dumps(sites, ensure_ascii=False).encode('utf-8')) >= size:
+            break
+    return json.dumps({"api_site": sites}, ensure_ascii=False).encode('utf-8')[:size]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Base58 编解码微基准")
+    parser.add_argument('--sizes', default='10K,100K,1M,10M', help="逗号分隔的负载大小")
+    parser.add_argument('--reference-limit', default='100K', help="对照组（base58 库）运行的最大负载")
+    parser.add_argument('--pure', action='store_true', help="不使用 gmpy2，测试纯 Python 实现")
+    args = parser.parse_args()
+    reference_limit = parse_size(args.reference_limit)
+    if args.pure:
+        base58_codec.gmpy2 = None
+    print(f"实现: {'gmpy2' if base58_codec.gmpy2 else '纯 Python'}；对照组: {'base58 库' if reference else '未安装'}")
+
+    print(f"{'大小':>8}{'编码':>10}{'解码':>10}{'库编码':>10}{'库解码':>10}{'嗅探':>10}")
+    for size in map(parse_size, args.sizes.split(',')):
+        payload = make_payload(size)
+        encoded, encode_time = timed(b58encode, payload)
+        decoded, decode_time = timed(b58decode, encoded)
+        assert decoded == payload
+        _, sniff_time = timed(sniff_format, encoded)
+
+        ref_encode = ref_decode = '-'
+        if reference and size <= reference_limit:
+            ref_encoded, t = timed(reference.b58encode, payload)
+            ref_encode = f"{t:.3f}s"
+            assert ref_encoded.decode('ascii') == encoded
+            _, t = timed(reference.b58decode, ref_encoded)
+            ref_decode = f"{t:.3f}s"
+
+        print(f"{len(payload) // 1024:>7}K{encode_time:>9.3f}s{decode_time:>9.3f}s{ref_encode:>10}{ref_decode:>10}"
+              f"{sniff_time:>9.4f}s")
+
+
+if __name__ == "__main__":
+    main()
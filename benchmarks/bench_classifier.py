@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+成人源分类微基准：对比逐个关键词 lower() 后做子串查找的旧实现与一次编译的 KeywordClassifier。
+
+旧实现只检查名称，这里同时给出"新分类器只匹配名称"的结果用于核对两者结论一致，
+以及同时匹配名称、键名与域名的耗时。合成源的键名与域名不含成人词，
+三字段比仅名称多出的命中都是误判；另外核对一组曾被子串匹配误判的键名与域名。
+
+用法: python benchmarks/bench_classifier.py --sources 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from separate_sources import ADULT_KEYWORDS, KeywordClassifier  # noqa: E402
+
+# 曾被子串匹配误判的 (键名, API)：avatar、jav 含 av，api_91、lziapi91 含 91
+FALSE_POSITIVES = [
+    ('avatar', 'https://avatar.example.com/api.php/provide/vod'),
+    ('jav', 'https://jav.example.com/api.php/provide/vod'),
+    ('api_91', 'https://api.example.com/api.php/provide/vod'),
+    ('lzi', 'https://cj.lziapi91.com/api.php/provide/vod'),
+]
+
+NORMAL_WORDS = ['卧龙', '光速', '天涯', '快车', '新浪', '无尽', '量子', '非凡', '暴风', '极速', 'U酷', 'iKun', '红牛', '金鹰']
+
+
+def make_sources(count: int, adult_rate: float, seed: int) -> dict:
+    """
+    生成合成源：按比例在名称中混入成人关键词，其余名称由普通词随机拼接
+    """
+    rng = random.Random(seed)
+    sources = {}
+    for i in range(count):
+        name = rng.choice(NORMAL_WORDS) + rng.choice(['资源', '点播', '影视', 'API'])
+        if rng.random() < adult_rate:
+            name = rng.choice(ADULT_KEYWORDS) + '-' + name
+        sources[f"src{i}"] = {"name": name, "api": f"https://api{i}.zy{rng.randrange(1000)}.com/api.php/provide/vod"}
+    return sources
+
+
+def legacy_is_adult(details: dict) -> bool:
+    """
+    旧版 classify_and_separate_sources 的内层循环
+    """
+    source_name = details.get('name', '').lower()
+    for keyword in ADULT_KEYWORDS:
+        if keyword.lower() in source_name:
+            return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="关键词分类器微基准")
+    parser.add_argument('--sources', type=int, default=100000, help="合成源数量")
+    parser.add_argument('--adult-rate', type=float, default=0.3, help="包含成人关键词的源比例")
+    parser.add_argument('--seed', type=int, default=1, help="随机种子")
+    args = parser.parse_args()
+
+    sources = make_sources(args.sources, args.adult_rate, args.seed)
+
+    start = time.perf_counter()
+    classifier = KeywordClassifier(ADULT_KEYWORDS)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy = {key for key, details in sources.items() if legacy_is_adult(details)}
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    name_only = {key for key, details in sources.items() if classifier.match(details['name'])}
+    name_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    full = {key for key, details in sources.items() if classifier.classify_source(key, details)}
+    full_time = time.perf_counter() - start
+
+    assert legacy == name_only, "新旧分类结论不一致"
+    wrong = [key for key, api in FALSE_POSITIVES if classifier.classify_source(key, {"name": "影视", "api": api})]
+    print(f"{args.sources} 个源，{len(ADULT_KEYWORDS)} 个关键词，命中 {len(legacy)} 个（名称+键名+域名命中 {len(full)} 个）")
+    print(f"编译分类器          {build_time * 1000:8.2f} ms")
+    print(f"旧实现（仅名称）    {legacy_time * 1000:8.1f} ms")
+    print(f"新分类器（仅名称）  {name_time * 1000:8.1f} ms  加速 {legacy_time / name_time:.1f}x")
+    print(f"新分类器（三字段）  {full_time * 1000:8.1f} ms")
+    print(f"键名与域名额外命中 {len(full - name_only)} 个，已知误判用例命中 {len(wrong)} 个" + (f" {wrong}" if wrong else ""))
+    if full - name_only or wrong:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
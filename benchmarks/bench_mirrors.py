@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+镜像识别的核对：在带镜像的模拟源上依次探测、获取首页指纹并按指纹折叠，
+与模拟源行为表中真实的镜像关系（mirror_of）对比，报告折叠数、误折叠与漏折叠。
+
+用法: python benchmarks/bench_mirrors.py --sources 80 --mirror-rate 0.2
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import probe_engine  # noqa: E402
+from mock_fleet import FleetServer, make_fleet  # noqa: E402
+from source_index import find_mirrors  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="镜像识别核对")
+    parser.add_argument('--sources', type=int, default=80, help="模拟源数量")
+    parser.add_argument('--mirror-rate', type=float, default=0.2, help="正常源中设为镜像的比例")
+    parser.add_argument('--timeout', type=float, default=2, help="单次请求超时秒数")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    fleet = make_fleet(args.sources, seed=args.seed, mirror_rate=args.mirror_rate)
+    server = FleetServer(fleet, blackhole_seconds=args.timeout * 2).start()
+    apis = {key: value['api'] for key, value in server.api_sites().items()}
+    # 行为表的编号与源名称一一对应（mock{编号}），同一原站的镜像属于同一组
+    origin = {f"mock{i}": f"mock{spec.get('mirror_of', i)}" for i, spec in fleet.items()}
+    expected = sum(1 for spec in fleet.values() if 'mirror_of' in spec)
+
+    try:
+        results = probe_engine.run_probes(apis, request_timeout=args.timeout, per_host=0, host_interval=0)
+        alive = {name: apis[name] for name, _, ok, _, _ in results if ok}
+        start = time.perf_counter()
+        fingerprints = probe_engine.run_fingerprints(alive, request_timeout=args.timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.stop()
+
+    mirrors = find_mirrors(fingerprints, {})
+    wrong = [name for name, keep in mirrors.items() if origin[name] != origin[keep]]
+    missed = expected - (len(mirrors) - len(wrong))
+    print(f"模拟源 {len(apis)} 个，有效 {len(alive)} 个，真实镜像 {expected} 个")
+    print(f"首页指纹 {len(fingerprints)}/{len(alive)} 个，耗时 {elapsed:.2f}s")
+    print(f"折叠 {len(mirrors)} 个，误折叠 {len(wrong)} 个，漏折叠 {missed} 个")
+    if wrong or missed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
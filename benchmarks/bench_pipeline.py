@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+端到端基准：在本地模拟源上运行 update_config.main 与 test_api_availability.main，
+按不同的模拟源数量与并发数报告耗时、峰值内存与请求数。
+
+每次运行都在独立的子进程与临时目录中进行（读写各自的 config.json 与 .tvapi_cache），
+峰值内存取子进程的峰值常驻内存，请求数由模拟源服务器统计。
+
+用法: python benchmarks/bench_pipeline.py --sizes 100,500 --concurrency 20,200 --engine async,thread
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_fleet import LATENCY_DISTRIBUTIONS, FleetServer, make_fleet  # noqa: E402
+
+
+def peak_rss_kb() -> int:
+    """
+    当前进程的峰值常驻内存（KB）。ru_maxrss 会跨 exec 继承父进程的峰值，Linux 上优先读取 VmHWM
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_child(target: str, workdir: str, argv: list, urls: list) -> None:
+    """
+    子进程入口：在 workdir 中运行目标脚本的 main，向标准输出打印一行 JSON 结果
+    """
+    os.chdir(workdir)
+    sys.argv = [target] + argv
+    if target == 'update':
+        import update_config
+        update_config.URLS_TO_FETCH = urls
+        entry = update_config.main
+    else:
+        import test_api_availability
+        entry = test_api_availability.main
+    log = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        entry()
+    elapsed = time.perf_counter() - start
+    sources = 0
+    if os.path.exists('config.json'):
+        with open('config.json', 'r', encoding='utf-8') as f:
+            sources = len(json.load(f).get('api_site', {}))
+    print(json.dumps({"elapsed": elapsed, "max_rss_kb": peak_rss_kb(),
+                      "sources": sources}))
+
+
+def spawn(target: str, workdir: str, argv: list, urls: list = ()) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), '--child', target, '--workdir', workdir,
+               '--urls', json.dumps(list(urls)), '--'] + argv
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(label: str, outcome: dict, requests_made: int, bytes_sent: int) -> None:
+    print(f"{label:<34} 耗时 {outcome['elapsed']:7.2f}s  峰值内存 {outcome['max_rss_kb'] / 1024:6.1f} MB  "
+          f"请求数 {requests_made:6d}  传输 {bytes_sent / 1024:8.0f} KB  剩余源 {outcome['sources']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="update_config 与 test_api_availability 的端到端基准")
+    parser.add_argument('--sizes', default='100,500', help="模拟源数量，逗号分隔")
+    parser.add_argument('--concurrency', default='20,200', help="测速并发数，逗号分隔")
+    parser.add_argument('--engine', default='async', help="测速引擎，逗号分隔（async、thread）")
+    parser.add_argument('--timeout', type=float, default=2, help="单次请求超时秒数")
+    parser.add_argument('--upstreams', type=int, default=3, help="上游列表数量（json、list、b58 三种格式轮换）")
+    parser.add_argument('--latency', default='uniform', choices=LATENCY_DISTRIBUTIONS, help="模拟源的延迟分布")
+    parser.add_argument('--slow-drip-rate', type=float, default=0.05, help="慢速滴漏响应体的源比例")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--urls', help=argparse.SUPPRESS)
+    parser.add_argument('extra', nargs='*', help="追加给 test_api_availability 的参数（写在 -- 之后）")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.workdir, args.extra, json.loads(args.urls))
+        return
+
+    sizes = [int(n) for n in args.sizes.split(',')]
+    concurrencies = [int(n) for n in args.concurrency.split(',')]
+    engines = args.engine.split(',')
+    print(f"延迟分布 {args.latency}，单次请求超时 {args.timeout}s，{args.upstreams} 个上游列表")
+
+    for size in sizes:
+        fleet = make_fleet(size, seed=args.seed, slow_drip_rate=args.slow_drip_rate,
+                           latency_distribution=args.latency)
+        server = FleetServer(fleet, blackhole_seconds=args.timeout * 2, upstreams=args.upstreams).start()
+        try:
+            with tempfile.TemporaryDirectory() as base:
+                seed_dir = os.path.join(base, 'update')
+                os.mkdir(seed_dir)
+                for label in ('首次', '无变化'):
+                    before_requests, before_bytes = server.upstream_requests, server.bytes_sent
+                    outcome = spawn('update', seed_dir, [], server.upstream_urls())
+                    report(f"[{size}] update_config ({label})", outcome,
+                           server.upstream_requests - before_requests, server.bytes_sent - before_bytes)
+                with open(os.path.join(seed_dir, 'config.json'), 'rb') as f:
+                    merged = f.read()
+
+                for engine in engines:
+                    for concurrency in concurrencies:
+                        workdir = os.path.join(base, f"{engine}-{concurrency}")
+                        os.mkdir(workdir)
+                        with open(os.path.join(workdir, 'config.json'), 'wb') as f:
+                            f.write(merged)
+                        # 所有模拟源都在 127.0.0.1 下，不做按域名限制，否则测的是限流而不是测速本身
+                        argv = ['--yes', '--no-history', '--no-variant-memory', '--speed-samples', '0',
+                                '--engine', engine, '--concurrency', str(concurrency),
+                                '--timeout', str(args.timeout), '--per-host', '0', '--host-interval', '0'] + args.extra
+                        before_requests, before_bytes = server.request_count, server.bytes_sent
+                        outcome = spawn('probe', workdir, argv)
+                        report(f"[{size}] test_api ({engine}, 并发 {concurrency})", outcome,
+                               server.request_count - before_requests, server.bytes_sent - before_bytes)
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
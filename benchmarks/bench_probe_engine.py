@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+对比线程池测速与 asyncio 异步测速引擎的耗时。
+
+用法: python benchmarks/bench_probe_engine.py --sources 300 --timeout 2
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import probe_engine  # noqa: E402
+from host_scheduler import ConnectionStats  # noqa: E402
+from test_api_availability import test_apis_with_threads  # noqa: E402
+from mock_fleet import FleetServer, make_fleet  # noqa: E402
+
+
+def summarize(label: str, results, elapsed: float, requests_made: int, probe_stats: dict):
+    ok = sum(1 for r in results if r[2])
+    read_kb = sum(stats.get('bytes_read', 0) for stats in probe_stats.values()) / 1024
+    print(f"{label:<10} 耗时 {elapsed:7.2f}s  有效 {ok}/{len(results)}  请求数 {requests_made}  读取 {read_kb:.0f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线程池与异步测速引擎的对比基准")
+    parser.add_argument('--sources', type=int, default=300, help="模拟源数量")
+    parser.add_argument('--timeout', type=float, default=2, help="单次请求超时秒数")
+    parser.add_argument('--concurrency', type=int, default=200, help="异步引擎并发数")
+    parser.add_argument('--hedge', action='store_true', help="异步引擎使用变体竞速模式")
+    # 慢速滴漏的源每次读取都不超时，但整体耗时很长，用来核对两种引擎的超时语义是否一致
+    parser.add_argument('--slow-drip-rate', type=float, default=0.05, help="慢速滴漏响应体的源比例")
+    parser.add_argument('--skip-thread', action='store_true', help="跳过线程池模式")
+    # 所有模拟源都在同一个域名（127.0.0.1）下，默认不做按域名限制，否则测的是限流而不是引擎
+    parser.add_argument('--per-host', type=int, default=0, help="每域名并发上限（0 表示不限制）")
+    parser.add_argument('--host-interval', type=float, default=0, help="同一域名相邻请求的最小间隔秒数")
+    args = parser.parse_args()
+
+    server = FleetServer(make_fleet(args.sources, slow_drip_rate=args.slow_drip_rate), blackhole_seconds=args.timeout * 2).start()
+    apis = {key: value['api'] for key, value in server.api_sites().items()}
+    print(f"模拟源 {len(apis)} 个，单次请求超时 {args.timeout}s")
+
+    try:
+        host_options = dict(per_host=args.per_host, host_interval=args.host_interval)
+        runs = [('async', lambda stats, conn: probe_engine.run_probes(
+            apis, concurrency=args.concurrency, request_timeout=args.timeout, hedge=args.hedge,
+            probe_stats=stats, connection_stats=conn, **host_options))]
+        if not args.skip_thread:
+            runs.append(('thread', lambda stats, conn: test_apis_with_threads(
+                apis, timeout=args.timeout, probe_stats=stats, connection_stats=conn, **host_options)))
+
+        outcomes = {}
+        for label, run in runs:
+            before = server.request_count
+            probe_stats = {}
+            connection_stats = ConnectionStats()
+            start = time.perf_counter()
+            results = run(probe_stats, connection_stats)
+            summarize(label, results, time.perf_counter() - start, server.request_count - before, probe_stats)
+            connection_stats.report(top=0)
+            outcomes[label] = {r[0]: r[2] for r in results}
+
+        if len(outcomes) == 2 and outcomes['async'] != outcomes['thread']:
+            diff = [k for k in outcomes['async'] if outcomes['async'][k] != outcomes['thread'].get(k)]
+            print(f"⚠️ 两种引擎结果不一致: {diff[:10]}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+流式校验与完整解析的一致性核对：同一份响应无论在哪个字节处被网络拆分，
+StreamingValidator 的结论都应与 json.loads + validate_api_response 相同。
+
+- 回归用例：含浮点数与指数的响应在每个字节位置拆成两块、以及逐字节喂入
+- 随机用例：随机生成的合法 JSON 响应（含浮点数、缺字段与错误 code）在随机位置拆分；
+  非法 JSON 不在核对范围内：流式校验得出结论后即停止读取，不会看到其后的语法错误
+
+用法: python benchmarks/bench_stream_validator.py --documents 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from probe_common import validate_api_response  # noqa: E402
+from stream_validator import StreamingValidator  # noqa: E402
+
+REGRESSION_DOCUMENT = ('{"code":1,"msg":"x","total":12.5,"ratio":-0.25,"big":1E+3,"small":2.5e-3,'
+                       '"list":[{"vod_id":1,"vod_name":"a","vod_score":7.5}]}')
+
+
+def expected(text: str) -> bool:
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return False
+    return validate_api_response(data)
+
+
+def streamed(chunks) -> bool:
+    validator = StreamingValidator()
+    for chunk in chunks:
+        if validator.feed(chunk):
+            break
+    validator.close()
+    data = validator.result
+    return data is not None and validate_api_response(data)
+
+
+def random_number(rng: random.Random) -> str:
+    kind = rng.randrange(4)
+    if kind == 0:
+        return str(rng.randint(-10 ** 6, 10 ** 6))
+    if kind == 1:
+        return f"{rng.uniform(-1000, 1000):.{rng.randint(1, 6)}f}"
+    if kind == 2:
+        return f"{rng.randint(1, 9)}.{rng.randint(0, 99)}{rng.choice('eE')}{rng.choice(['', '+', '-'])}{rng.randint(0, 12)}"
+    return str(rng.randint(0, 9))
+
+
+def random_document(rng: random.Random) -> str:
+    fields = []
+    if rng.random() < 0.9:
+        fields.append(f'"code":{rng.choice(["1", "200", "0", "1.0", random_number(rng)])}')
+    for name in rng.sample(['msg', 'page', 'pagecount', 'total', 'limit'], rng.randint(0, 5)):
+        fields.append(f'"{name}":{rng.choice([random_number(rng), json.dumps("文本")])}')
+    items = []
+    for i in range(rng.randint(0, 3)):
+        item = []
+        if rng.random() < 0.9:
+            item.append(f'"{rng.choice(["vod_id", "id"])}":{random_number(rng)}')
+        if rng.random() < 0.9:
+            item.append(f'"{rng.choice(["vod_name", "title"])}":"片名{i}"')
+        item.append(f'"vod_score":{random_number(rng)}')
+        rng.shuffle(item)
+        items.append('{' + ','.join(item) + '}')
+    if rng.random() < 0.9:
+        fields.append('"list":[' + ','.join(items) + ']')
+    rng.shuffle(fields)
+    return '{' + ','.join(fields) + '}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式校验与完整解析的一致性核对")
+    parser.add_argument('--documents', type=int, default=20000, help="随机用例数")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    body = REGRESSION_DOCUMENT.encode('utf-8')
+    failures = [offset for offset in range(1, len(body)) if not streamed([body[:offset], body[offset:]])]
+    if not streamed([body[i:i + 1] for i in range(len(body))]):
+        failures.append('逐字节')
+    print(f"回归用例: {len(body)} 字节，拆分位置 {len(body) - 1} 个，不一致 {len(failures)} 个"
+          + (f" {failures[:10]}" if failures else ""))
+
+    rng = random.Random(args.seed)
+    mismatches = 0
+    start = time.perf_counter()
+    for _ in range(args.documents):
+        text = random_document(rng)
+        data = text.encode('utf-8')
+        cut = sorted(rng.sample(range(1, len(data)), min(2, len(data) - 1))) if len(data) > 1 else []
+        chunks = [data[a:b] for a, b in zip([0] + cut, cut + [len(data)])]
+        if streamed(chunks) != expected(text):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  不一致: {text!r} 拆分于 {cut}")
+    elapsed = time.perf_counter() - start
+    print(f"随机用例: {args.documents} 个，不一致 {mismatches} 个，耗时 {elapsed:.2f}s")
+    if failures or mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
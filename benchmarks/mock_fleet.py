@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟源服务器：在一个 HTTP 服务中模拟 N 个 maccms/mac10 接口，用于离线测速对比。
+
+每个源的路径为 /s{i}/api.php/provide/vod，行为由 make_fleet 按固定随机种子生成：
+- ok: 延迟一段时间后返回合法的 maccms JSON
+- error: 返回 HTTP 500
+- html: 返回 200 但内容是 HTML 页面
+- blackhole: 接受连接后长时间不返回任何内容
+- refused: 指向一个未监听的端口，连接会被直接拒绝
+- list_only: 只有 ac=list 变体返回合法 JSON，其余变体返回 HTML
+- oversized: 忽略 limit 参数，ac=detail 返回带完整播放列表的数 MB 大页面
+- adult: 名称正常，但分类与影片标题都是成人内容
+- slow_drip: 立即返回响应头，响应体每隔 drip_interval 秒才发送 drip_bytes 字节
+- slow_cdn: 接口正常，但视频分片限速为 cdn_rate 字节/秒
+
+接口正常的源在 ac=detail 中附带指向本服务的播放地址 /play/{i}/index.m3u8：偶数编号的源返回
+多码率主列表（子列表为 /play/{i}/720p/index.m3u8），奇数编号的源直接返回分片列表，
+每个分片 /play/{i}/.../seg{n}.ts 为 segment_bytes 字节。
+
+另外可以按 mirror_rate 把部分 ok 源设为之前某个 ok 源的镜像（mirror_of），返回与其完全相同的内容。
+各源的响应延迟按 latency_distribution 抽样：uniform（均匀分布）、lognormal（对数正态，
+中位数为区间的几何平均，上界约为 p95）或 pareto（下界起步的长尾分布）。
+
+同一个服务还提供上游源列表 /upstream/{j}.{json|list|b58}：把所有源轮流分到 upstreams 个列表中，
+每 5 个源中有 1 个同时出现在所有列表里（用于检验合并去重）；json 为 config.json 格式，
+list 为 [{"name", "api"}] 数组格式，b58 为 json 格式的 Base58 编码。响应带 ETag，支持 304。
+
+与真实的 maccms10 一致，除 ac=detail 以外的响应都附带顶层的 class 分类列表。
+
+带 wd 参数的请求按片名搜索 SEARCH_CATALOG：每个源收录其中一部分影片，部分源的片名带有
+"(国语)"、"[HD]" 之类的后缀，用于检验跨源合并搜索结果。
+"""
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from base58_codec import b58encode  # noqa: E402
+
+# 未监听的本地端口，用于模拟拒绝连接
+REFUSED_PORT = 9
+
+# 模拟的分类列表与影片标题
+NORMAL_CLASSES = ['电影', '连续剧', '综艺', '动漫', '动作片', '喜剧片', '国产剧', '纪录片']
+ADULT_CLASSES = ['国产自拍', '日本无码', '中文字幕', '人妻熟女', '巨乳美乳', '探花系列']
+ADULT_TITLES = ['素人无码流出', '人妻偷拍实录', '巨乳女优合集', '探花约啪', '国产自拍泄露']
+
+LATENCY_DISTRIBUTIONS = ('uniform', 'lognormal', 'pareto')
+UPSTREAM_FORMATS = ('json', 'list', 'b58')
+# pareto 分布的形状参数（1.16 即常说的 80/20）与抽样上限（秒）
+PARETO_ALPHA = 1.16
+MAX_LATENCY = 60
+# 搜索用的片库：(片名, 年份)
+SEARCH_CATALOG = [('流浪地球', 2019), ('流浪地球2', 2023), ('三体', 2023), ('狂飙', 2023),
+                  ('繁花', 2023), ('庆余年', 2019), ('庆余年第二季', 2024), ('封神第一部', 2023)]
+# 每个模拟播放列表中的分片数
+PLAYLIST_SEGMENTS = 5
+
+
+def sample_latency(rng: random.Random, distribution: str, low: float, high: float) -> float:
+    """
+    按指定分布抽样一个响应延迟（秒）
+    """
+    if distribution == 'uniform':
+        return rng.uniform(low, high)
+    if distribution == 'lognormal':
+        median = math.sqrt(max(low, 1e-3) * high)
+        sigma = math.log(high / median) / 1.645
+        return min(rng.lognormvariate(math.log(median), sigma), MAX_LATENCY)
+    if distribution == 'pareto':
+        return min(max(low, 1e-3) * rng.paretovariate(PARETO_ALPHA), MAX_LATENCY)
+    raise ValueError(f"未知的延迟分布: {distribution}")
+
+
+def make_fleet(size: int, seed: int = 0, error_rate: float = 0.1, html_rate: float = 0.05,
+               blackhole_rate: float = 0.05, refused_rate: float = 0.05, list_only_rate: float = 0.1,
+               oversized_rate: float = 0.05, adult_rate: float = 0.0, mirror_rate: float = 0.0,
+               slow_drip_rate: float = 0.0, slow_cdn_rate: float = 0.0, latency: Tuple[float, float] = (0.02, 0.3),
+               latency_distribution: str = 'uniform') -> Dict[int, dict]:
+    """
+    生成模拟源的行为表：{源编号: {"kind": ..., "latency": 秒}}
+    """
+    rng = random.Random(seed)
+    rates = [
+        ('blackhole', blackhole_rate),
+        ('refused', refused_rate),
+        ('error', error_rate),
+        ('html', html_rate),
+        ('list_only', list_only_rate),
+        ('oversized', oversized_rate),
+        ('adult', adult_rate),
+        ('slow_drip', slow_drip_rate),
+        ('slow_cdn', slow_cdn_rate),
+    ]
+    fleet = {}
+    for i in range(size):
+        roll = rng.random()
+        kind = 'ok'
+        for candidate, rate in rates:
+            if roll < rate:
+                kind = candidate
+                break
+            roll -= rate
+        fleet[i] = {"kind": kind, "latency": sample_latency(rng, latency_distribution, *latency)}
+    if mirror_rate > 0:
+        # 使用独立的随机序列，保证同一种子下其余行为与不设镜像时一致
+        mirror_rng = random.Random(seed + 1)
+        originals = []
+        for i, spec in fleet.items():
+            if spec['kind'] != 'ok':
+                continue
+            if originals and mirror_rng.random() < mirror_rate:
+                spec['mirror_of'] = mirror_rng.choice(originals)
+            else:
+                originals.append(i)
+    return fleet
+
+
+def maccms_payload(index: int, count: int = 1, play_url_length: int = 0,
+                   adult: bool = False, with_class: bool = False, play_base: Optional[str] = None) -> dict:
+    """
+    构造一个 maccms 风格的列表响应，play_url_length 大于 0 时附带对应长度的播放地址列表；
+    adult 为 True 时使用成人分类与标题，with_class 为 True 时附带顶层 class 分类列表；
+    给出 play_base 时附带指向 {play_base}/play/{index}/index.m3u8 的播放地址
+    """
+    classes = ADULT_CLASSES if adult else NORMAL_CLASSES
+    play_url = '#'.join(f"第{n:02d}集$https://cdn.example.com/{index}/{n}/index.m3u8"
+                        for n in range(play_url_length // 48 + 1))[:play_url_length]
+    if play_base:
+        play_url = f"正片${play_base}/play/{index}/index.m3u8"
+    payload = {
+        "code": 1,
+        "msg": "数据列表",
+        "page": 1,
+        "pagecount": 100,
+        "limit": str(count),
+        "total": 100 * count,
+        "list": [
+            {"vod_id": index * 1000 + n,
+             "vod_name": ADULT_TITLES[n % len(ADULT_TITLES)] if adult else f"测试影片{index}-{n}",
+             "type_name": classes[n % len(classes)],
+             **({"vod_play_url": play_url} if play_url else {})}
+            for n in range(count)
+        ],
+    }
+    if with_class:
+        payload["class"] = [{"type_id": n + 1, "type_name": name} for n, name in enumerate(classes)]
+    return payload
+
+
+def search_payload(index: int, keyword: str, play_base: Optional[str] = None) -> dict:
+    """
+    第 index 个源对关键词 keyword 的搜索结果：源 i 收录片库中满足 (i + n) % 3 != 0 的第 n 部影片，
+    i % 4 为 1、2 时片名分别带 " (国语)" 与 "[HD]" 后缀
+    """
+    suffix = {1: ' (国语)', 2: '[HD]'}.get(index % 4, '')
+    items = []
+    for n, (title, year) in enumerate(SEARCH_CATALOG):
+        if (index + n) % 3 == 0 or keyword not in title:
+            continue
+        item = {"vod_id": index * 1000 + n, "vod_name": title + suffix, "vod_year": str(year),
+                "type_name": NORMAL_CLASSES[n % len(NORMAL_CLASSES)]}
+        if play_base:
+            item["vod_play_url"] = f"正片${play_base}/play/{index}/index.m3u8"
+        items.append(item)
+    return {"code": 1, "msg": "数据列表", "page": 1, "pagecount": 1, "limit": "20",
+            "total": len(items), "list": items}
+
+
+class FleetHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        parts = parsed.path.strip('/').split('/')
+        if parts[0] == 'upstream' and len(parts) == 2:
+            self.send_upstream(parts[1])
+            return
+        if parts[0] == 'play':
+            self.send_play(parts[1:])
+            return
+        try:
+            index = int(parts[0][1:])
+            spec = server.fleet[index]
+        except (IndexError, ValueError, KeyError):
+            self.send_body(404, b'not found', 'text/plain')
+            return
+
+        if spec['kind'] == 'blackhole':
+            time.sleep(server.blackhole_seconds)
+            self.close_connection = True
+            return
+
+        time.sleep(spec['latency'])
+        if spec['kind'] == 'error':
+            self.send_body(500, b'internal error', 'text/plain')
+        elif spec['kind'] == 'html' or (spec['kind'] == 'list_only' and query.get('ac') != ['list']):
+            self.send_body(200, b'<html><body>404 Not Found</body></html>', 'text/html')
+        elif spec['kind'] == 'oversized' and query.get('ac') == ['detail']:
+            self.send_body(200, server.oversized_body(index), 'application/json; charset=utf-8')
+        elif spec['kind'] == 'slow_drip':
+            body = json.dumps(maccms_payload(index, with_class=query.get('ac') != ['detail']),
+                              ensure_ascii=False).encode('utf-8')
+            self.send_drip(body)
+        elif 'wd' in query:
+            payload = search_payload(spec.get('mirror_of', index), query['wd'][0], server.base_url)
+            self.send_body(200, json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+        else:
+            # limit 默认为 1；与 maccms10 一致，ac=detail 不返回 class
+            try:
+                count = max(1, min(int(query.get('limit', ['1'])[0]), 20))
+            except ValueError:
+                count = 1
+            payload = maccms_payload(spec.get('mirror_of', index), count, adult=spec['kind'] == 'adult',
+                                     with_class=query.get('ac') != ['detail'],
+                                     play_base=server.base_url if query.get('ac') == ['detail'] else None)
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_body(200, body, 'application/json; charset=utf-8')
+
+    def send_upstream(self, filename: str):
+        server = self.server
+        name, _, fmt = filename.partition('.')
+        try:
+            body = server.upstream_body(int(name), fmt)
+        except (ValueError, KeyError):
+            self.send_body(404, b'not found', 'text/plain')
+            return
+        with server.lock:
+            server.upstream_requests += 1
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_body(200, body, 'text/plain; charset=utf-8', {'ETag': etag})
+
+    def send_play(self, parts: List[str]):
+        """
+        /play/{i}/index.m3u8、/play/{i}/720p/index.m3u8 与 /play/{i}/[720p/]seg{n}.ts
+        """
+        server = self.server
+        try:
+            spec = server.fleet[int(parts[0])]
+        except (IndexError, ValueError, KeyError):
+            self.send_body(404, b'not found', 'text/plain')
+            return
+        index, filename = int(parts[0]), parts[-1]
+        with server.lock:
+            server.play_requests += 1
+        time.sleep(spec['latency'])
+        if filename == 'index.m3u8':
+            if index % 2 == 0 and len(parts) == 2:
+                body = "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1500000,RESOLUTION=1280x720\n720p/index.m3u8\n"
+            else:
+                body = "#EXTM3U\n#EXT-X-TARGETDURATION:6\n" + "".join(
+                    f"#EXTINF:6.0,\nseg{n}.ts\n" for n in range(PLAYLIST_SEGMENTS)) + "#EXT-X-ENDLIST\n"
+            self.send_body(200, body.encode('utf-8'), 'application/vnd.apple.mpegurl')
+        elif filename.startswith('seg') and filename.endswith('.ts'):
+            body = bytes(server.segment_bytes)
+            if spec['kind'] == 'slow_cdn':
+                self.send_throttled(body, server.cdn_rate)
+            else:
+                self.send_body(200, body, 'video/mp2t')
+        else:
+            self.send_body(404, b'not found', 'text/plain')
+
+    def send_throttled(self, body: bytes, rate: int):
+        """
+        以约 rate 字节/秒的速度发送响应体
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp2t')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        step = max(rate // 10, 1)
+        sent = 0
+        try:
+            for offset in range(0, len(body), step):
+                self.wfile.write(body[offset:offset + step])
+                self.wfile.flush()
+                sent += len(body[offset:offset + step])
+                time.sleep(0.1)
+        finally:
+            with self.server.lock:
+                self.server.bytes_sent += sent
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        finally:
+            with self.server.lock:
+                self.server.bytes_sent += len(body)
+
+    def send_drip(self, body: bytes):
+        """
+        先发送响应头，再按 drip_bytes / drip_interval 的速度逐段发送响应体
+        """
+        server = self.server
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.flush()
+        sent = 0
+        try:
+            for offset in range(0, len(body), server.drip_bytes):
+                chunk = body[offset:offset + server.drip_bytes]
+                self.wfile.write(chunk)
+                self.wfile.flush()
+                sent += len(chunk)
+                time.sleep(server.drip_interval)
+        finally:
+            with server.lock:
+                server.bytes_sent += sent
+
+
+class FleetServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, fleet: Dict[int, dict], blackhole_seconds: float = 30, host: str = '127.0.0.1', port: int = 0,
+                 drip_bytes: int = 16, drip_interval: float = 0.2, upstreams: int = 3,
+                 segment_bytes: int = 512 * 1024, cdn_rate: int = 64 * 1024):
+        super().__init__((host, port), FleetHandler)
+        self.fleet = fleet
+        self.blackhole_seconds = blackhole_seconds
+        self.drip_bytes = drip_bytes
+        self.drip_interval = drip_interval
+        self.upstreams = upstreams
+        self.segment_bytes = segment_bytes
+        self.cdn_rate = cdn_rate
+        self.request_count = 0
+        self.play_requests = 0
+        self.upstream_requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self._oversized_cache: Dict[int, bytes] = {}
+        self._upstream_cache: Dict[Tuple[int, str], bytes] = {}
+
+    def oversized_body(self, index: int) -> bytes:
+        """
+        约 5 MB 的 ac=detail 页面（200 条，每条带 25 KB 播放地址），按源缓存
+        """
+        with self.lock:
+            if index not in self._oversized_cache:
+                payload = maccms_payload(index, count=200, play_url_length=25000)
+                self._oversized_cache[index] = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            return self._oversized_cache[index]
+
+    def upstream_body(self, index: int, fmt: str) -> bytes:
+        """
+        第 index 个上游列表的响应体，按 (index, fmt) 缓存
+        """
+        if not 0 <= index < self.upstreams or fmt not in UPSTREAM_FORMATS:
+            raise KeyError((index, fmt))
+        with self.lock:
+            if (index, fmt) not in self._upstream_cache:
+                sites = {key: site for n, (key, site) in enumerate(self.api_sites().items())
+                         if n % self.upstreams == index or n % 5 == 0}
+                if fmt == 'list':
+                    data = [{"name": site['name'], "api": site['api'], "key": key} for key, site in sites.items()]
+                else:
+                    data = {"cache_time": 7200, "api_site": sites}
+                text = json.dumps(data, ensure_ascii=False)
+                self._upstream_cache[(index, fmt)] = (b58encode(text.encode('utf-8')) if fmt == 'b58' else text).encode('utf-8')
+            return self._upstream_cache[(index, fmt)]
+
+    def upstream_urls(self, formats=UPSTREAM_FORMATS) -> List[str]:
+        """
+        所有上游列表的 URL，格式依次轮换
+        """
+        return [f"{self.base_url}/upstream/{j}.{formats[j % len(formats)]}" for j in range(self.upstreams)]
+
+    def handle_error(self, request, client_address):
+        # 客户端主动断开（竞速取消、超时）属于预期行为，不打印堆栈
+        pass
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def api_sites(self) -> Dict[str, dict]:
+        """
+        以 config.json 中 api_site 的格式返回所有模拟源
+        """
+        host = self.server_address[0]
+        sites = {}
+        for i, spec in self.fleet.items():
+            base_url = f"http://{host}:{REFUSED_PORT}" if spec['kind'] == 'refused' else self.base_url
+            sites[f"mock{i}"] = {
+                "api": f"{base_url}/s{i}/api.php/provide/vod",
+                "name": f"模拟源{i}",
+                "detail": base_url,
+            }
+        return sites
+
+    def start(self) -> 'FleetServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
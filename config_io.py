@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+配置文件读写工具。
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Iterable, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def write_text_atomic(path: str, text: str) -> None:
+    """
+    原子写入文本：先写入同目录下的临时文件，再用 os.replace 替换目标文件，
+    写入中途失败或被中断时不会留下半截文件
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        # mkstemp 创建的文件权限为 0600，改为常规的 0644
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def write_json_atomic(path: str, data, indent: Optional[int] = 4) -> None:
+    """
+    原子写入 JSON，见 write_text_atomic
+    """
+    write_text_atomic(path, json.dumps(data, ensure_ascii=False, indent=indent))
+
+
+def write_bytes_atomic(path: str, data: bytes) -> None:
+    """
+    原子写入二进制内容，见 write_text_atomic
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+# --- 发布产物 ---
+# 每个配置文件 config.json 旁边生成:
+#   config.min.json                 紧凑格式，客户端启动时下载这个更省流量
+#   config.min.json.gz / .br        预压缩版本（.br 需要安装 brotli）
+#   config.patch.json               与上一次发布相比新增、删除、改动的源
+# 以及记录所有文件大小、sha256 与 ETag 的 manifest.json
+MANIFEST_FILE = 'manifest.json'
+
+
+def canonical_json(config: dict) -> str:
+    """
+    规范化序列化：所有键排序、无多余空白，只取决于内容本身，与源的排列顺序无关
+    """
+    return json.dumps(config, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def content_hash(config: dict) -> str:
+    return hashlib.sha256(canonical_json(config).encode('utf-8')).hexdigest()
+
+
+def ordered_config(config: dict) -> dict:
+    """
+    固定键顺序：顶层字段与每个源的字段按字母排序；api_site 中源的先后保持不变（可能是按延迟排好的）
+    """
+    ordered = {key: config[key] for key in sorted(config) if key != 'api_site'}
+    if 'api_site' in config:
+        ordered['api_site'] = {name: {field: details[field] for field in sorted(details)} if isinstance(details, dict)
+                               else details for name, details in config['api_site'].items()}
+    return {key: ordered[key] for key in sorted(ordered)}
+
+
+def config_patch(previous: dict, current: dict) -> dict:
+    """
+    两次发布之间的差异：added / changed 给出源的完整内容，removed 只给键名，
+    other 为 api_site 以外发生变化的顶层字段
+    """
+    before, after = previous.get('api_site', {}), current.get('api_site', {})
+    patch = {
+        "base": content_hash(previous),
+        "target": content_hash(current),
+        "added": {name: after[name] for name in after if name not in before},
+        "removed": [name for name in before if name not in after],
+        "changed": {name: after[name] for name in after
+                    if name in before and canonical_json(after[name]) != canonical_json(before[name])},
+    }
+    other = {key: current.get(key) for key in sorted(set(previous) | set(current))
+             if key != 'api_site' and previous.get(key) != current.get(key)}
+    if other:
+        patch['other'] = other
+    return patch
+
+
+def artifact_paths(path: str) -> Dict[str, str]:
+    stem = path[:-len('.json')] if path.endswith('.json') else path
+    return {
+        "full": path,
+        "min": f"{stem}.min.json",
+        "gzip": f"{stem}.min.json.gz",
+        "brotli": f"{stem}.min.json.br",
+        "patch": f"{stem}.patch.json",
+    }
+
+
+def load_json_or_none(path: str) -> Optional[dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def artifacts_complete(path: str, config: dict, manifest_path: str = MANIFEST_FILE) -> bool:
+    """
+    manifest 中已记录该配置文件的当前内容，且记录的产物与紧凑格式、预压缩版本都存在于磁盘上
+    """
+    manifest = load_json_or_none(manifest_path) or {}
+    entry = manifest.get(os.path.basename(path))
+    if not isinstance(entry, dict) or entry.get('content_hash') != content_hash(config):
+        return False
+    paths = artifact_paths(path)
+    directory = os.path.dirname(path)
+    required = [paths['min'], paths['gzip']] + ([paths['brotli']] if brotli is not None else [])
+    listed = [os.path.join(directory, item['path']) for item in entry.get('files', {}).values()
+              if isinstance(item, dict) and 'path' in item]
+    return all(os.path.exists(artifact) for artifact in required + listed)
+
+
+def publish_config(path: str, config: dict, manifest_path: str = MANIFEST_FILE) -> bool:
+    """
+    写出配置文件及其发布产物，返回是否有改动。规范化内容（见 canonical_json）与现有文件相同、
+    且 manifest 记录的产物齐全时不改写任何文件，仅源的排列顺序变化不会产生新提交；
+    产物缺失时（如首次发布）按现有内容补齐，差异补丁只在内容变化时重新生成
+    """
+    previous = load_json_or_none(path)
+    unchanged = previous is not None and content_hash(previous) == content_hash(config)
+    if unchanged and artifacts_complete(path, config, manifest_path):
+        print(f"内容未变化，保留现有的 '{path}'")
+        return False
+
+    paths = artifact_paths(path)
+    config = ordered_config(config)
+    minified = json.dumps(config, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    write_json_atomic(paths['full'], config)
+    write_bytes_atomic(paths['min'], minified)
+    # mtime=0 使相同内容压缩出的字节完全一致
+    write_bytes_atomic(paths['gzip'], gzip.compress(minified, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_bytes_atomic(paths['brotli'], brotli.compress(minified, quality=11))
+    if previous is not None and not unchanged:
+        write_json_atomic(paths['patch'], config_patch(previous, config), indent=None)
+    return True
+
+
+def file_entry(path: str) -> dict:
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    return {"size": len(data), "sha256": digest, "etag": f'"{digest[:32]}"'}
+
+
+def write_manifest(paths: Iterable[str], manifest_path: str = MANIFEST_FILE) -> None:
+    """
+    为每个配置文件记录规范化内容哈希、源数量以及各发布产物的大小、sha256 与 ETag；
+    内容完全不变时不改写 manifest
+    """
+    manifest = {}
+    for path in paths:
+        config = load_json_or_none(path)
+        if config is None:
+            continue
+        entry = {"content_hash": content_hash(config), "sources": len(config.get('api_site', {})), "files": {}}
+        for kind, artifact in artifact_paths(path).items():
+            if os.path.exists(artifact):
+                entry['files'][kind] = dict(file_entry(artifact), path=os.path.basename(artifact))
+        manifest[os.path.basename(path)] = entry
+    if load_json_or_none(manifest_path) != manifest:
+        write_json_atomic(manifest_path, manifest)
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+常驻健康检查服务：持续在后台重新探测各个源，并通过 HTTP 提供实时的 config.json 与 config18.json。
+
+每日一次的定时任务中，凌晨失效的源要在配置里留到第二天，恢复的源也要等到下一次运行才会加回来。
+本服务复用流水线的拉取、探测与分类函数，在内存中维护每个源的健康状态：
+
+- 调度：每个源按波动程度安排下一次探测，状态反复变化的源探测得更勤，长期稳定的源间隔接近 --interval；
+  间隔带 ±jitter 的随机抖动，避免所有源在同一时刻集中探测；正在提供的源失败后按 --min-interval 尽快复查
+- 增删：连续失败达到 --remove-after 次才从文档中移除，成功一次即重新加入
+- 增量重建：每个源在文档中的片段单独序列化并缓存，健康状态变化时只替换这一个片段，
+  文档在下一次被请求时拼接一次并计算 ETag 与 gzip 压缩版本
+- 上游：每隔 --upstream-interval 秒重新拉取上游（带 ETag 缓存），源列表变化时新源立即探测
+
+接口：GET /config.json、/config18.json（支持 If-None-Match/304 与 gzip）、/health（各源状态）
+
+用法: python health_daemon.py --port 8080
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import random
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from aiohttp import web
+
+import probe_engine
+from config_io import canonical_json
+from host_scheduler import DEFAULT_PER_HOST
+from probe_common import REQUEST_TIMEOUT
+from separate_sources import ADULT_OUTPUT_FILE, NORMAL_OUTPUT_FILE, classify_source
+from source_index import canonical_api_url, remove_duplicate_apis
+from update_config import URLS_TO_FETCH, UpstreamCache, fetch_all_upstreams, merge_configs
+
+# 计算波动程度时参考的最近探测次数
+VOLATILITY_WINDOW = 10
+# 探测循环空闲时最长的等待秒数（新源加入或间隔调整后不至于等太久）
+MAX_IDLE = 30
+
+
+class SourceHealth:
+    """
+    单个源的健康状态
+    """
+
+    def __init__(self, key: str, details: dict):
+        self.key = key
+        self.details = details
+        self.serving = False
+        self.failures = 0
+        self.outcomes = deque(maxlen=VOLATILITY_WINDOW)
+        self.last_checked: Optional[float] = None
+        self.next_due = 0.0
+        self.latency: Optional[float] = None
+        self.digest: Optional[dict] = None
+        self.adult = bool(classify_source(key, details))
+
+    @property
+    def api(self) -> str:
+        return self.details['api']
+
+    @property
+    def volatility(self) -> float:
+        """
+        最近几次探测中结果翻转的比例，做了加一平滑：探测次数少时取中间值，结果一直不变时趋近 0
+        """
+        outcomes = list(self.outcomes)
+        flips = sum(1 for a, b in zip(outcomes, outcomes[1:]) if a != b)
+        return (flips + 1) / (len(outcomes) + 1)
+
+    def status(self) -> dict:
+        return {
+            "serving": self.serving,
+            "adult": self.adult,
+            "failures": self.failures,
+            "volatility": round(self.volatility, 2),
+            "latency_ms": round(self.latency * 1000) if self.latency is not None else None,
+            "last_checked": self.last_checked,
+            "next_due": round(self.next_due),
+        }
+
+
+class ServedDocument:
+    """
+    对外提供的一份配置文件。每个源的 JSON 片段单独缓存，增删一个源只改动一个片段；
+    完整内容、ETag 与 gzip 版本在内容变化后的第一次请求时生成
+    """
+
+    def __init__(self, template: dict):
+        self.template = {key: value for key, value in template.items() if key != 'api_site'}
+        self.entries: Dict[str, str] = {}
+        self.version = 0
+        self._body: Optional[bytes] = None
+        self._gzipped: Optional[bytes] = None
+        self._etag = ''
+
+    def put(self, key: str, details: dict) -> bool:
+        fragment = f"{json.dumps(key, ensure_ascii=False)}:{canonical_json(details)}"
+        if self.entries.get(key) == fragment:
+            return False
+        self.entries[key] = fragment
+        self._invalidate()
+        return True
+
+    def discard(self, key: str) -> bool:
+        if self.entries.pop(key, None) is None:
+            return False
+        self._invalidate()
+        return True
+
+    def _invalidate(self) -> None:
+        self.version += 1
+        self._body = self._gzipped = None
+
+    def render(self) -> Tuple[bytes, str]:
+        """
+        返回 (完整内容, ETag)；键顺序与 config_io.canonical_json 一致，api_site 中的源按加入顺序排列
+        """
+        if self._body is None:
+            sections = {key: canonical_json(value) for key, value in self.template.items()}
+            sections['api_site'] = '{' + ','.join(self.entries.values()) + '}'
+            text = '{' + ','.join(f"{json.dumps(key)}:{sections[key]}" for key in sorted(sections)) + '}'
+            self._body = text.encode('utf-8')
+            self._etag = f'"{hashlib.sha256(self._body).hexdigest()[:32]}"'
+        return self._body, self._etag
+
+    def gzipped(self) -> bytes:
+        body, _ = self.render()
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        return self._gzipped
+
+
+class HealthDaemon:
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random()
+        self.sources: Dict[str, SourceHealth] = {}
+        self.template: dict = {}
+        self.documents: Dict[str, ServedDocument] = {}
+        self.cache = UpstreamCache()
+        self.upstream_refreshed: Optional[float] = None
+
+    # --- 源列表 ---
+
+    def fetch_universe(self) -> Optional[dict]:
+        """
+        拉取并合并上游，返回去重后的配置；没有任何上游变化或全部失败时返回 None（阻塞调用）
+        """
+        fetched = fetch_all_upstreams(self.args.upstream, self.cache)
+        contents = [content for content, _ in fetched if content]
+        if not contents or (self.sources and not any(changed for _, changed in fetched)):
+            return None
+        config, _ = remove_duplicate_apis(merge_configs(contents))
+        return config
+
+    def load_universe(self, config: dict, seed: Optional[set] = None) -> None:
+        """
+        用新的源列表替换当前列表：规范化 API 链接相同的源沿用已有的健康状态，新源立即探测；
+        seed 为初始时视为可用的规范化 API 链接（来自磁盘上现有的配置文件）。源列表很少变化，这里整体重建文档
+        """
+        previous = {canonical_api_url(health.api): health for health in self.sources.values()}
+        sources = {}
+        now = time.time()
+        for key, details in config.get('api_site', {}).items():
+            if not isinstance(details, dict) or not isinstance(details.get('api'), str):
+                continue
+            canonical = canonical_api_url(details['api'])
+            health = previous.get(canonical)
+            if health is None:
+                health = SourceHealth(key, details)
+                if seed and canonical in seed:
+                    # 上一次发布中可用的源先照常提供，在最短间隔内陆续复查
+                    health.serving = True
+                    health.next_due = now + self.rng.uniform(0, self.args.min_interval)
+            else:
+                health.key, health.details = key, details
+                health.adult = bool(classify_source(key, details, health.digest))
+            sources[key] = health
+        added = len(set(sources) - set(self.sources))
+        removed = len(set(self.sources) - set(sources))
+        self.sources = sources
+        self.template = {k: v for k, v in config.items() if k != 'api_site'}
+        self.documents = {NORMAL_OUTPUT_FILE: ServedDocument(self.template),
+                          ADULT_OUTPUT_FILE: ServedDocument(self.template)}
+        for health in self.sources.values():
+            self.publish(health)
+        print(f"📋 源列表已更新: 共 {len(sources)} 个源（新增 {added}，移除 {removed}），"
+              f"当前提供 {sum(1 for h in sources.values() if h.serving)} 个")
+
+    async def refresh_upstreams(self) -> None:
+        while True:
+            await asyncio.sleep(self.args.upstream_interval)
+            try:
+                config = await asyncio.to_thread(self.fetch_universe)
+            except Exception as e:
+                print(f"⚠️ 拉取上游失败，沿用当前源列表: {e}")
+                continue
+            self.upstream_refreshed = time.time()
+            if config is not None:
+                self.load_universe(config)
+
+    # --- 探测与调度 ---
+
+    def next_interval(self, health: SourceHealth) -> float:
+        """
+        下一次探测的间隔：正在提供却失败了的源按最短间隔复查，其余按波动程度在最短与最长间隔之间插值，再加随机抖动
+        """
+        args = self.args
+        if health.serving and health.failures:
+            interval = args.min_interval
+        else:
+            interval = args.interval - (args.interval - args.min_interval) * health.volatility
+        return interval * self.rng.uniform(1 - args.jitter, 1 + args.jitter)
+
+    def publish(self, health: SourceHealth) -> bool:
+        """
+        把单个源的状态同步到对外的文档中，返回文档是否有变化
+        """
+        normal, adult = self.documents[NORMAL_OUTPUT_FILE], self.documents[ADULT_OUTPUT_FILE]
+        target, other = (adult, normal) if health.adult else (normal, adult)
+        changed = other.discard(health.key)
+        if health.serving:
+            changed = target.put(health.key, health.details) or changed
+        else:
+            changed = target.discard(health.key) or changed
+        return changed
+
+    def apply_result(self, health: SourceHealth, ok: bool, stats: dict, now: float) -> None:
+        first_probe = health.last_checked is None
+        health.outcomes.append(ok)
+        health.last_checked = now
+        health.latency = stats.get('elapsed') if ok else health.latency
+        if ok:
+            health.failures = 0
+            if 'digest' in stats:
+                health.digest = stats['digest']
+                health.adult = bool(classify_source(health.key, health.details, health.digest))
+            if not health.serving:
+                health.serving = True
+                print(f"✅ [{health.key}] {'验证可用，加入' if first_probe else '恢复可用，重新加入'}")
+        else:
+            health.failures += 1
+            if health.serving and health.failures >= self.args.remove_after:
+                health.serving = False
+                print(f"❌ [{health.key}] 连续失败 {health.failures} 次，暂时移除")
+        health.next_due = now + self.next_interval(health)
+        self.publish(health)
+
+    async def probe_due(self) -> int:
+        """
+        探测所有已到期的源（每批最多 --batch 个），返回本批探测的源数
+        """
+        now = time.time()
+        due = sorted((h for h in self.sources.values() if h.next_due <= now), key=lambda h: h.next_due)
+        due = due[:self.args.batch]
+        if not due:
+            return 0
+        by_key = {health.key: health for health in due}
+        probe_stats: Dict[str, dict] = {}
+        results = await probe_engine.probe_all(
+            {health.key: health.api for health in due},
+            concurrency=self.args.concurrency,
+            request_timeout=self.args.timeout,
+            probe_timeout=self.args.timeout * 3,
+            probe_stats=probe_stats,
+            collect_digest=True,
+            per_host=self.args.per_host
+        )
+        now = time.time()
+        for name, _, ok, _, _ in results:
+            # 探测期间上游刷新可能替换了源列表，只更新仍然存在的源
+            health = by_key[name]
+            if self.sources.get(health.key) is health:
+                self.apply_result(health, ok, probe_stats.get(name, {}), now)
+        failed = sum(1 for r in results if not r[2])
+        print(f"🔁 探测 {len(results)} 个源，失败 {failed} 个；当前提供 "
+              f"{len(self.documents[NORMAL_OUTPUT_FILE].entries)} 个正常源、"
+              f"{len(self.documents[ADULT_OUTPUT_FILE].entries)} 个成人源")
+        return len(results)
+
+    async def probe_loop(self) -> None:
+        while True:
+            try:
+                probed = await self.probe_due()
+            except Exception as e:
+                print(f"⚠️ 探测出错: {e}")
+                probed = 0
+            if probed:
+                continue
+            upcoming = min((h.next_due for h in self.sources.values()), default=time.time() + MAX_IDLE)
+            await asyncio.sleep(min(max(upcoming - time.time(), 0.5), MAX_IDLE))
+
+    # --- HTTP 接口 ---
+
+    async def serve_document(self, request: web.Request) -> web.Response:
+        document = self.documents.get(request.match_info['name'])
+        if document is None:
+            raise web.HTTPNotFound()
+        body, etag = document.render()
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if_none_match = request.headers.get('If-None-Match', '')
+        if if_none_match.strip() == '*' or etag in (tag.strip() for tag in if_none_match.split(',')):
+            return web.Response(status=304, headers=headers)
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            body = document.gzipped()
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        return web.Response(body=body, headers=headers)
+
+    async def serve_health(self, request: web.Request) -> web.Response:
+        status = {
+            "sources": len(self.sources),
+            "serving": {name: len(document.entries) for name, document in self.documents.items()},
+            "versions": {name: document.version for name, document in self.documents.items()},
+            "upstream_refreshed": self.upstream_refreshed,
+            "source_status": {key: health.status() for key, health in self.sources.items()},
+        }
+        return web.json_response(status, dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/health', self.serve_health)
+        app.router.add_get('/{name:config(18)?\\.json}', self.serve_document)
+        return app
+
+    async def run(self) -> None:
+        print("--- 启动健康检查服务：拉取上游 ---")
+        config = await asyncio.to_thread(self.fetch_universe)
+        if config is None:
+            print("错误: 所有上游均无法获取，无法启动。")
+            return
+        self.upstream_refreshed = time.time()
+        self.load_universe(config, load_seed())
+
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, self.args.host, self.args.port).start()
+        print(f"🌐 正在 http://{self.args.host}:{self.args.port}/ 提供 {NORMAL_OUTPUT_FILE} 与 {ADULT_OUTPUT_FILE}")
+        try:
+            await asyncio.gather(self.probe_loop(), self.refresh_upstreams())
+        finally:
+            await runner.cleanup()
+
+
+def load_seed(paths: Tuple[str, ...] = (NORMAL_OUTPUT_FILE, ADULT_OUTPUT_FILE)) -> set:
+    """
+    磁盘上现有配置文件中各源的规范化 API 链接，启动时先把它们视为可用
+    """
+    seed = set()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                sites = json.load(f).get('api_site', {})
+        except (OSError, ValueError) as e:
+            print(f"警告: 读取 {path} 失败，忽略: {e}")
+            continue
+        seed.update(canonical_api_url(site['api']) for site in sites.values()
+                    if isinstance(site, dict) and isinstance(site.get('api'), str))
+    return seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻服务：持续探测各个源，并通过 HTTP 提供实时的配置文件。")
+    parser.add_argument('--host', default='0.0.0.0', help="监听地址（默认 0.0.0.0）。")
+    parser.add_argument('--port', type=int, default=8080, help="监听端口（默认 8080）。")
+    parser.add_argument('--upstream', action='append', default=None,
+                        help="上游源列表地址，可重复指定（默认使用 update_config.py 中的列表）。")
+    parser.add_argument('--interval', type=float, default=1800,
+                        help="稳定的源两次探测的间隔秒数（默认 1800）。")
+    parser.add_argument('--min-interval', type=float, default=120,
+                        help="状态反复变化、或正在提供却失败了的源两次探测的间隔秒数（默认 120）。")
+    parser.add_argument('--jitter', type=float, default=0.2, help="探测间隔的随机抖动比例（默认 0.2）。")
+    parser.add_argument('--remove-after', type=int, default=2,
+                        help="正在提供的源连续失败达到该次数才移除（默认 2）。")
+    parser.add_argument('--upstream-interval', type=float, default=6 * 3600,
+                        help="重新拉取上游的间隔秒数（默认 21600）。")
+    parser.add_argument('--batch', type=int, default=200, help="每批最多探测的源数（默认 200）。")
+    parser.add_argument('--concurrency', type=int, default=50, help="最大并发探测数（默认 50）。")
+    parser.add_argument('--timeout', type=float, default=REQUEST_TIMEOUT,
+                        help=f"单次请求超时秒数（默认 {REQUEST_TIMEOUT}）。")
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST,
+                        help=f"同一域名最多同时在测的源数（默认 {DEFAULT_PER_HOST}，0 表示不限制）。")
+    args = parser.parse_args()
+    args.upstream = args.upstream or URLS_TO_FETCH
+
+    try:
+        asyncio.run(HealthDaemon(args).run())
+    except KeyboardInterrupt:
+        print("\n已停止")
+
+
+if __name__ == "__main__":
+    main()
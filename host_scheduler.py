@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+按域名调度测速请求：同一域名下的请求复用长连接、限制并发并保持最小间隔，避免短时间内
+对同一站点（很多源共用一个域名或同一套 */api.php/provide/vod 站群）发出大量请求而被限流。
+
+- 每域名并发上限：AsyncHostSlots / HostSlots 限制同一域名同时在测的源数，线程池另用
+  requests 连接池的 pool_maxsize + pool_block 兜底限制连接数；排队等待都不计入请求超时
+- 最小间隔：HostPacer / AsyncHostPacer 为每个域名预约下一次请求的最早发出时间
+- 连接复用统计：ConnectionStats 汇总每个域名的请求数与新建连接数
+"""
+import asyncio
+import contextlib
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 默认每域名最大连接数与同一域名相邻请求的最小间隔（秒）
+DEFAULT_PER_HOST = 4
+DEFAULT_HOST_INTERVAL = 0.05
+
+
+def host_key(url: str) -> str:
+    """
+    取 URL 中的域名（小写，不含端口）作为调度分组的键
+    """
+    try:
+        return (urlsplit(url.strip()).hostname or '').lower()
+    except ValueError:
+        return ''
+
+
+def interleave_by_host(apis: Dict[str, str], priority: Optional[Dict[str, float]] = None) -> Dict[str, str]:
+    """
+    按域名轮流排列源，同一域名的源在队列中尽量分散，避免并发槽位被同一个域名占满；
+    给出 priority（{源名称: 分数}，越高越先测）时先按分数分档（保留一位小数），档内再按域名轮流排列
+    """
+    if priority:
+        tiers: Dict[float, Dict[str, str]] = defaultdict(dict)
+        for name, url in apis.items():
+            tiers[round(priority.get(name, 0.0), 1)][name] = url
+        ordered = {}
+        for tier in sorted(tiers, reverse=True):
+            ordered.update(interleave_by_host(tiers[tier]))
+        return ordered
+    groups: Dict[str, List[str]] = defaultdict(list)
+    for name, url in apis.items():
+        groups[host_key(url)].append(name)
+    ordered = {}
+    queues = list(groups.values())
+    depth = 0
+    while len(ordered) < len(apis):
+        for names in queues:
+            if depth < len(names):
+                ordered[names[depth]] = apis[names[depth]]
+        depth += 1
+    return ordered
+
+
+class HostPacer:
+    """
+    线程安全的按域名限速：同一域名相邻两次请求的发出时间至少间隔 min_interval 秒
+    """
+
+    def __init__(self, min_interval: float = DEFAULT_HOST_INTERVAL):
+        self.min_interval = min_interval
+        self._next: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        if self.min_interval <= 0:
+            return
+        host = host_key(url)
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, 0.0))
+            self._next[host] = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class AsyncHostPacer:
+    """
+    asyncio 版本的按域名限速，只能在同一个事件循环中使用；
+    通过 trace_config() 挂到 aiohttp 会话上，每个请求发出前自动等待
+    """
+
+    def __init__(self, min_interval: float = DEFAULT_HOST_INTERVAL):
+        self.min_interval = min_interval
+        self._next: Dict[str, float] = {}
+
+    async def wait(self, url: str) -> None:
+        if self.min_interval <= 0:
+            return
+        host = host_key(url)
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next.get(host, 0.0))
+        self._next[host] = start + self.min_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def trace_config(self):
+        """
+        返回在每个请求发出前等待的 aiohttp.TraceConfig
+        """
+        import aiohttp
+
+        async def on_request_start(session, ctx, params):
+            await self.wait(str(params.url))
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        return trace_config
+
+
+class AsyncHostSlots:
+    """
+    每个域名同时在测的源不超过 per_host 个（per_host <= 0 表示不限制）
+    """
+
+    def __init__(self, per_host: int = DEFAULT_PER_HOST):
+        self.per_host = per_host
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+
+    def slot(self, url: str):
+        if self.per_host <= 0:
+            return contextlib.nullcontext()
+        host = host_key(url)
+        if host not in self._slots:
+            self._slots[host] = asyncio.Semaphore(self.per_host)
+        return self._slots[host]
+
+
+class HostSlots:
+    """
+    线程版的 AsyncHostSlots：每个域名同时在测的源不超过 per_host 个（per_host <= 0 表示不限制）
+    """
+
+    def __init__(self, per_host: int = DEFAULT_PER_HOST):
+        self.per_host = per_host
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def slot(self, url: str) -> Optional[threading.BoundedSemaphore]:
+        if self.per_host <= 0:
+            return None
+        host = host_key(url)
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._slots[host]
+
+
+class ConnectionStats:
+    """
+    按域名统计请求数与新建连接数，复用率 = 1 - 新建连接数 / 请求数
+    """
+
+    def __init__(self):
+        self.hosts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"requests": 0, "connections": 0})
+
+    @property
+    def request_count(self) -> int:
+        return sum(h['requests'] for h in self.hosts.values())
+
+    @property
+    def connection_count(self) -> int:
+        return sum(h['connections'] for h in self.hosts.values())
+
+    @property
+    def reuse_rate(self) -> float:
+        return 1 - self.connection_count / self.request_count if self.request_count else 0.0
+
+    def trace_config(self):
+        """
+        返回记录请求与新建连接的 aiohttp.TraceConfig
+        """
+        import aiohttp
+
+        async def on_request_start(session, ctx, params):
+            ctx.host = (params.url.host or '').lower()
+            self.hosts[ctx.host]['requests'] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self.hosts[getattr(ctx, 'host', '')]['connections'] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        return trace_config
+
+    def collect_from_session(self, session: requests.Session) -> None:
+        """
+        从 requests 会话的 urllib3 连接池中读取每个域名的请求数与新建连接数
+        """
+        # http:// 与 https:// 挂载的是同一个适配器，只统计一次
+        adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = (pool.host or '').lower()
+                self.hosts[host]['requests'] += pool.num_requests
+                self.hosts[host]['connections'] += pool.num_connections
+
+    def report(self, top: int = 5) -> None:
+        """
+        打印整体复用率，以及请求数最多的几个域名
+        """
+        if not self.request_count:
+            return
+        print(f"🔗 连接复用: 共 {self.request_count} 次请求，新建 {self.connection_count} 个连接，"
+              f"复用率 {self.reuse_rate:.0%}，涉及 {len(self.hosts)} 个域名")
+        busiest = sorted(self.hosts.items(), key=lambda item: item[1]['requests'], reverse=True)[:top]
+        for host, counts in busiest:
+            if counts['requests'] > 1:
+                print(f"   {host}: {counts['requests']} 次请求 / {counts['connections']} 个连接")
+
+
+def make_session(per_host: int = DEFAULT_PER_HOST, hosts: int = 10) -> requests.Session:
+    """
+    创建按域名复用连接的 requests 会话：每个域名最多保持 per_host 个连接，
+    连接用完时阻塞等待（pool_block），从而同时限制了每域名并发；per_host <= 0 时不限制
+    """
+    session = requests.Session()
+    if per_host > 0:
+        adapter = HTTPAdapter(pool_connections=max(hosts, 1), pool_maxsize=per_host, pool_block=True)
+    else:
+        adapter = HTTPAdapter(pool_connections=max(hosts, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
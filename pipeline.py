@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+单进程流水线：拉取上游 → 合并 → 去重 → 测速清理 → 分类。
+
+源列表（以及测速阶段收集的内容摘要）在各阶段之间始终保存在内存中，
+最后一次性原子写入 config.json 与 config18.json（连同紧凑格式、预压缩版本、差异补丁与
+manifest.json，规范化内容不变时不改写），每个阶段单独计时。
+update_config.py、test_api_availability.py、separate_sources.py 仍可单独运行，
+与本流水线共用同一套阶段函数。
+
+用法: python pipeline.py --yes --sort-by-latency
+
+分片测速：各进程/作业分别运行 python pipeline.py --yes --shard i/n（i = 0..n-1），
+再运行 python pipeline.py --yes --sort-by-latency --merge-shards probe_results.*.json 生成配置文件，
+结果与单进程运行一致。
+"""
+import argparse
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from config_io import content_hash, load_json_or_none
+from run_trace import RunTrace, add_trace_arguments
+from separate_sources import ADULT_OUTPUT_FILE, NORMAL_OUTPUT_FILE, split_sources, write_separated_configs
+from test_api_availability import (
+    add_probe_arguments,
+    add_shard_arguments,
+    apply_measurements,
+    check_probe_arguments,
+    dedupe_config,
+    load_shard_results,
+    measure_sources,
+    probe_and_prune,
+    shard_output_path,
+    write_shard_results,
+)
+from update_config import (
+    URLS_TO_FETCH,
+    UpstreamCache,
+    add_update_arguments,
+    fetch_all_upstreams,
+    merge_configs,
+    report_changed,
+    upstream_digest,
+)
+
+
+class StageTimer:
+    """
+    记录每个阶段的耗时，trace 不为 None 时同时写入追踪记录
+    """
+
+    def __init__(self, trace: Optional[RunTrace] = None):
+        self.timings: List[Tuple[str, float]] = []
+        self.trace = trace
+
+    @contextmanager
+    def stage(self, name: str):
+        print(f"\n===== 阶段: {name} =====")
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings.append((name, elapsed))
+            if self.trace:
+                self.trace.emit('stage', stage=name, elapsed=round(elapsed, 6))
+            print(f"⏱️ 阶段 [{name}] 耗时 {elapsed:.2f} 秒")
+
+    def report(self) -> None:
+        total = sum(elapsed for _, elapsed in self.timings)
+        print("\n" + "=" * 40)
+        for name, elapsed in self.timings:
+            print(f"{name:<12}{elapsed:>10.2f} 秒")
+        print(f"{'合计':<12}{total:>10.2f} 秒")
+
+
+def main():
+    """
+    主执行函数，返回本次是否生成了新的配置文件
+    """
+    parser = argparse.ArgumentParser(description="在单个进程内完成拉取、去重、测速与分类，最后一次性写出配置文件。")
+    parser.add_argument(
+        '-y', '--yes',
+        action='store_true',
+        help="自动对所有提问回答'是'，用于非交互式环境（如GitHub Actions）。"
+    )
+    add_update_arguments(parser)
+    add_probe_arguments(parser)
+    add_shard_arguments(parser)
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    check_probe_arguments(parser, args)
+
+    trace = RunTrace(args.trace)
+    try:
+        ok = merge_shards(args, trace) if args.merge_shards else run(args, trace)
+    finally:
+        trace.close()
+    trace.print_summary()
+    if args.metrics:
+        trace.write_prometheus(args.metrics)
+    return ok
+
+
+def is_published(path: str, config: dict) -> bool:
+    """
+    磁盘上的配置文件内容是否与 config 相同（按规范化内容比较）
+    """
+    current = load_json_or_none(path)
+    return current is not None and content_hash(current) == content_hash(config)
+
+
+def merge_shards(args: argparse.Namespace, trace: RunTrace) -> bool:
+    """
+    合并各分片（--shard）的测量结果，按与单进程运行相同的规则清理、分类并写出配置文件
+    """
+    timer = StageTimer(trace)
+    with timer.stage("合并分片"):
+        config, measurements = load_shard_results(args.merge_shards)
+    if config is None:
+        report_changed(False)
+        return False
+    with timer.stage("清理"):
+        config = apply_measurements(config, measurements, args)
+    with timer.stage("分类"):
+        digests = {name: m['digest'] for name, m in measurements.items() if m['digest']}
+        normal_config, adult_config = split_sources(config, digests=digests, trace=trace)
+    with timer.stage("写出"):
+        ok = write_separated_configs(normal_config, adult_config, NORMAL_OUTPUT_FILE, ADULT_OUTPUT_FILE)
+
+    timer.report()
+    report_changed(ok)
+    return ok
+
+
+def run(args: argparse.Namespace, trace: RunTrace) -> bool:
+    """
+    依次执行各阶段，返回本次是否生成了新的配置文件
+    """
+    timer = StageTimer(trace)
+    with timer.stage("拉取上游"):
+        cache = None if args.no_cache else UpstreamCache()
+        fetched = fetch_all_upstreams(URLS_TO_FETCH, cache, trace)
+    clean = [(url, content) for url, (content, _) in zip(URLS_TO_FETCH, fetched) if content]
+    if not clean:
+        print("错误: 所有链接内容均为空或无法按规则过滤，无法生成配置文件。")
+        report_changed(False)
+        return False
+    # 与上一次成功写出时的上游内容比较（见 UpstreamCache.mark_published），上次中途失败时不会走这条捷径
+    digest = upstream_digest([content for _, content in clean])
+    if (not args.force and cache and os.path.exists(NORMAL_OUTPUT_FILE)
+            and cache.published_input('pipeline') == digest):
+        print("✅ 所有上游均未变化，沿用现有配置文件，跳过后续流程。")
+        report_changed(False)
+        return False
+
+    with timer.stage("合并"):
+        config = merge_configs([content for _, content in clean], [url for url, _ in clean], trace.origins)
+        print(f"合并完成，共 {len(config['api_site'])} 个源")
+    with timer.stage("去重"):
+        config = dedupe_config(config, args.yes)
+    if args.shard:
+        with timer.stage("分片测速"):
+            write_shard_results(shard_output_path(args), config, args.shard,
+                                measure_sources(config, args, trace, args.shard))
+        timer.report()
+        report_changed(True)
+        return True
+    digests = {}
+    with timer.stage("测速清理"):
+        config = probe_and_prune(config, args, digests, trace)
+    with timer.stage("分类"):
+        normal_config, adult_config = split_sources(config, digests=digests, trace=trace)
+    with timer.stage("写出"):
+        ok = write_separated_configs(normal_config, adult_config, NORMAL_OUTPUT_FILE, ADULT_OUTPUT_FILE)
+    # 内容无变化时 write_separated_configs 同样返回 False，以磁盘上的文件是否就是本轮结果为准；
+    # 分片模式下本进程不写出配置文件，不做记录
+    if cache and is_published(NORMAL_OUTPUT_FILE, normal_config) and is_published(ADULT_OUTPUT_FILE, adult_config):
+        cache.mark_published('pipeline', digest)
+
+    timer.report()
+    report_changed(ok)
+    return ok
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+播放测速：对通过连通性测试的源模拟一次真实播放，衡量的是用户点开影片后的体验，而不是接口是否在线。
+
+每个源依次：
+1. 请求 ac=detail，从响应中取第一个 m3u8 播放地址（vod_play_url，格式为 "集名$地址#集名$地址$$$下一组..."）
+2. 下载 m3u8 播放列表；如果是多码率的主列表，跟随第一个子列表
+3. 从前一两个分片下载有限的字节
+
+记录起播延迟（请求播放列表到收到第一个分片首字节的时间）与持续吞吐（首字节之后的下载速度）。
+每个源的所有读取（详情、播放列表与分片）共用一份字节预算，读取量严格不超过预算。
+"""
+import asyncio
+import json
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import aiohttp
+
+from probe_common import CONNECT_TIMEOUT, REQUEST_TIMEOUT, TEST_HEADERS
+from probe_engine import DEFAULT_CONCURRENCY
+from stream_validator import CHUNK_SIZE
+
+# 每个源默认的字节预算、下载的分片数，以及详情响应与播放列表各自最多读取的字节数
+DEFAULT_PLAYBACK_BYTES = 1024 * 1024
+DEFAULT_SEGMENTS = 2
+MAX_DETAIL_BYTES = 256 * 1024
+MAX_PLAYLIST_BYTES = 64 * 1024
+
+DETAIL_VARIANT = '?ac=detail&limit=1'
+
+# 失败发生的阶段：详情里没有可用的播放地址属于数据问题，播放列表或分片失败才说明播放不了
+STAGE_DETAIL = 'detail'
+STAGE_PLAYLIST = 'playlist'
+STAGE_SEGMENT = 'segment'
+
+_PLAY_URL_PATTERN = re.compile(rb'"vod_play_url"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+class ByteBudget:
+    """
+    单个源的读取字节预算
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(self.limit - self.used, 0)
+
+
+class PlaybackError(Exception):
+    def __init__(self, stage: str, reason: str):
+        super().__init__(reason)
+        self.stage = stage
+        self.reason = reason
+
+
+def first_play_url(play_url: str) -> Optional[str]:
+    """
+    从 vod_play_url 中取第一个 m3u8 地址，没有时返回 None
+    """
+    for group in play_url.split('$$$'):
+        for episode in group.split('#'):
+            url = episode.rsplit('$', 1)[-1].strip()
+            if url.startswith(('http://', 'https://')) and '.m3u8' in url:
+                return url
+    return None
+
+
+def extract_play_url(body: bytes) -> Optional[str]:
+    """
+    在（可能被截断的）详情响应中查找第一个完整的 vod_play_url 字段并取出 m3u8 地址
+    """
+    for match in _PLAY_URL_PATTERN.finditer(body):
+        try:
+            value = json.loads(b'"' + match.group(1) + b'"')
+        except ValueError:
+            continue
+        url = first_play_url(value)
+        if url:
+            return url
+    return None
+
+
+def parse_playlist(text: str, base_url: str) -> Tuple[List[str], List[str]]:
+    """
+    解析 m3u8，返回 (子播放列表地址, 分片地址)，均已转换为绝对地址
+    """
+    variants, segments = [], []
+    expect_variant = False
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            expect_variant = expect_variant or line.startswith('#EXT-X-STREAM-INF')
+            continue
+        (variants if expect_variant else segments).append(urljoin(base_url, line))
+        expect_variant = False
+    return variants, segments
+
+
+async def read_limited(response: aiohttp.ClientResponse, budget: ByteBudget, limit: int,
+                       stop=None, until: Optional[float] = None) -> Tuple[bytes, Optional[float]]:
+    """
+    读取至多 min(limit, 预算剩余) 字节，返回 (内容, 首字节时间)；
+    stop(内容) 为真或到达 until（perf_counter 时刻）时提前结束
+    """
+    data = bytearray()
+    first_byte = None
+    cap = min(limit, budget.remaining)
+    while len(data) < cap and (until is None or time.perf_counter() < until):
+        chunk = await response.content.read(min(CHUNK_SIZE, cap - len(data)))
+        if not chunk:
+            break
+        if first_byte is None:
+            first_byte = time.perf_counter()
+        data += chunk
+        budget.used += len(chunk)
+        if stop and stop(data):
+            break
+    return bytes(data), first_byte
+
+
+async def fetch(session: aiohttp.ClientSession, url: str, stage: str, budget: ByteBudget, limit: int,
+                stop=None, time_limit: Optional[float] = None) -> Tuple[bytes, Optional[float]]:
+    """
+    请求 url 并按 read_limited 读取；给出 time_limit 时不使用会话的总超时，
+    读满 time_limit 秒即停止并返回已读到的部分（慢速 CDN 也能测出吞吐，而不是记为超时）
+    """
+    if budget.remaining <= 0:
+        raise PlaybackError(stage, 'budget_exhausted')
+    kwargs, until = {}, None
+    if time_limit is not None:
+        kwargs['timeout'] = aiohttp.ClientTimeout(total=None, sock_connect=session.timeout.sock_connect,
+                                                  sock_read=time_limit)
+        until = time.perf_counter() + time_limit
+    try:
+        async with session.get(url, **kwargs) as response:
+            if response.status != 200:
+                raise PlaybackError(stage, f"http_{response.status}")
+            return await read_limited(response, budget, limit, stop, until)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise PlaybackError(stage, 'timeout' if isinstance(e, asyncio.TimeoutError) else type(e).__name__)
+
+
+async def probe_playback(session: aiohttp.ClientSession, api_url: str, max_bytes: int = DEFAULT_PLAYBACK_BYTES,
+                         segments: int = DEFAULT_SEGMENTS, segment_time: float = REQUEST_TIMEOUT) -> dict:
+    """
+    对单个源模拟一次播放，每个分片最多下载 segment_time 秒，返回可写入 JSON 的结果：
+    成功时 {"ok": True, "startup_ms", "throughput_kbps", "bytes", "segments", "play_url"}，
+    失败时 {"ok": False, "stage": STAGE_*, "reason", "bytes"}
+    """
+    budget = ByteBudget(max_bytes)
+    try:
+        body, _ = await fetch(session, f"{api_url}{DETAIL_VARIANT}", STAGE_DETAIL, budget, MAX_DETAIL_BYTES,
+                              stop=lambda data: _PLAY_URL_PATTERN.search(data) is not None)
+        play_url = extract_play_url(body)
+        if not play_url:
+            raise PlaybackError(STAGE_DETAIL, 'no_m3u8')
+
+        start = time.perf_counter()
+        playlist_url = play_url
+        text, _ = await fetch(session, playlist_url, STAGE_PLAYLIST, budget, MAX_PLAYLIST_BYTES)
+        variants, segment_urls = parse_playlist(text.decode('utf-8', 'replace'), playlist_url)
+        if variants and not segment_urls:
+            playlist_url = variants[0]
+            text, _ = await fetch(session, playlist_url, STAGE_PLAYLIST, budget, MAX_PLAYLIST_BYTES)
+            _, segment_urls = parse_playlist(text.decode('utf-8', 'replace'), playlist_url)
+        if not segment_urls:
+            raise PlaybackError(STAGE_PLAYLIST, 'no_segments')
+
+        first_byte = None
+        sustained_bytes, sustained_time = 0, 0.0
+        downloaded = 0
+        segment_urls = segment_urls[:segments]
+        for index, segment_url in enumerate(segment_urls):
+            if budget.remaining <= 0:
+                break
+            # 剩余预算平均分给还没尝试的分片；分不到字节的分片直接跳过，不算播放失败
+            share = budget.remaining // (len(segment_urls) - index)
+            if share <= 0:
+                continue
+            segment_start = time.perf_counter()
+            data, segment_first = await fetch(session, segment_url, STAGE_SEGMENT, budget, share,
+                                              time_limit=segment_time)
+            if segment_first is None:
+                raise PlaybackError(STAGE_SEGMENT, 'empty')
+            finished = time.perf_counter()
+            first_byte = first_byte or segment_first
+            # 第一个分片从首字节开始计时（起播延迟单独统计），之后的分片计整段下载（含请求开销，更接近连续播放）
+            sustained_bytes += len(data)
+            sustained_time += finished - (segment_first if downloaded == 0 else segment_start)
+            downloaded += 1
+        if downloaded == 0:
+            # 详情与播放列表已用完预算，一个分片也没下载，测不出起播延迟
+            raise PlaybackError(STAGE_SEGMENT, 'budget_exhausted')
+    except PlaybackError as e:
+        return {"ok": False, "stage": e.stage, "reason": e.reason, "bytes": budget.used}
+    return {
+        "ok": True,
+        "startup_ms": round((first_byte - start) * 1000, 1),
+        "throughput_kbps": round(sustained_bytes / 1024 / sustained_time, 1) if sustained_time > 0 else None,
+        "bytes": budget.used,
+        "segments": downloaded,
+        "play_url": play_url,
+    }
+
+
+async def measure_all(targets: Dict[str, str], concurrency: int = DEFAULT_CONCURRENCY,
+                      request_timeout: float = REQUEST_TIMEOUT, max_bytes: int = DEFAULT_PLAYBACK_BYTES,
+                      segments: int = DEFAULT_SEGMENTS, run_timeout: Optional[float] = None) -> Dict[str, dict]:
+    """
+    并发对所有目标 {源名称: API 地址} 做播放测速，run_timeout 秒后取消尚未完成的源，只返回已完成的
+    """
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=False, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=request_timeout, sock_connect=min(CONNECT_TIMEOUT, request_timeout))
+    semaphore = asyncio.Semaphore(concurrency)
+    results: Dict[str, dict] = {}
+
+    async with aiohttp.ClientSession(connector=connector, headers=TEST_HEADERS, timeout=timeout) as session:
+
+        async def measure(name: str, api_url: str) -> None:
+            async with semaphore:
+                results[name] = await probe_playback(session, api_url, max_bytes, segments, request_timeout)
+
+        tasks = [asyncio.ensure_future(measure(name, url)) for name, url in targets.items()]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=run_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if pending:
+                print(f"⏱️ 播放测速超过预算，取消剩余 {len(pending)} 个源")
+    return results
+
+
+def run_playback_test(targets: Dict[str, str], **kwargs) -> Dict[str, dict]:
+    """
+    同步入口：在新的事件循环中运行 measure_all
+    """
+    return asyncio.run(measure_all(targets, **kwargs))
+
+
+def print_playback_report(results: Dict[str, dict]) -> None:
+    """
+    按起播延迟从快到慢打印可播放的源，再列出播放失败的源
+    """
+    playable = {name: r for name, r in results.items() if r['ok']}
+    print(f"{'源':<24}{'起播 ms':>10}{'吞吐 KB/s':>12}{'读取 KB':>10}")
+    for name, r in sorted(playable.items(), key=lambda item: item[1]['startup_ms']):
+        print(f"{name:<24}{r['startup_ms']:>10}{r['throughput_kbps'] or 0:>12}{r['bytes'] / 1024:>10.0f}")
+    failed = {name: r for name, r in results.items() if not r['ok']}
+    if failed:
+        print(f"▶️ {len(failed)} 个源无法播放: "
+              + ", ".join(f"{name}({r['stage']}:{r['reason']})" for name, r in failed.items()))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+测速的公共部分：请求头、超时、URL 变体与响应校验。
+
+线程池测速（test_api_availability）、异步引擎（probe_engine）以及 speed_test、playback_probe、
+search_client、health_daemon 都从这里导入，避免库模块反过来导入命令行脚本。
+"""
+from typing import List, Optional
+
+from stream_validator import DIGEST_TITLES
+
+# 测速请求统一使用的请求头
+TEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# 单次读取的超时（秒）、建立连接的超时（秒）与失败后的重试间隔（秒）
+REQUEST_TIMEOUT = 10
+CONNECT_TIMEOUT = 5
+RETRY_DELAY = 0.5
+
+# 单次请求的总时长上限为读取超时的多少倍：每次读取都不超时、但持续缓慢发送的响应到此为止，
+# 两种测速引擎按同一上限判定
+REQUEST_TOTAL_FACTOR = 3
+
+# 测试 URL 变体的后缀，按默认优先级排列
+TEST_VARIANTS = ["?ac=detail&limit=1", "?ac=list&limit=1", "?limit=1", ""]
+# 镜像识别请求的首页：测试变体只取 1 项，不足以区分采集到同一部新片的不同站点
+FINGERPRINT_VARIANT = f"?ac=list&limit={DIGEST_TITLES}"
+
+
+def request_total_timeout(request_timeout: float) -> float:
+    """
+    单次请求（含建连、等待响应头与读取响应体）的总时长上限
+    """
+    return request_timeout * REQUEST_TOTAL_FACTOR
+
+
+def build_test_urls(api_url: str, preferred_variant: Optional[str] = None) -> List[str]:
+    """
+    按优先级生成用于测试单个API的URL变体，上次验证成功的变体排在最前
+    """
+    variants = list(TEST_VARIANTS)
+    if preferred_variant in variants:
+        variants.remove(preferred_variant)
+        variants.insert(0, preferred_variant)
+    return [f"{api_url}{variant}" for variant in variants]
+
+
+def is_retryable_status(status_code: int) -> bool:
+    """
+    限流或服务端错误属于临时性失败，值得在下一轮重试
+    """
+    return status_code == 429 or status_code >= 500
+
+
+def validate_api_response(data: dict) -> bool:
+    """
+    验证API响应数据是否符合预期格式
+    """
+    if not isinstance(data, dict):
+        return False
+
+    if 'code' in data and data['code'] != 1 and data['code'] != 200:
+        return False
+
+    if 'list' in data:
+        if not isinstance(data['list'], list):
+            return False
+        if len(data['list']) > 0:
+            first_item = data['list'][0]
+            if not isinstance(first_item, dict):
+                return False
+            required_fields = ['vod_id', 'vod_name']
+            for field in required_fields:
+                if field not in first_item:
+                    alt_fields = {
+                        'vod_id': ['id', 'video_id'],
+                        'vod_name': ['name', 'title']
+                    }
+                    found = False
+                    for alt_field in alt_fields.get(field, []):
+                        if alt_field in first_item:
+                            found = True
+                            break
+                    if not found:
+                        return False
+    elif 'data' in data:
+        if not isinstance(data['data'], (list, dict)):
+            return False
+    else:
+        if len(data) == 0:
+            return False
+
+    return True
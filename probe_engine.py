@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+基于 asyncio + aiohttp 的异步测速引擎。
+
+用于替代 test_api_availability 中 20 线程的阻塞线程池：所有探测共享同一个连接池，
+可以同时保持数百个在途请求，并支持单源超时与整轮超时。返回结果格式与 test_api 保持一致：
+(name, url, ok, status, msg)，因此 remove_unavailable_apis 等后续逻辑无需改动。
+"""
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from host_scheduler import (
+    DEFAULT_HOST_INTERVAL,
+    DEFAULT_PER_HOST,
+    AsyncHostPacer,
+    AsyncHostSlots,
+    ConnectionStats,
+    interleave_by_host,
+)
+from probe_common import (
+    CONNECT_TIMEOUT,
+    FINGERPRINT_VARIANT,
+    REQUEST_TIMEOUT,
+    RETRY_DELAY,
+    TEST_HEADERS,
+    TEST_VARIANTS,
+    build_test_urls,
+    is_retryable_status,
+    request_total_timeout,
+    validate_api_response,
+)
+from probe_state import NOT_TESTED_MESSAGE, STATUS_NOT_TESTED
+from run_trace import phase_durations, phase_trace_config
+from stream_validator import CHUNK_SIZE, MAX_PROBE_BYTES, StreamingValidator
+
+# 默认最大在途探测数
+DEFAULT_CONCURRENCY = 200
+
+ProbeResult = Tuple[str, str, bool, int, str]
+# (验证成功的 URL 或 None, 状态码, 错误信息, 是否值得重试)
+LadderOutcome = Tuple[Optional[str], int, Optional[str], bool]
+
+
+# 连接层面的失败：DNS 解析失败、拒绝连接、TLS 握手失败、连接超时
+CONNECTION_FAILURES = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+
+
+class HeaderTimeoutError(asyncio.TimeoutError):
+    """
+    连接已建立，但超时前没有收到响应头：主机接受连接后挂起，换变体或重试同样会等满超时
+    """
+
+
+async def check_variant(session: aiohttp.ClientSession, test_url: str,
+                        max_bytes: int = MAX_PROBE_BYTES, stats: Optional[dict] = None,
+                        collect_digest: bool = False) -> Tuple[bool, int]:
+    """
+    请求单个 URL 变体，返回 (是否为有效的API响应, 状态码)；网络异常直接抛出。
+    响应体流式读取，得出结论或达到 max_bytes 后立即停止并关闭连接；
+    collect_digest 为 True 时，验证成功的响应的内容摘要记录在 stats['digest']。
+    每次请求的状态码、读取量与分阶段耗时追加到 stats['attempts']。
+    收到响应头之前的读取超时以 HeaderTimeoutError 抛出。
+    """
+    loop = asyncio.get_running_loop()
+    marks = {}
+    record = {"url": test_url, "attempt": stats.get('attempt', 1) if stats is not None else 1,
+              "status": -1, "ok": False, "bytes": 0}
+    validator = StreamingValidator(max_bytes, collect_digest)
+    try:
+        async with session.get(test_url, trace_request_ctx=marks) as response:
+            record['status'] = response.status
+            if response.status != 200:
+                return False, response.status
+            try:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if validator.feed(chunk):
+                        break
+            finally:
+                record['bytes'] = validator.bytes_read
+                if stats is not None:
+                    stats['bytes_read'] = stats.get('bytes_read', 0) + validator.bytes_read
+            validator.close()
+        data = validator.result
+        ok = data is not None and validate_api_response(data)
+        record['ok'] = ok
+        if ok and collect_digest and stats is not None:
+            stats['digest'] = validator.digest
+        return ok, 200
+    except BaseException as e:
+        record['error'] = e.__class__.__name__
+        if record['status'] == -1 and isinstance(e, asyncio.TimeoutError) and not isinstance(e, CONNECTION_FAILURES):
+            raise HeaderTimeoutError(str(e) or e.__class__.__name__) from e
+        raise
+    finally:
+        if stats is not None:
+            record.update(phase_durations(marks, loop.time()))
+            record['total'] = round(loop.time() - marks['start'], 6) if 'start' in marks else None
+            stats.setdefault('attempts', []).append(record)
+
+
+async def ladder_variants(session: aiohttp.ClientSession, test_urls: List[str],
+                          max_bytes: int = MAX_PROBE_BYTES, stats: Optional[dict] = None,
+                          collect_digest: bool = False) -> LadderOutcome:
+    """
+    按顺序逐个尝试 URL 变体，遇到连接层面的失败或等待响应头超时立即停止
+    """
+    status_code, last_error, retryable = -1, None, False
+    for test_url in test_urls:
+        try:
+            ok, status_code = await check_variant(session, test_url, max_bytes, stats, collect_digest)
+        except CONNECTION_FAILURES as e:
+            return None, -1, f"连接失败: {e}", False
+        except HeaderTimeoutError as e:
+            return None, -1, f"等待响应头超时: {e}", False
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            last_error = str(e) or e.__class__.__name__
+            retryable = True
+            continue
+        if ok:
+            return test_url, status_code, None, False
+        retryable = retryable or is_retryable_status(status_code)
+    return None, status_code, last_error, retryable
+
+
+async def race_variants(session: aiohttp.ClientSession, test_urls: List[str], hedge_delay: float = 0.0,
+                        max_bytes: int = MAX_PROBE_BYTES, stats: Optional[dict] = None,
+                        collect_digest: bool = False) -> LadderOutcome:
+    """
+    竞速模式：依次（间隔 hedge_delay 秒）发出所有变体请求，取最先验证成功的一个并取消其余请求
+    """
+    status_code, last_error, retryable = -1, None, False
+    remaining = list(test_urls)
+    task_urls: Dict[asyncio.Future, str] = {}
+    pending = set()
+    try:
+        while remaining or pending:
+            if remaining:
+                test_url = remaining.pop(0)
+                task = asyncio.ensure_future(check_variant(session, test_url, max_bytes, stats, collect_digest))
+                task_urls[task] = test_url
+                pending.add(task)
+            wait_timeout = hedge_delay if remaining else None
+            done, pending = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    ok, status = task.result()
+                    if ok:
+                        return task_urls[task], status, None, False
+                    status_code = status
+                    retryable = retryable or is_retryable_status(status)
+                elif isinstance(error, CONNECTION_FAILURES):
+                    return None, -1, f"连接失败: {error}", False
+                elif isinstance(error, HeaderTimeoutError):
+                    return None, -1, f"等待响应头超时: {error}", False
+                else:
+                    last_error = str(error) or error.__class__.__name__
+                    retryable = True
+    finally:
+        for task in task_urls:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # 标记异常已读取，避免提前返回时产生告警
+    return None, status_code, last_error, retryable
+
+
+async def probe_api(session: aiohttp.ClientSession, api_name: str, api_url: str,
+                    max_retries: int = 2, preferred_variant: Optional[str] = None,
+                    hedge: bool = False, hedge_delay: float = 0.0,
+                    max_bytes: int = MAX_PROBE_BYTES, stats: Optional[dict] = None,
+                    collect_digest: bool = False) -> ProbeResult:
+    """
+    异步测试单个API的有效性，失败策略与 test_api 相同：
+    连接层面的失败与等待响应头超时立即放弃，只有临时性失败才重试；累计读取量记录在 stats['bytes_read']
+    """
+    stats = {} if stats is None else stats
+    stats.setdefault('bytes_read', 0)
+    test_urls = build_test_urls(api_url, preferred_variant)
+    status_code = -1
+    last_error = "请求失败"
+
+    for attempt in range(max_retries):
+        stats['attempt'] = attempt + 1
+        if hedge:
+            winner, status_code, error, retryable = await race_variants(session, test_urls, hedge_delay, max_bytes,
+                                                                        stats, collect_digest)
+        else:
+            winner, status_code, error, retryable = await ladder_variants(session, test_urls, max_bytes, stats,
+                                                                          collect_digest)
+        if winner:
+            return api_name, winner, True, status_code, "有效"
+        last_error = error or last_error
+        if not retryable:
+            break
+        if attempt < max_retries - 1:
+            await asyncio.sleep(RETRY_DELAY)
+
+    return api_name, api_url, False, status_code, last_error
+
+
+async def probe_all(apis: Dict[str, str],
+                    concurrency: int = DEFAULT_CONCURRENCY,
+                    request_timeout: float = REQUEST_TIMEOUT,
+                    probe_timeout: Optional[float] = None,
+                    run_timeout: Optional[float] = None,
+                    max_retries: int = 2,
+                    preferred: Optional[Dict[str, str]] = None,
+                    hedge: bool = False,
+                    hedge_delay: float = 0.0,
+                    max_bytes: int = MAX_PROBE_BYTES,
+                    probe_stats: Optional[Dict[str, dict]] = None,
+                    collect_digest: bool = False,
+                    per_host: int = DEFAULT_PER_HOST,
+                    host_interval: float = DEFAULT_HOST_INTERVAL,
+                    connection_stats: Optional[ConnectionStats] = None,
+                    priority: Optional[Dict[str, float]] = None,
+                    on_result: Optional[Callable[[ProbeResult], None]] = None) -> List[ProbeResult]:
+    """
+    并发测试所有API
+
+    - concurrency: 同时在途的最大探测数，同时也是共享连接池的大小
+    - request_timeout: 单次读取的超时；单次 HTTP 请求的总时长另有 request_total_timeout 倍数上限
+    - probe_timeout: 单个源（含所有变体与重试）的总超时
+    - run_timeout: 整轮测速的总超时，超时后取消未完成的探测，这些源记为 STATUS_NOT_TESTED
+    - preferred: {源名称: 上次验证成功的变体}，该变体会被优先尝试
+    - hedge / hedge_delay: 是否并行竞速所有变体，以及相邻变体的启动间隔
+    - max_bytes: 单次请求最多读取的响应字节数
+    - probe_stats: 不为 None 时填入 {源名称: 探测统计}（bytes_read、elapsed、逐次请求记录 attempts，
+      以及 collect_digest 时的 digest）
+    - collect_digest: 是否顺带收集验证成功的响应的内容摘要（分类名称与前几条标题）
+    - per_host / host_interval: 每个域名同时在测的最大源数（<= 0 不限制），以及同一域名相邻请求的最小间隔（秒）
+    - connection_stats: 不为 None 时记录每个域名的请求数与新建连接数
+    - priority: {源名称: 优先级分数}，分数高的源先占用并发槽位
+    """
+    preferred = preferred or {}
+    probe_stats = {} if probe_stats is None else probe_stats
+    # 连接池按域名设上限，与域名槽位一致；竞速模式下每个源最多同时占用每个变体一个连接
+    limit_per_host = per_host * (len(TEST_VARIANTS) if hedge else 1) if per_host > 0 else 0
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=limit_per_host, ssl=False, ttl_dns_cache=300)
+    # 与 requests 的 (连接超时, 读取超时) 语义一致：超时针对每次读取，持续缓慢发送的响应由总时限截断
+    timeout = aiohttp.ClientTimeout(total=request_total_timeout(request_timeout),
+                                    sock_connect=min(CONNECT_TIMEOUT, request_timeout), sock_read=request_timeout)
+    semaphore = asyncio.Semaphore(concurrency)
+    host_slots = AsyncHostSlots(per_host)
+    results: List[ProbeResult] = []
+    # 限速等待发生在请求超时之内，只有在域名槽位限制了排队长度时才启用，否则等待时间会随源数无限增长
+    trace_configs = [AsyncHostPacer(host_interval).trace_config()] if per_host > 0 else []
+    if connection_stats is not None:
+        trace_configs.append(connection_stats.trace_config())
+    # 分阶段计时放在限速之后，限速等待不计入请求耗时
+    trace_configs.append(phase_trace_config())
+
+    async with aiohttp.ClientSession(connector=connector, headers=TEST_HEADERS, timeout=timeout,
+                                     trace_configs=trace_configs) as session:
+
+        async def guarded(name: str, url: str) -> ProbeResult:
+            stats = probe_stats.setdefault(name, {})
+            # 先排队等待域名槽位再占用全局并发槽位，排队时间不计入单源超时
+            async with host_slots.slot(url), semaphore:
+                start = time.perf_counter()
+                try:
+                    return await asyncio.wait_for(
+                        probe_api(session, name, url, max_retries, preferred.get(name), hedge, hedge_delay,
+                                  max_bytes, stats, collect_digest),
+                        probe_timeout
+                    )
+                except asyncio.TimeoutError:
+                    return name, url, False, -1, f"单源测试超过 {probe_timeout} 秒"
+                finally:
+                    stats['elapsed'] = time.perf_counter() - start
+
+        # 按优先级分档、档内按域名轮流排列，避免并发槽位被同一个域名的源占满后排队等待连接
+        tasks = {asyncio.ensure_future(guarded(name, url)): (name, url)
+                 for name, url in interleave_by_host(apis, priority).items()}
+        pending = set(tasks)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + run_timeout if run_timeout else None
+
+        while pending:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name, url = tasks[task]
+                try:
+                    result = task.result()
+                except Exception as e:
+                    print(f"测试 {name} 时发生错误: {e}")
+                    result = (name, url, False, -1, str(e))
+                results.append(result)
+                if on_result:
+                    on_result(result)
+
+        if pending:
+            print(f"⚠️ 整轮测速超过 {run_timeout} 秒，取消剩余 {len(pending)} 个未完成的探测")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in pending:
+                name, url = tasks[task]
+                result = (name, url, False, STATUS_NOT_TESTED, NOT_TESTED_MESSAGE)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+
+    return results
+
+
+def run_probes(apis: Dict[str, str], **kwargs) -> List[ProbeResult]:
+    """
+    同步入口：在新的事件循环中运行 probe_all
+    """
+    return asyncio.run(probe_all(apis, **kwargs))
+
+
+async def fetch_fingerprints(apis: Dict[str, str], concurrency: int = DEFAULT_CONCURRENCY,
+                             request_timeout: float = REQUEST_TIMEOUT, max_bytes: int = MAX_PROBE_BYTES,
+                             run_timeout: Optional[float] = None) -> Dict[str, str]:
+    """
+    并发请求各源的首页（FINGERPRINT_VARIANT），按前几项的 (id, 标题) 生成内容指纹，
+    返回 {源名称: 指纹}；请求失败、响应无效或首页项数不足的源不在结果中，run_timeout 秒后取消未完成的源
+    """
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=False, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=request_total_timeout(request_timeout),
+                                    sock_connect=min(CONNECT_TIMEOUT, request_timeout), sock_read=request_timeout)
+    semaphore = asyncio.Semaphore(concurrency)
+    fingerprints: Dict[str, str] = {}
+
+    async with aiohttp.ClientSession(connector=connector, headers=TEST_HEADERS, timeout=timeout) as session:
+
+        async def fingerprint(name: str, url: str) -> None:
+            stats = {}
+            async with semaphore:
+                try:
+                    ok, _ = await check_variant(session, f"{url}{FINGERPRINT_VARIANT}", max_bytes, stats,
+                                                collect_digest=True)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    return
+            if ok and stats['digest'].get('fingerprint'):
+                fingerprints[name] = stats['digest']['fingerprint']
+
+        tasks = [asyncio.ensure_future(fingerprint(name, url)) for name, url in apis.items()]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=run_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if pending:
+                print(f"⏱️ 首页指纹超过预算，取消剩余 {len(pending)} 个源")
+    return fingerprints
+
+
+def run_fingerprints(apis: Dict[str, str], **kwargs) -> Dict[str, str]:
+    """
+    同步入口：在新的事件循环中运行 fetch_fingerprints
+    """
+    return asyncio.run(fetch_fingerprints(apis, **kwargs))
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+测速状态的本地持久化（跨次运行保存），默认存放在 .tvapi_cache 目录下。
+"""
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+from source_index import canonical_api_url
+
+# 本地状态目录（GitHub Actions 中通过 actions/cache 在多次运行之间保留）
+STATE_DIR = '.tvapi_cache'
+VARIANT_MEMORY_PATH = os.path.join(STATE_DIR, 'probe_variants.json')
+
+
+class VariantMemory:
+    """
+    记录每个源上一次验证成功的 URL 变体（如 '?ac=list&limit=1'），下次测速时优先尝试
+    """
+
+    def __init__(self, path: str = VARIANT_MEMORY_PATH):
+        self.path = path
+        self.variants: Dict[str, str] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    # 旧版本按 normalize_api_url 记录，读取时统一换成 canonical_api_url
+                    self.variants = {canonical_api_url(key): variant for key, variant in json.load(f).items()}
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"警告: 读取变体记录 {path} 失败，将重新记录: {e}")
+
+    def get(self, api_url: str) -> Optional[str]:
+        return self.variants.get(canonical_api_url(api_url))
+
+    def preferred(self, apis: Dict[str, str]) -> Dict[str, str]:
+        """
+        返回 {源名称: 优先变体}，只包含有记录的源
+        """
+        return {name: variant for name, url in apis.items() if (variant := self.get(url)) is not None}
+
+    def remember(self, api_url: str, test_url: str) -> None:
+        """
+        根据验证成功的完整测试 URL 记录其变体后缀
+        """
+        if test_url.startswith(api_url):
+            self.variants[canonical_api_url(api_url)] = test_url[len(api_url):]
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.variants, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+HISTORY_PATH = os.path.join(STATE_DIR, 'probe_history.sqlite3')
+# 探测日志保留时长（秒）
+LOG_RETENTION = 30 * 24 * 3600
+
+# 探测计划中的几种处理方式
+PLAN_PROBE = 'probe'          # 需要重新探测
+PLAN_FRESH = 'fresh'          # TTL 内验证过，直接视为有效
+PLAN_BACKOFF = 'backoff'      # 失败后处于退避期，暂不探测，先保留
+PLAN_DEAD = 'dead'            # 连续失败次数已达上限且处于退避期，直接移除
+
+# 测速预算用尽、没能完成测试的源使用的状态码：既不算有效也不算失败，本轮保留且不写入探测历史
+STATUS_NOT_TESTED = -2
+NOT_TESTED_MESSAGE = "测速预算用尽，未完成测试"
+
+# 探测历史的键格式版本（PRAGMA user_version）：0 为 normalize_api_url，1 为 canonical_api_url
+HISTORY_KEY_VERSION = 1
+# 每个源一行的状态表及其记录时间列，迁移键格式时同一接口的多行只保留最新的一行
+_KEYED_TABLES = (
+    ('source_state', 'last_checked'),
+    ('speed_state', 'measured_at'),
+    ('playback_state', 'measured_at'),
+    ('search_state', 'measured_at'),
+    ('digest_state', 'collected_at'),
+)
+
+# 计算探测优先级时参考的最近探测次数
+PRIORITY_WINDOW = 10
+# 每个源保留的最近搜索耗时个数
+SEARCH_WINDOW = 10
+
+
+class ProbeHistory:
+    """
+    基于 SQLite 的探测历史，按 canonical_api_url 规范化后的 API URL 记录每次探测的结果、耗时与时间。
+
+    - 在 ttl 秒内验证成功过的源跳过探测
+    - 失败的源按指数退避（backoff * 2^(连续失败次数-1)，最长 max_backoff）延后重新探测
+    - 连续失败达到 remove_after 次才判定为应移除
+    """
+
+    def __init__(self, path: str = HISTORY_PATH, ttl: float = 20 * 3600, backoff: float = 6 * 3600,
+                 max_backoff: float = 7 * 24 * 3600, remove_after: int = 3):
+        self.path = path
+        self.ttl = ttl
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.remove_after = remove_after
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS source_state (
+                url_key TEXT PRIMARY KEY,
+                last_ok INTEGER NOT NULL,
+                last_status INTEGER,
+                last_latency REAL,
+                last_checked REAL NOT NULL,
+                last_success REAL,
+                consecutive_failures INTEGER NOT NULL DEFAULT 0,
+                next_probe_at REAL NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS probe_log (
+                url_key TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                ok INTEGER NOT NULL,
+                status INTEGER,
+                latency REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_probe_log_url ON probe_log (url_key, checked_at);
+            CREATE TABLE IF NOT EXISTS speed_state (
+                url_key TEXT PRIMARY KEY,
+                measured_at REAL NOT NULL,
+                summary TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS playback_state (
+                url_key TEXT PRIMARY KEY,
+                measured_at REAL NOT NULL,
+                result TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS search_state (
+                url_key TEXT PRIMARY KEY,
+                measured_at REAL NOT NULL,
+                summary TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS digest_state (
+                url_key TEXT PRIMARY KEY,
+                collected_at REAL NOT NULL,
+                digest TEXT NOT NULL
+            );
+        """)
+        self._migrate_keys()
+
+    def _migrate_keys(self) -> None:
+        """
+        一次性把旧版本按 normalize_api_url 记录的键换成 canonical_api_url；
+        换键后重合的行（同一接口的不同写法）只保留记录时间最新的一行，探测日志全部保留
+        """
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= HISTORY_KEY_VERSION:
+            return
+        for table, time_column in _KEYED_TABLES:
+            rows = self.conn.execute(f"SELECT * FROM {table} ORDER BY {time_column}").fetchall()
+            self.conn.execute(f"DELETE FROM {table}")
+            placeholders = ', '.join('?' * len(rows[0])) if rows else ''
+            # 按时间从旧到新写回，INSERT OR REPLACE 使较新的行覆盖较旧的行
+            for row in rows:
+                self.conn.execute(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})",
+                                  (canonical_api_url(row['url_key']),) + tuple(row)[1:])
+        self.conn.create_function('canonical_api_url', 1, canonical_api_url)
+        self.conn.execute("UPDATE probe_log SET url_key = canonical_api_url(url_key)")
+        self.conn.execute(f"PRAGMA user_version = {HISTORY_KEY_VERSION}")
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get(self, api_url: str) -> Optional[sqlite3.Row]:
+        return self.conn.execute(
+            "SELECT * FROM source_state WHERE url_key = ?", (canonical_api_url(api_url),)
+        ).fetchone()
+
+    def plan(self, apis: Dict[str, str], now: Optional[float] = None) -> Dict[str, str]:
+        """
+        为每个源给出本轮的处理方式：{源名称: PLAN_*}
+        """
+        now = time.time() if now is None else now
+        plans = {}
+        for name, url in apis.items():
+            row = self.get(url)
+            if row is None:
+                plans[name] = PLAN_PROBE
+            elif row['last_ok'] and now - row['last_checked'] < self.ttl:
+                plans[name] = PLAN_FRESH
+            elif not row['last_ok'] and now < row['next_probe_at']:
+                plans[name] = PLAN_DEAD if row['consecutive_failures'] >= self.remove_after else PLAN_BACKOFF
+            else:
+                plans[name] = PLAN_PROBE
+        return plans
+
+    def priorities(self, apis: Dict[str, str]) -> Dict[str, float]:
+        """
+        按探测的预期价值给出优先级 {源名称: 分数}，分数越高越应该先测：
+
+        - 没有记录的新源: 3
+        - 上次失败的源: 2 - 0.1 × 连续失败次数（不低于 1.5），刚开始失败的比早已连续失败的更值得确认
+        - 最近 PRIORITY_WINDOW 次中有过失败的源: 1 + 失败比例
+        - 一直稳定的源: 1 / (1 + 连续成功次数)，越稳定越靠后
+        """
+        priorities = {}
+        for name, url in apis.items():
+            row = self.get(url)
+            if row is None:
+                priorities[name] = 3.0
+                continue
+            if not row['last_ok']:
+                priorities[name] = max(2.0 - 0.1 * row['consecutive_failures'], 1.5)
+                continue
+            recent = [r['ok'] for r in self.conn.execute(
+                "SELECT ok FROM probe_log WHERE url_key = ? ORDER BY checked_at DESC LIMIT ?",
+                (canonical_api_url(url), PRIORITY_WINDOW)
+            )]
+            failures = recent.count(0)
+            if failures:
+                priorities[name] = 1.0 + failures / len(recent)
+            else:
+                priorities[name] = 1.0 / (1 + max(len(recent), 1))
+        return priorities
+
+    def record(self, api_url: str, ok: bool, status: int, latency: Optional[float],
+               now: Optional[float] = None) -> None:
+        """
+        记录一次探测结果，并更新连续失败次数与下次探测时间
+        """
+        now = time.time() if now is None else now
+        key = canonical_api_url(api_url)
+        row = self.get(api_url)
+        if ok:
+            failures, next_probe_at, last_success = 0, now, now
+        else:
+            failures = (row['consecutive_failures'] if row else 0) + 1
+            next_probe_at = now + min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+            last_success = row['last_success'] if row else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO source_state VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, int(ok), status, latency, now, last_success, failures, next_probe_at)
+        )
+        self.conn.execute(
+            "INSERT INTO probe_log VALUES (?, ?, ?, ?, ?)", (key, now, int(ok), status, latency)
+        )
+
+    def record_speed(self, api_url: str, summary: dict, now: Optional[float] = None) -> None:
+        """
+        保存最近一次测速汇总（见 speed_test.summarize_samples）
+        """
+        now = time.time() if now is None else now
+        self.conn.execute(
+            "INSERT OR REPLACE INTO speed_state VALUES (?, ?, ?)",
+            (canonical_api_url(api_url), now, json.dumps(summary))
+        )
+
+    def speeds(self, apis: Dict[str, str]) -> Dict[str, dict]:
+        """
+        返回 {源名称: 最近一次测速汇总}，只包含测过速的源
+        """
+        speeds = {}
+        for name, url in apis.items():
+            row = self.conn.execute(
+                "SELECT summary FROM speed_state WHERE url_key = ?", (canonical_api_url(url),)
+            ).fetchone()
+            if row:
+                speeds[name] = json.loads(row['summary'])
+        return speeds
+
+    def record_playback(self, api_url: str, result: dict, now: Optional[float] = None) -> None:
+        """
+        保存最近一次播放测速结果（见 playback_probe.probe_playback）
+        """
+        now = time.time() if now is None else now
+        self.conn.execute(
+            "INSERT OR REPLACE INTO playback_state VALUES (?, ?, ?)",
+            (canonical_api_url(api_url), now, json.dumps(result, ensure_ascii=False))
+        )
+
+    def playbacks(self, apis: Dict[str, str]) -> Dict[str, dict]:
+        """
+        返回 {源名称: 最近一次播放测速结果}，只包含有记录的源
+        """
+        playbacks = {}
+        for name, url in apis.items():
+            row = self.conn.execute(
+                "SELECT result FROM playback_state WHERE url_key = ?", (canonical_api_url(url),)
+            ).fetchone()
+            if row:
+                playbacks[name] = json.loads(row['result'])
+        return playbacks
+
+    def record_search(self, api_url: str, latency_ms: Optional[float], ok: bool, now: Optional[float] = None) -> None:
+        """
+        记录一次搜索（见 search_client）：保留最近 SEARCH_WINDOW 次成功搜索的耗时与失败次数，
+        汇总为 {"latency_p50", "samples", "failures"}；上次记录已超过 ttl 时从头统计
+        """
+        now = time.time() if now is None else now
+        key = canonical_api_url(api_url)
+        row = self.conn.execute("SELECT measured_at, summary FROM search_state WHERE url_key = ?", (key,)).fetchone()
+        if row and now - row['measured_at'] < self.ttl:
+            summary = json.loads(row['summary'])
+        else:
+            summary = {"samples": [], "failures": 0}
+        if ok and latency_ms is not None:
+            summary['samples'] = (summary['samples'] + [round(latency_ms, 1)])[-SEARCH_WINDOW:]
+        elif not ok:
+            summary['failures'] += 1
+        ordered = sorted(summary['samples'])
+        summary['latency_p50'] = ordered[(len(ordered) - 1) // 2] if ordered else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO search_state VALUES (?, ?, ?)", (key, now, json.dumps(summary))
+        )
+
+    def searches(self, apis: Dict[str, str], now: Optional[float] = None) -> Dict[str, dict]:
+        """
+        返回 {源名称: 搜索耗时汇总}，只包含 ttl 内有记录的源；过期的记录与探测结果一样不再可信
+        """
+        now = time.time() if now is None else now
+        searches = {}
+        for name, url in apis.items():
+            row = self.conn.execute(
+                "SELECT measured_at, summary FROM search_state WHERE url_key = ?", (canonical_api_url(url),)
+            ).fetchone()
+            if row and now - row['measured_at'] < self.ttl:
+                searches[name] = json.loads(row['summary'])
+        return searches
+
+    def record_digest(self, api_url: str, digest: dict, now: Optional[float] = None) -> None:
+        """
+        保存最近一次探测得到的内容摘要（见 stream_validator.StreamingValidator.digest）
+        """
+        now = time.time() if now is None else now
+        self.conn.execute(
+            "INSERT OR REPLACE INTO digest_state VALUES (?, ?, ?)",
+            (canonical_api_url(api_url), now, json.dumps(digest, ensure_ascii=False))
+        )
+
+    def digests(self, apis: Dict[str, str]) -> Dict[str, dict]:
+        """
+        返回 {源名称: 最近一次的内容摘要}，只包含有记录的源
+        """
+        digests = {}
+        for name, url in apis.items():
+            row = self.conn.execute(
+                "SELECT digest FROM digest_state WHERE url_key = ?", (canonical_api_url(url),)
+            ).fetchone()
+            if row:
+                digests[name] = json.loads(row['digest'])
+        return digests
+
+    def should_remove(self, api_url: str) -> bool:
+        """
+        连续失败次数是否已达到移除阈值
+        """
+        row = self.get(api_url)
+        return row is not None and row['consecutive_failures'] >= self.remove_after
+
+    def commit(self) -> None:
+        self.conn.execute("DELETE FROM probe_log WHERE checked_at < ?", (time.time() - LOG_RETENTION,))
+        self.conn.commit()
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+运行追踪与指标导出。
+
+- RunTrace.emit 记录结构化事件（探测的每次请求、上游拉取、分类结果、阶段耗时），
+  可选写入 JSON Lines 文件（--trace）
+- RunTrace.print_summary 在运行结束时打印延迟直方图、探测请求的分阶段耗时与失败原因分布
+- RunTrace.write_prometheus 导出 node_exporter textfile 格式的指标（--metrics）
+
+探测请求的分阶段耗时（DNS、建连含 TLS、首字节、响应体）在异步引擎中由 phase_trace_config
+通过 aiohttp 的 TraceConfig 采集；requests 不提供连接阶段的钩子，线程池模式只记录首字节与响应体耗时。
+"""
+import argparse
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from config_io import write_text_atomic
+from probe_state import STATUS_NOT_TESTED
+
+# 直方图分桶（秒），与 Prometheus 惯例一致
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PHASES = ('dns', 'connect', 'ttfb', 'body')
+# 上游拉取中视为成功的结果：内容有变化，或 304 / 内容哈希未变而复用缓存
+FETCH_OK_OUTCOMES = ('changed', 'not_modified', 'hash_unchanged')
+
+
+def add_trace_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    注册追踪与指标导出的命令行参数
+    """
+    parser.add_argument('--trace', metavar='PATH', help="将每次探测、上游拉取与分类的结构化记录写入 JSON Lines 文件。")
+    parser.add_argument('--metrics', metavar='PATH', help="运行结束时导出 Prometheus textfile 格式的指标文件（*.prom）。")
+
+
+def phase_trace_config():
+    """
+    返回采集请求各阶段时间点的 aiohttp.TraceConfig。
+    请求时通过 session.get(url, trace_request_ctx={}) 传入一个字典，回调会写入各阶段的时间点（loop.time()）
+    """
+    import asyncio
+    import aiohttp
+
+    def mark(name):
+        async def callback(session, ctx, params):
+            marks = ctx.trace_request_ctx
+            if isinstance(marks, dict):
+                marks[name] = asyncio.get_running_loop().time()
+        return callback
+
+    async def on_reuse(session, ctx, params):
+        if isinstance(ctx.trace_request_ctx, dict):
+            ctx.trace_request_ctx['reused'] = True
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(mark('start'))
+    trace_config.on_dns_resolvehost_start.append(mark('dns_start'))
+    trace_config.on_dns_resolvehost_end.append(mark('dns_end'))
+    trace_config.on_connection_create_start.append(mark('connect_start'))
+    trace_config.on_connection_create_end.append(mark('connect_end'))
+    trace_config.on_connection_reuseconn.append(on_reuse)
+    trace_config.on_request_end.append(mark('headers'))
+    return trace_config
+
+
+def phase_durations(marks: dict, end: float) -> Dict[str, Optional[float]]:
+    """
+    把 phase_trace_config 记录的时间点换算为各阶段耗时（秒），缺失的阶段为 None
+    """
+    def span(a: str, b: str) -> Optional[float]:
+        return round(marks[b] - marks[a], 6) if a in marks and b in marks else None
+
+    durations = {
+        "dns": span('dns_start', 'dns_end'),
+        "connect": span('connect_start', 'connect_end'),
+        "ttfb": span('start', 'headers'),
+        "body": round(end - marks['headers'], 6) if 'headers' in marks else None,
+    }
+    if 'reused' in marks:
+        durations['reused'] = True
+    return durations
+
+
+def failure_reason(status: int, msg: str, attempts: List[dict]) -> str:
+    """
+    归纳单个源的失败原因：HTTP 状态码、响应无效、最后一次请求的异常类型或超时
+    """
+    if status == STATUS_NOT_TESTED:
+        return 'not_tested'
+    if status == 200:
+        return 'invalid_response'
+    if status > 0:
+        return f"http_{status}"
+    errors = [a['error'] for a in attempts if a.get('error')]
+    # 单源超时或整轮超时会取消在途请求，最后一次请求记为 CancelledError
+    if errors and errors[-1] != 'CancelledError':
+        return errors[-1]
+    return 'timeout' if errors or '超' in msg else 'unknown'
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    最近秩法计算百分位数
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def _histogram(values: Iterable[float]) -> List[int]:
+    """
+    按 LATENCY_BUCKETS 统计累积计数（最后一项为 +Inf）
+    """
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    for value in values:
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+    return counts
+
+
+def _label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class RunTrace:
+    """
+    一次运行中的结构化事件记录；线程安全，path 不为 None 时同时追加写入 JSON Lines 文件。
+    origins 为 {源名称: 来源上游 URL}，由流水线在合并阶段填入，用于按上游统计失效源
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.records: List[dict] = []
+        self.origins: Dict[str, str] = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8') if path else None
+
+    def emit(self, kind: str, **fields) -> dict:
+        record = {"ts": round(time.time(), 3), "kind": kind, **fields}
+        with self._lock:
+            self.records.append(record)
+            if self._file:
+                self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return record
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def of_kind(self, kind: str) -> List[dict]:
+        return [r for r in self.records if r['kind'] == kind]
+
+    def record_probes(self, apis: Dict[str, str], results, probe_stats: Dict[str, dict]) -> None:
+        """
+        根据测速结果与 probe_stats 中逐次请求的记录（attempts）生成 probe_request 与 probe 事件
+        """
+        for name, test_url, ok, status, msg in results:
+            api_url = apis[name]
+            stats = probe_stats.get(name, {})
+            attempts = stats.get('attempts', [])
+            for attempt in attempts:
+                url = attempt.get('url', '')
+                variant = url[len(api_url):] if url.startswith(api_url) else url
+                self.emit('probe_request', source=name, variant=variant,
+                          **{k: v for k, v in attempt.items() if k != 'url'})
+            self.emit('probe', source=name, api=api_url, upstream=self.origins.get(name), ok=ok, status=status,
+                      variant=test_url[len(api_url):] if ok and test_url.startswith(api_url) else None,
+                      reason=None if ok else failure_reason(status, msg, attempts), message=None if ok else msg,
+                      elapsed=round(stats['elapsed'], 6) if 'elapsed' in stats else None,
+                      bytes=stats.get('bytes_read', 0), requests=len(attempts))
+
+    def print_summary(self) -> None:
+        """
+        打印本次运行的汇总：上游拉取、探测延迟直方图、分阶段耗时、失败原因与分类结果（阶段耗时由 StageTimer 打印）
+        """
+        print("\n" + "=" * 30 + " 运行汇总 " + "=" * 30)
+        # 每个上游只显示最后一条记录（成功的那次请求，或全部失败后的最终结果）
+        fetches = {r['url']: r for r in self.of_kind('fetch')}
+        if fetches:
+            print("\n上游拉取:")
+            for record in fetches.values():
+                state = record.get('outcome')
+                print(f"  {record['url']}: {state}，共 {record['attempt']} 次请求，{record.get('bytes', 0) / 1024:.1f} KB，"
+                      f"{record['elapsed'] * 1000:.0f} ms" + (f"，{record['error']}" if record.get('error') else ""))
+
+        probes = self.of_kind('probe')
+        if probes:
+            ok = [p for p in probes if p['ok']]
+            print(f"\n探测: {len(ok)}/{len(probes)} 个源有效，共 {sum(p['requests'] for p in probes)} 次请求，"
+                  f"读取 {sum(p['bytes'] for p in probes) / 1024:.1f} KB")
+            elapsed = [p['elapsed'] for p in ok if p['elapsed'] is not None]
+            if elapsed:
+                print("有效源探测耗时分布:")
+                counts = _histogram(elapsed)
+                previous = 0
+                labels = [f"≤{bound * 1000:g}ms" for bound in LATENCY_BUCKETS] + ["更慢"]
+                width = max(counts[-1], 1)
+                for label, count in zip(labels, counts):
+                    in_bucket = count - previous
+                    previous = count
+                    print(f"  {label:>10} {'█' * round(in_bucket * 40 / width):<40} {in_bucket}")
+
+            requests = [r for r in self.of_kind('probe_request') if r.get('status') == 200]
+            phase_lines = []
+            for phase in PHASES:
+                values = [r[phase] * 1000 for r in requests if r.get(phase) is not None]
+                if values:
+                    phase_lines.append(f"{phase} p50 {percentile(values, 50):.0f} / p90 {percentile(values, 90):.0f} ms")
+            if phase_lines:
+                # 只有异步引擎能观察到建连阶段，也才知道是否复用了连接
+                traced = [r for r in requests if 'connect' in r]
+                reuse = f"，复用连接 {sum(1 for r in traced if r.get('reused'))}/{len(traced)}" if traced else ""
+                print("分阶段耗时（HTTP 200 的请求）: " + "，".join(phase_lines) + reuse)
+
+            failed = [p for p in probes if not p['ok']]
+            if failed:
+                print("失败原因: " + ", ".join(f"{reason}×{count}" for reason, count in
+                                             Counter(p['reason'] for p in failed).most_common()))
+                by_upstream = Counter(p['upstream'] for p in failed if p['upstream'])
+                if by_upstream:
+                    print("各上游的失效源数:")
+                    for upstream, count in by_upstream.most_common():
+                        total = sum(1 for p in probes if p['upstream'] == upstream)
+                        print(f"  {upstream}: {count}/{total}")
+
+        classified = self.of_kind('classify')
+        if classified:
+            adult = [c for c in classified if c['adult']]
+            fields = Counter(c['field'].split()[0] for c in adult)
+            print(f"\n分类: {len(classified) - len(adult)} 个正常源，{len(adult)} 个成人源"
+                  + (f"（按 {', '.join(f'{k}×{v}' for k, v in fields.most_common())} 命中）" if adult else ""))
+
+    def prometheus_text(self) -> str:
+        """
+        生成 Prometheus textfile 格式的指标
+        """
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: Iterable):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{_label(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        def histogram(name: str, help_text: str, series: Dict[tuple, List[float]], label_names: tuple):
+            samples = []
+            for key, values in series.items():
+                labels = dict(zip(label_names, key))
+                for bound, count in zip(list(LATENCY_BUCKETS) + ['+Inf'], _histogram(values)):
+                    samples.append(({**labels, "le": bound}, count))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, value in samples:
+                lines.append(f"{name}_bucket{{{','.join(f'{k}={chr(34)}{_label(v)}{chr(34)}' for k, v in labels.items())}}} {value}")
+            for key, values in series.items():
+                label_text = ','.join(f'{k}="{_label(v)}"' for k, v in zip(label_names, key))
+                suffix = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{name}_sum{suffix} {sum(values):.6f}")
+                lines.append(f"{name}_count{suffix} {len(values)}")
+
+        metric('tvapi_run_timestamp_seconds', 'gauge', "本次运行开始的 Unix 时间戳", [({}, round(self.started_at, 3))])
+        metric('tvapi_stage_duration_seconds', 'gauge', "流水线各阶段耗时",
+               [({"stage": r['stage']}, round(r['elapsed'], 6)) for r in self.of_kind('stage')])
+
+        fetches = {}
+        for record in self.of_kind('fetch'):
+            fetches[record['url']] = record  # 只保留每个上游的最后一次尝试
+        metric('tvapi_upstream_fetch_success', 'gauge', "上游拉取是否成功（含 304/内容未变）",
+               [({"upstream": url}, int(r['outcome'] in FETCH_OK_OUTCOMES)) for url, r in fetches.items()])
+        metric('tvapi_upstream_fetch_attempts', 'gauge', "上游请求次数",
+               [({"upstream": url}, r['attempt']) for url, r in fetches.items()])
+        metric('tvapi_upstream_fetch_duration_seconds', 'gauge', "上游最后一次请求的耗时（全部失败时为总耗时）",
+               [({"upstream": url}, round(r['elapsed'], 6)) for url, r in fetches.items()])
+        metric('tvapi_upstream_fetch_bytes', 'gauge', "上游响应体字节数",
+               [({"upstream": url}, r.get('bytes', 0)) for url, r in fetches.items()])
+
+        probes = self.of_kind('probe')
+        results = Counter('ok' if p['ok'] else 'failed' for p in probes)
+        metric('tvapi_probe_sources', 'gauge', "本轮探测的源数", [({"result": k}, v) for k, v in sorted(results.items())])
+        metric('tvapi_probe_failures', 'gauge', "按失败原因统计的失效源数",
+               [({"reason": k}, v) for k, v in Counter(p['reason'] for p in probes if not p['ok']).most_common()])
+        metric('tvapi_probe_failures_by_upstream', 'gauge', "按来源上游统计的失效源数",
+               [({"upstream": k}, v) for k, v in
+                Counter(p['upstream'] for p in probes if not p['ok'] and p['upstream']).most_common()])
+        metric('tvapi_probe_bytes_total', 'counter', "探测读取的响应字节数", [({}, sum(p['bytes'] for p in probes))])
+        histogram('tvapi_probe_duration_seconds', "有效源的探测总耗时",
+                  {(): [p['elapsed'] for p in probes if p['ok'] and p['elapsed'] is not None]}, ())
+        phases = defaultdict(list)
+        for record in self.of_kind('probe_request'):
+            for phase in PHASES:
+                if record.get(phase) is not None:
+                    phases[(phase,)].append(record[phase])
+        histogram('tvapi_probe_phase_seconds', "探测请求各阶段耗时", dict(phases), ('phase',))
+
+        classified = Counter(('adult' if c['adult'] else 'normal', c['field'].split()[0] if c['adult'] else '')
+                             for c in self.of_kind('classify'))
+        metric('tvapi_classified_sources', 'gauge', "分类结果",
+               [({"class": cls, "field": field}, v) for (cls, field), v in sorted(classified.items())])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str) -> None:
+        write_text_atomic(path, self.prometheus_text())
+        print(f"📈 指标已导出到 {path}")
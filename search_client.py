@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+并发搜索客户端：像 MoonTV 一类的客户端那样，用 ?wd= 同时搜索配置中的所有源并合并结果。
+
+- 每个源单独限时（--timeout），结果按返回的先后逐个输出，不等最慢的源
+- 不同源返回的同一部影片按规范化后的片名与年份合并（去掉括号内的"国语"、"HD"等标注、空白与标点）
+- 最近的查询按 LRU + TTL 缓存，重复查询直接回放上一次的结果
+- 报告每个源的搜索耗时；加上 --record 时写入探测历史，测速阶段排序时一并参考
+
+用法: python search_client.py 流浪地球 [--config config.json] [--timeout 5] [--record]
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import aiohttp
+
+from host_scheduler import DEFAULT_PER_HOST
+from probe_common import CONNECT_TIMEOUT, TEST_HEADERS, validate_api_response
+from probe_engine import DEFAULT_CONCURRENCY
+from probe_state import HISTORY_PATH, ProbeHistory
+
+SEARCH_VARIANT = '?ac=videolist&wd='
+DEFAULT_SEARCH_TIMEOUT = 5
+# 单个源的搜索响应最多读取的字节数
+MAX_SEARCH_BYTES = 2 * 1024 * 1024
+# 查询缓存的默认容量与有效期（秒）
+DEFAULT_CACHE_SIZE = 128
+DEFAULT_CACHE_TTL = 600
+
+_BRACKETS = re.compile(r'[(\[【（《<「].*?[)\]】）》>」]')
+_YEAR = re.compile(r'(?<!\d)(19|20)\d{2}(?!\d)')
+_NOISE = re.compile(r'[\W_]+')
+
+
+def normalize_title(name: str) -> str:
+    """
+    规范化片名用于跨源合并：全角转半角、转小写，去掉括号及其中的标注、空白与标点
+    """
+    text = unicodedata.normalize('NFKC', name).lower()
+    return _NOISE.sub('', _BRACKETS.sub('', text))
+
+
+def item_year(item: dict) -> Optional[str]:
+    """
+    取影片年份：优先 vod_year 字段，没有时从片名中查找四位年份
+    """
+    year = str(item.get('vod_year') or '').strip()
+    if _YEAR.fullmatch(year):
+        return year
+    found = _YEAR.search(str(item.get('vod_name') or ''))
+    return found.group(0) if found else None
+
+
+class SearchCache:
+    """
+    查询结果的 LRU + TTL 缓存：最多保留 maxsize 个查询，每个查询 ttl 秒后过期
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE, ttl: float = DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[float, list]]' = OrderedDict()
+
+    def get(self, query: str) -> Optional[list]:
+        entry = self._entries.get(query)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._entries[query]
+            return None
+        self._entries.move_to_end(query)
+        return entry[1]
+
+    def put(self, query: str, value: list) -> None:
+        self._entries[query] = (time.monotonic(), value)
+        self._entries.move_to_end(query)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class SearchResults:
+    """
+    合并后的搜索结果：{(规范化片名, 年份): {"name", "year", "sources": [{"source", "vod_id", "vod_name"}]}}，
+    以及每个源的搜索耗时（毫秒，失败为 None）
+    """
+
+    def __init__(self):
+        self.titles: Dict[Tuple[str, Optional[str]], dict] = {}
+        self.latency: Dict[str, Optional[float]] = {}
+
+    def add(self, source: str, items: List[dict]) -> List[dict]:
+        """
+        合并一个源的结果，返回本次新出现的影片
+        """
+        new = []
+        for item in items:
+            name = item.get('vod_name')
+            if not isinstance(name, str) or not normalize_title(name):
+                continue
+            year = item_year(item)
+            key = (normalize_title(name), year)
+            entry = self.titles.get(key)
+            if entry is None:
+                entry = self.titles[key] = {"name": _BRACKETS.sub('', name).strip() or name, "year": year,
+                                            "sources": []}
+                new.append(entry)
+            entry['sources'].append({"source": source, "vod_id": item.get('vod_id'), "vod_name": name})
+        return new
+
+    def apply(self, event: dict) -> List[dict]:
+        self.latency[event['source']] = event['latency_ms'] if event['ok'] else None
+        return self.add(event['source'], event['items']) if event['ok'] else []
+
+
+class SearchClient:
+    """
+    并发搜索 sources（config.json 中 api_site 格式的 {源名称: {"api", "name", ...}}）；
+    在 async with 中使用，或用完后调用 close()。与 MoonTV 等客户端一样默认同时向所有源发出请求，
+    per_host 大于 0 时限制同一域名的连接数（排队时间计入该源的搜索限时）
+    """
+
+    def __init__(self, sources: Dict[str, dict], timeout: float = DEFAULT_SEARCH_TIMEOUT,
+                 concurrency: int = DEFAULT_CONCURRENCY, per_host: int = 0,
+                 max_bytes: int = MAX_SEARCH_BYTES, cache: Optional[SearchCache] = None):
+        self.sources = {name: details['api'] for name, details in sources.items()
+                        if isinstance(details, dict) and isinstance(details.get('api'), str)}
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.max_bytes = max_bytes
+        self.cache = cache if cache is not None else SearchCache()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> 'SearchClient':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=max(self.per_host, 0),
+                                             ssl=False, ttl_dns_cache=300)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=min(CONNECT_TIMEOUT, self.timeout))
+            self._session = aiohttp.ClientSession(connector=connector, headers=TEST_HEADERS, timeout=timeout)
+        return self._session
+
+    async def search_source(self, name: str, api_url: str, query: str) -> dict:
+        """
+        搜索单个源，返回事件 {"source", "ok", "latency_ms", "items", "error"}；整个请求不超过 self.timeout 秒
+        """
+        start = time.perf_counter()
+        try:
+            body = await asyncio.wait_for(self._fetch(f"{api_url}{SEARCH_VARIANT}{quote(query)}"), self.timeout)
+            data = json.loads(body.decode('utf-8-sig', 'replace'))
+            if not isinstance(data, dict) or data.get('code') not in (1, 200) or not isinstance(data.get('list'), list):
+                raise ValueError('invalid_response')
+            if data['list'] and not validate_api_response(data):
+                raise ValueError('invalid_response')
+            items, error = [item for item in data['list'] if isinstance(item, dict)], None
+        except asyncio.TimeoutError:
+            items, error = [], 'timeout'
+        except ValueError as e:
+            items, error = [], 'too_large' if str(e) == 'too_large' else 'invalid_response'
+        except aiohttp.ClientResponseError as e:
+            items, error = [], f"http_{e.status}"
+        except aiohttp.ClientError as e:
+            items, error = [], type(e).__name__
+        return {"source": name, "ok": error is None, "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+                "items": items, "error": error}
+
+    async def _fetch(self, url: str) -> bytes:
+        async with self.session().get(url) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status)
+            body = await response.content.read(self.max_bytes + 1)
+            while len(body) <= self.max_bytes:
+                chunk = await response.content.read(self.max_bytes + 1 - len(body))
+                if not chunk:
+                    break
+                body += chunk
+            if len(body) > self.max_bytes:
+                raise ValueError('too_large')
+            return body
+
+    async def search_stream(self, query: str) -> AsyncIterator[dict]:
+        """
+        逐个产出各源的搜索事件（先返回的先产出）；命中缓存时直接回放上一次的事件，每个事件带 cached 标记
+        """
+        key = ' '.join(query.split())
+        cached = self.cache.get(key)
+        if cached is not None:
+            for event in cached:
+                yield dict(event, cached=True)
+            return
+        events = []
+        tasks = [asyncio.ensure_future(self.search_source(name, url, key)) for name, url in self.sources.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                event = await next_done
+                events.append(event)
+                yield dict(event, cached=False)
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.cache.put(key, events)
+
+    async def search(self, query: str) -> SearchResults:
+        results = SearchResults()
+        async for event in self.search_stream(query):
+            results.apply(event)
+        return results
+
+
+def load_sources(paths: List[str]) -> Dict[str, dict]:
+    sources: Dict[str, dict] = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            sources.update(json.load(f).get('api_site', {}))
+    return sources
+
+
+def print_latency_report(results: SearchResults) -> None:
+    """
+    按耗时从快到慢打印各源的搜索耗时，失败的源排在最后
+    """
+    ok = sorted((item for item in results.latency.items() if item[1] is not None), key=lambda item: item[1])
+    failed = [name for name, latency in results.latency.items() if latency is None]
+    print(f"\n{'源':<24}{'搜索耗时 ms':>12}")
+    for name, latency in ok:
+        print(f"{name:<24}{latency:>12}")
+    if failed:
+        print(f"❌ {len(failed)} 个源搜索失败: {', '.join(failed)}")
+
+
+async def run_search(args: argparse.Namespace) -> SearchResults:
+    sources = load_sources(args.config)
+    print(f"🔍 在 {len(sources)} 个源中搜索 “{args.query}”（每个源限时 {args.timeout:g} 秒）")
+    results = SearchResults()
+    start = time.perf_counter()
+    async with SearchClient(sources, timeout=args.timeout, concurrency=args.concurrency,
+                            per_host=args.per_host) as client:
+        async for event in client.search_stream(args.query):
+            new = results.apply(event)
+            if not event['ok']:
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"[{elapsed:7.0f} ms] {event['source']}: {len(event['items'])} 条结果"
+                  + (f"，新增 {len(new)} 部: " + "、".join(f"{e['name']}({e['year'] or '?'})" for e in new) if new else ""))
+    print(f"\n共 {len(results.titles)} 部影片（合并自 {sum(len(e['sources']) for e in results.titles.values())} 条结果）:")
+    for entry in sorted(results.titles.values(), key=lambda e: len(e['sources']), reverse=True):
+        print(f"  {entry['name']} ({entry['year'] or '?'}) - {len(entry['sources'])} 个源")
+    print_latency_report(results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发搜索配置中的所有源并合并结果。")
+    parser.add_argument('query', help="搜索关键词")
+    parser.add_argument('--config', action='append', default=None,
+                        help="要搜索的配置文件，可重复指定（默认 config.json）。")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_SEARCH_TIMEOUT,
+                        help=f"每个源的搜索限时秒数（默认 {DEFAULT_SEARCH_TIMEOUT}）。")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"最大并发请求数（默认 {DEFAULT_CONCURRENCY}）。")
+    parser.add_argument('--per-host', type=int, default=0,
+                        help=f"同一域名的最大连接数（默认 0 表示不限制；测速阶段默认为 {DEFAULT_PER_HOST}）。")
+    parser.add_argument('--record', action='store_true',
+                        help="把各源的搜索耗时写入探测历史，按延迟排序时一并参考。")
+    parser.add_argument('--history', default=HISTORY_PATH, help=f"探测历史数据库路径（默认 {HISTORY_PATH}）。")
+    args = parser.parse_args()
+    args.config = args.config or ['config.json']
+
+    results = asyncio.run(run_search(args))
+    if args.record:
+        sources = load_sources(args.config)
+        history = ProbeHistory(args.history)
+        try:
+            for name, latency in results.latency.items():
+                history.record_search(sources[name]['api'], latency, latency is not None)
+            history.commit()
+        finally:
+            history.close()
+        print(f"📝 {len(results.latency)} 个源的搜索耗时已写入 {args.history}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
+import argparse
 import json
 import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+from config_io import MANIFEST_FILE, publish_config, write_manifest
+from probe_state import HISTORY_PATH, ProbeHistory
+from run_trace import RunTrace, add_trace_arguments
 
 # --- 配置区 ---
 INPUT_CONFIG_FILE = 'config.json'
@@ -31,25 +39,155 @@ ADULT_KEYWORDS = [
     '🔞'
 ]
 
-def classify_and_separate_sources():
+# 按内容识别时使用的关键词：只收录几乎不会出现在正常影视站分类与片名中的词，
+# '伦理'、'三级'、'福利' 等在正常站点中也常见的分类不在其列
+CONTENT_KEYWORDS = [
+    '无码', '有码', '自拍', '偷拍', '女优', '巨乳', '美乳', '人妻', '熟女', '萝莉',
+    '探花', '中出', '素人', '约啪', '口交', '乱伦', '调教', '丝袜', '制服诱惑',
+    '成人', '色情', '情色', '18禁', '十八禁', '番号', '麻豆', '糖心', '蜜桃传媒',
+    '果冻传媒', '天美传媒', '黑料', '福利姬', '🔞'
+]
+# 摘要（分类名称 + 影片标题）中至少有这么多项命中才按内容判定为成人源
+CONTENT_MIN_HITS = 2
+
+# 从 API 链接中取出域名部分（跳过协议与用户信息，不含端口），比 urlparse 快得多
+_HOST_RE = re.compile(r'\s*[a-zA-Z][\w+.-]*://(?:[^/?#@]*@)?([^/?#:]*)')
+
+def _token_regex(keyword: str) -> str:
     """
-    读取配置文件，根据关键词分类API源，并分别写入两个文件。
+    把（已转为小写的）关键词转成只匹配完整词元的正则：首尾是英文字母时两侧不能紧挨字母，
+    是数字时不能紧挨数字，中文等其他字符不设边界
     """
-    print("--- 步骤 3: 开始分类视频源 ---")
-    
-    # 检查输入文件是否存在
-    if not os.path.exists(INPUT_CONFIG_FILE):
-        print(f"错误: 输入文件 '{INPUT_CONFIG_FILE}' 未找到。请确保前序步骤已成功生成该文件。")
-        return
+    def boundary(char: str) -> str:
+        if char.isascii() and char.isalpha():
+            return 'a-z'
+        if char.isascii() and char.isdigit():
+            return '0-9'
+        return ''
+    pattern = re.escape(keyword)
+    head, tail = boundary(keyword[0]), boundary(keyword[-1])
+    return (f'(?<![{head}])' if head else '') + pattern + (f'(?![{tail}])' if tail else '')
 
-    # 读取原始配置文件
+class KeywordClassifier:
+    """
+    由关键词列表一次性编译出的分类器：所有关键词转为小写后合并为一个正则交替式，
+    较长的关键词排在前面，同一位置能匹配多个关键词时报告最长的那个。
+
+    名称按子串匹配；键名与域名只按完整词元匹配（以 '.'、'_'、'-' 及字母与数字的交界为界，
+    'avatar'、'jav' 不再命中 'AV'），且不使用纯数字关键词（'api_91'、'lziapi91' 里的 91 多是编号）。
+    """
+
+    # 参与匹配的字段：名称单独匹配，键名与域名按词元匹配
+    FIELDS = ('name', 'key', 'host')
+
+    def __init__(self, keywords: Iterable[str]):
+        # 忽略大小写去重，保留首次出现的写法用于报告
+        canonical: Dict[str, str] = {}
+        for keyword in keywords:
+            canonical.setdefault(keyword.lower(), keyword)
+        self._canonical = canonical
+        ordered = sorted(canonical, key=len, reverse=True)
+        # 不使用 re.IGNORECASE：先把文本整体转为小写再匹配要快数倍
+        self.pattern = re.compile('|'.join(map(re.escape, ordered)))
+        # 没有可用于键名与域名的关键词时用永不匹配的正则，空交替式会匹配任何文本
+        self.token_pattern = re.compile('|'.join(_token_regex(keyword) for keyword in ordered
+                                                 if not keyword.isdigit()) or '(?!)')
+
+    def _search(self, pattern, texts: Tuple[str, ...]) -> Optional[Tuple[str, int]]:
+        # 用换行分隔各段文本（关键词中不含换行），避免跨段误匹配
+        text = '\n'.join(texts).lower()
+        # 带边界断言的交替式无法按首字符快速跳过，先用子串交替式排除大多数不含任何关键词的文本
+        if pattern is not self.pattern and not self.pattern.search(text):
+            return None
+        found = pattern.search(text)
+        if not found:
+            return None
+        return self._canonical[found.group(0)], text.count('\n', 0, found.start())
+
+    def match(self, *texts: str) -> Optional[Tuple[str, int]]:
+        """
+        在多段文本中按子串查找第一个命中的关键词，返回 (关键词, 所在文本的序号)，未命中返回 None
+        """
+        return self._search(self.pattern, texts)
+
+    def match_tokens(self, *texts: str) -> Optional[Tuple[str, int]]:
+        """
+        与 match 相同，但关键词必须是完整词元，且不含纯数字关键词，用于键名与域名
+        """
+        return self._search(self.token_pattern, texts)
+
+    def classify_source(self, key: str, details: dict) -> Optional[Tuple[str, str]]:
+        """
+        同时匹配源的名称、键名与 API 域名，返回 (命中的关键词, 字段名)，未命中返回 None
+        """
+        name = details.get('name')
+        result = self.match(name) if isinstance(name, str) else None
+        if result is not None:
+            return result[0], 'name'
+        api = details.get('api')
+        host = _HOST_RE.match(api) if isinstance(api, str) else None
+        result = self.match_tokens(key, host.group(1) if host else '')
+        if result is None:
+            return None
+        keyword, index = result
+        return keyword, self.FIELDS[index + 1]
+
+DEFAULT_CLASSIFIER = KeywordClassifier(ADULT_KEYWORDS)
+CONTENT_CLASSIFIER = KeywordClassifier(CONTENT_KEYWORDS)
+
+def classify_digest(digest: dict, classifier: Optional[KeywordClassifier] = None,
+                    min_hits: int = CONTENT_MIN_HITS) -> Optional[Tuple[str, int]]:
+    """
+    按探测时收集的内容摘要（分类名称与影片标题）判断是否为成人源，
+    命中项数达到 min_hits 时返回 (命中的关键词, 命中项数)，否则返回 None
+    """
+    classifier = classifier or CONTENT_CLASSIFIER
+    keywords = Counter()
+    for text in list(digest.get('categories', [])) + list(digest.get('titles', [])):
+        result = classifier.match(text) if isinstance(text, str) else None
+        if result:
+            keywords[result[0]] += 1
+    hits = sum(keywords.values())
+    if hits < min_hits:
+        return None
+    return '、'.join(keyword for keyword, _ in keywords.most_common()), hits
+
+def load_digests(config: dict, history_path: str = HISTORY_PATH) -> Dict[str, dict]:
+    """
+    从探测历史中读取各个源最近一次的内容摘要，没有探测历史时返回空字典
+    """
+    if not os.path.exists(history_path):
+        return {}
+    history = ProbeHistory(history_path)
     try:
-        with open(INPUT_CONFIG_FILE, 'r', encoding='utf-8') as f:
-            original_config = json.load(f)
-    except json.JSONDecodeError:
-        print(f"错误: 无法解析 '{INPUT_CONFIG_FILE}'。文件可能已损坏或格式不正确。")
-        return
-        
+        apis = {key: value['api'] for key, value in config.get('api_site', {}).items()
+                if isinstance(value, dict) and isinstance(value.get('api'), str)}
+        return history.digests(apis)
+    finally:
+        history.close()
+
+def classify_source(key: str, details: dict, digest: Optional[dict] = None,
+                    classifier: Optional[KeywordClassifier] = None) -> Optional[Tuple[str, str]]:
+    """
+    判断单个源是否为成人源：先匹配名称、键名与域名，都未命中时再看内容摘要，
+    返回 (命中的关键词, 命中依据)，未命中返回 None
+    """
+    match = (classifier or DEFAULT_CLASSIFIER).classify_source(key, details)
+    if not match and digest:
+        content = classify_digest(digest)
+        if content:
+            match = (content[0], f"内容 {content[1]} 项")
+    return match
+
+def split_sources(original_config: dict, classifier: Optional[KeywordClassifier] = None,
+                  digests: Optional[Dict[str, dict]] = None, trace: Optional[RunTrace] = None) -> Tuple[dict, dict]:
+    """
+    根据关键词将配置拆分为 (正常源配置, 成人源配置)，两者都继承原始文件的元数据（如 cache_time）。
+    名称、键名与域名都未命中时，再用 digests 中该源的内容摘要按分类与标题判断；
+    trace 不为 None 时记录每个源的分类结果与命中依据
+    """
+    classifier = classifier or DEFAULT_CLASSIFIER
+    digests = digests or {}
     # 创建两个新的配置模板，继承原始文件的元数据（如 cache_time）
     normal_config = original_config.copy()
     adult_config = original_config.copy()
@@ -60,43 +198,85 @@ def classify_and_separate_sources():
     
     all_sources = original_config.get('api_site', {})
     
-    print(f"开始从 {len(all_sources)} 个源中进行分类...")
+    print(f"开始从 {len(all_sources)} 个源中进行分类（其中 {sum(1 for key in all_sources if key in digests)} 个源有内容摘要）...")
 
-    # 遍历所有源进行分类
+    # 遍历所有源进行分类，命中的关键词逐条打印，便于审核关键词列表
+    hits = Counter()
     for key, details in all_sources.items():
-        is_adult = False
-        source_name = details.get('name', '').lower() # 获取源名称并转为小写
-
-        # 检查名称是否包含任何成人关键词
-        for keyword in ADULT_KEYWORDS:
-            if keyword.lower() in source_name:
-                is_adult = True
-                break # 找到一个关键词就足够了，跳出内层循环
-        
-        if is_adult:
+        match = classify_source(key, details, digests.get(key), classifier)
+        if trace:
+            trace.emit('classify', source=key, adult=bool(match), keyword=match[0] if match else None,
+                       field=match[1] if match else None, has_digest=key in digests)
+        if match:
+            keyword, field = match
+            hits[keyword] += 1
+            print(f"🔞 [{key}] {details.get('name', '')} <- 命中关键词 '{keyword}' ({field})")
             adult_sources[key] = details
         else:
             normal_sources[key] = details
+    if hits:
+        print("关键词命中统计: " + ", ".join(f"{keyword}×{count}" for keyword, count in hits.most_common()))
 
     # 将分类好的源放回配置模板
     normal_config['api_site'] = normal_sources
     adult_config['api_site'] = adult_sources
+    return normal_config, adult_config
 
-    # 写入正常源配置文件
-    try:
-        with open(NORMAL_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(normal_config, f, indent=4, ensure_ascii=False)
-        print(f"处理完成: {len(normal_sources)} 个正常源已写入 '{NORMAL_OUTPUT_FILE}'")
-    except IOError as e:
-        print(f"错误: 写入 '{NORMAL_OUTPUT_FILE}' 失败: {e}")
+def write_separated_configs(normal_config: dict, adult_config: dict,
+                            normal_path: str = NORMAL_OUTPUT_FILE, adult_path: str = ADULT_OUTPUT_FILE) -> bool:
+    """
+    分别发布正常源与成人源配置文件（含紧凑格式、预压缩版本与差异补丁，见 config_io.publish_config），
+    并更新 manifest.json；全部写入成功且至少一个文件有改动时返回 True
+    """
+    ok, changed = True, False
+    for path, config, label in ((normal_path, normal_config, '正常源'), (adult_path, adult_config, '成人源')):
+        try:
+            if publish_config(path, config):
+                changed = True
+                print(f"处理完成: {len(config['api_site'])} 个{label}已写入 '{path}'")
+        except OSError as e:
+            print(f"错误: 写入 '{path}' 失败: {e}")
+            ok = False
+    if changed:
+        try:
+            write_manifest((normal_path, adult_path))
+        except OSError as e:
+            print(f"错误: 写入 '{MANIFEST_FILE}' 失败: {e}")
+            ok = False
+    return ok and changed
+
+def classify_and_separate_sources():
+    """
+    读取配置文件，根据关键词分类API源，并分别写入两个文件。
+    """
+    parser = argparse.ArgumentParser(description="按关键词与内容摘要把 config.json 拆分为正常源与成人源。")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
 
-    # 写入成人源配置文件
+    print("--- 步骤 3: 开始分类视频源 ---")
+    
+    # 检查输入文件是否存在
+    if not os.path.exists(INPUT_CONFIG_FILE):
+        print(f"错误: 输入文件 '{INPUT_CONFIG_FILE}' 未找到。请确保前序步骤已成功生成该文件。")
+        return
+
+    # 读取原始配置文件
+    try:
+        with open(INPUT_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            original_config = json.load(f)
+    except json.JSONDecodeError:
+        print(f"错误: 无法解析 '{INPUT_CONFIG_FILE}'。文件可能已损坏或格式不正确。")
+        return
+    
+    trace = RunTrace(args.trace)
     try:
-        with open(ADULT_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(adult_config, f, indent=4, ensure_ascii=False)
-        print(f"处理完成: {len(adult_sources)} 个成人源已写入 '{ADULT_OUTPUT_FILE}'")
-    except IOError as e:
-        print(f"错误: 写入 '{ADULT_OUTPUT_FILE}' 失败: {e}")
+        normal_config, adult_config = split_sources(original_config, digests=load_digests(original_config), trace=trace)
+    finally:
+        trace.close()
+    write_separated_configs(normal_config, adult_config)
+    trace.print_summary()
+    if args.metrics:
+        trace.write_prometheus(args.metrics)
 
 if __name__ == "__main__":
     classify_and_separate_sources()
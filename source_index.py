@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+源的规范化索引：在探测之前尽量缩小需要探测的源集合。
+
+- normalize_api_url: 只去掉首尾空格、末尾斜杠与协议的简单规范化，canonical_api_url 无法解析时退回使用
+- canonical_api_url: 比 normalize_api_url 更彻底的 URL 规范化，用于合并、去重与探测历史中识别同一个接口
+- remove_duplicate_apis: 按 canonical_api_url 去掉配置中重复的源，保留首次出现的一个
+- find_mirrors: 按另行请求的多项首页内容指纹识别镜像站，每组只保留最快的一个
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+# 省略后等价的默认端口（http/https 差异已被抹平，两个端口都视为默认）
+_DEFAULT_PORTS = (None, 80, 443)
+# maccms 中与 /api.php/provide/vod 等价的路径后缀（at/json 即默认的 JSON 格式）
+_MACCMS_EQUIVALENT_SUFFIXES = ('/at/json',)
+# 不影响接口本身的查询参数：测速和客户端都会自行追加 ac，at=json 为默认格式
+_NEUTRAL_QUERY = {('ac', 'list'), ('ac', 'videolist'), ('ac', 'detail'), ('at', 'json')}
+
+
+def normalize_api_url(url: str) -> str:
+    """
+    标准化 API URL 用于比对：去除首尾空格与末尾斜杠，并抹平 http/https 差异
+    """
+    clean_url = url.strip().rstrip('/')
+    return clean_url.replace("https://", "").replace("http://", "")
+
+
+def canonical_api_url(url: str) -> str:
+    """
+    规范化 API URL 用于识别同一个接口：
+
+    - 抹平 http/https 差异，域名转为小写并去掉末尾的点与 www. 前缀，省略默认端口
+    - 合并路径中重复的斜杠，去掉末尾斜杠，把 maccms 的等价路径写法（如 /at/json）折叠为基础路径
+    - 去掉不影响接口的查询参数，其余参数按名称排序
+    """
+    clean_url = url.strip()
+    if '://' not in clean_url:
+        clean_url = 'http://' + clean_url
+    try:
+        parts = urlsplit(clean_url)
+        port = parts.port
+    except ValueError:
+        return normalize_api_url(url)
+
+    host = (parts.hostname or '').rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    if ':' in host:
+        host = f"[{host}]"
+    netloc = host if port in _DEFAULT_PORTS else f"{host}:{port}"
+    userinfo = parts.netloc.rpartition('@')[0]
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+
+    path = re.sub(r'/{2,}', '/', parts.path).rstrip('/')
+    if '/provide/vod' in path.lower():
+        for suffix in _MACCMS_EQUIVALENT_SUFFIXES:
+            if path.lower().endswith(suffix):
+                path = path[:-len(suffix)]
+
+    query = sorted(pair for pair in parse_qsl(parts.query, keep_blank_values=True)
+                   if (pair[0].lower(), pair[1].lower()) not in _NEUTRAL_QUERY)
+    return netloc + path + ('?' + urlencode(query) if query else '')
+
+
+def remove_duplicate_apis(config: dict) -> Tuple[dict, List[Tuple[str, str]]]:
+    """
+    优化版去重核心：按 canonical_api_url 规范化后对比URL，
+    忽略空格、末尾斜杠、HTTP/HTTPS、域名大小写、www.、默认端口、查询参数顺序及 maccms 等价路径的差异
+    """
+    api_sites = config.get('api_site', {})
+    seen_urls = {}
+    removed_apis = []
+
+    new_api_sites = {}
+    for name, value in api_sites.items():
+        if 'api' in value and isinstance(value['api'], str):
+            original_url = value['api']
+
+            # --- 优化点：清洗 URL 用于严格去重对比 ---
+            compare_url = canonical_api_url(original_url)
+
+            if compare_url in seen_urls:
+                # 发现重复的API
+                removed_apis.append((name, original_url))
+                print(f"✂️ 已清理重复 API: [{name}] -> {original_url}")
+                print(f"   (由于内容等同于首次出现的: [{seen_urls[compare_url]}])")
+            else:
+                # 首次出现的API，记录其清洗后的用于后续比对的特征码
+                seen_urls[compare_url] = name
+                new_api_sites[name] = value
+        else:
+            # 没有 api 字段的配置也默认保留
+            new_api_sites[name] = value
+
+    # 更新配置
+    config['api_site'] = new_api_sites
+    return config, removed_apis
+
+
+def find_mirrors(fingerprints: Dict[str, Optional[str]], latency: Dict[str, float]) -> Dict[str, str]:
+    """
+    按首页内容指纹分组，同组的源视为同一站点的镜像，保留延迟最低的一个（没有延迟数据的排在最后，
+    延迟相同时保留先出现的），返回 {被折叠的源: 保留的源}
+    """
+    groups: Dict[str, list] = {}
+    for name, fingerprint in fingerprints.items():
+        if fingerprint:
+            groups.setdefault(fingerprint, []).append(name)
+    collapsed = {}
+    for names in groups.values():
+        if len(names) < 2:
+            continue
+        keep = min(names, key=lambda name: latency.get(name, float('inf')))
+        for name in names:
+            if name != keep:
+                collapsed[name] = keep
+    return collapsed
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+对通过连通性测试的源进行真实测速。
+
+每个源使用验证成功的 URL 变体采样多次，记录首字节时间（TTFB）、总耗时与下载吞吐，
+汇总出 p50/p90，可用于按延迟对 api_site 排序、写入延迟字段或剔除过慢的源。
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from probe_common import CONNECT_TIMEOUT, REQUEST_TIMEOUT, TEST_HEADERS
+from probe_engine import DEFAULT_CONCURRENCY
+from run_trace import percentile
+from search_client import DEFAULT_SEARCH_TIMEOUT
+from stream_validator import CHUNK_SIZE, MAX_PROBE_BYTES
+
+# 每个源的默认采样次数
+DEFAULT_SAMPLES = 3
+
+# 排序时一次失败的搜索按多少毫秒计：用户要白等到搜索限时为止
+SEARCH_FAILURE_PENALTY_MS = DEFAULT_SEARCH_TIMEOUT * 1000
+
+
+async def sample_once(session: aiohttp.ClientSession, url: str, max_bytes: int) -> Optional[dict]:
+    """
+    请求一次并测量 TTFB、总耗时与读取字节数，失败返回 None
+    """
+    start = time.perf_counter()
+    try:
+        async with session.get(url) as response:
+            if response.status != 200:
+                return None
+            first_chunk = await response.content.readany()
+            ttfb = time.perf_counter() - start
+            size = len(first_chunk)
+            while size < max_bytes:
+                chunk = await response.content.read(min(CHUNK_SIZE, max_bytes - size))
+                if not chunk:
+                    break
+                size += len(chunk)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+    total = time.perf_counter() - start
+    return {"ttfb": ttfb, "total": total, "bytes": size}
+
+
+def summarize_samples(samples: List[dict]) -> Optional[dict]:
+    """
+    将多次采样汇总为 p50/p90（毫秒）与中位吞吐（KB/s）
+    """
+    if not samples:
+        return None
+    ttfb = [s['ttfb'] * 1000 for s in samples]
+    total = [s['total'] * 1000 for s in samples]
+    throughput = [s['bytes'] / 1024 / s['total'] for s in samples if s['total'] > 0]
+    return {
+        "samples": len(samples),
+        "ttfb_p50": round(percentile(ttfb, 50), 1),
+        "ttfb_p90": round(percentile(ttfb, 90), 1),
+        "total_p50": round(percentile(total, 50), 1),
+        "total_p90": round(percentile(total, 90), 1),
+        "throughput_kbps": round(percentile(throughput, 50) or 0, 1),
+    }
+
+
+async def measure_all(targets: Dict[str, str], samples: int = DEFAULT_SAMPLES,
+                      concurrency: int = DEFAULT_CONCURRENCY, request_timeout: float = REQUEST_TIMEOUT,
+                      max_bytes: int = MAX_PROBE_BYTES, run_timeout: Optional[float] = None) -> Dict[str, dict]:
+    """
+    并发测速所有目标 {源名称: 测试 URL}；同一个源的多次采样依次进行，避免互相干扰。
+    run_timeout 秒后取消尚未完成的测速，只返回已完成的源
+    """
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=False, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=request_timeout, sock_connect=min(CONNECT_TIMEOUT, request_timeout))
+    semaphore = asyncio.Semaphore(concurrency)
+    speeds: Dict[str, dict] = {}
+
+    async with aiohttp.ClientSession(connector=connector, headers=TEST_HEADERS, timeout=timeout) as session:
+
+        async def measure(name: str, url: str) -> None:
+            async with semaphore:
+                results = [await sample_once(session, url, max_bytes) for _ in range(samples)]
+            summary = summarize_samples([r for r in results if r])
+            if summary:
+                speeds[name] = summary
+
+        tasks = [asyncio.ensure_future(measure(name, url)) for name, url in targets.items()]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=run_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if pending:
+                print(f"⏱️ 测速超过预算，取消剩余 {len(pending)} 个源的测速")
+    return speeds
+
+
+def run_speed_test(targets: Dict[str, str], **kwargs) -> Dict[str, dict]:
+    """
+    同步入口：在新的事件循环中运行 measure_all
+    """
+    return asyncio.run(measure_all(targets, **kwargs))
+
+
+def print_speed_report(speeds: Dict[str, dict]) -> None:
+    """
+    按 p50 总耗时从快到慢打印测速结果
+    """
+    print(f"{'源':<24}{'TTFB p50':>10}{'TTFB p90':>10}{'总耗时 p50':>12}{'总耗时 p90':>12}{'吞吐 KB/s':>12}")
+    for name, s in sorted(speeds.items(), key=lambda item: item[1]['total_p50']):
+        print(f"{name:<24}{s['ttfb_p50']:>10}{s['ttfb_p90']:>10}{s['total_p50']:>12}{s['total_p90']:>12}"
+              f"{s['throughput_kbps']:>12}")
+
+
+def search_cost(summary: dict) -> float:
+    """
+    把搜索耗时汇总（见 probe_state.ProbeHistory.record_search）折算为毫秒：
+    成功搜索的耗时 p50，加上失败比例乘以 SEARCH_FAILURE_PENALTY_MS；从未成功过时按失败计
+    """
+    if summary.get('latency_p50') is None:
+        return SEARCH_FAILURE_PENALTY_MS
+    failure_rate = summary['failures'] / (len(summary['samples']) + summary['failures'])
+    return summary['latency_p50'] + SEARCH_FAILURE_PENALTY_MS * failure_rate
+
+
+def rank_api_sites(config: dict, speeds: Dict[str, dict], sort: bool = True, write_latency: bool = False,
+                   playbacks: Optional[Dict[str, dict]] = None, searches: Optional[Dict[str, dict]] = None) -> dict:
+    """
+    按 p50 总耗时对 api_site 排序（未测速的源保持原有顺序排在最后），
+    write_latency 为 True 时为每个已测速的源写入 latency_ms 字段。
+    给出 playbacks（见 playback_probe.probe_playback）时，可播放的源按接口耗时加起播延迟排序，
+    播放失败的源排在测过速的源的最后；给出 searches（{源名称: 搜索耗时汇总}）且每个测过速的源都有记录时，
+    再加上各自的搜索代价（见 search_cost），只有部分源有记录时不参考搜索，以免没搜过的源反而排在前面
+    """
+    playbacks = playbacks or {}
+    searches = searches or {}
+    measured = [n for n in config.get('api_site', {}) if n in speeds]
+    use_search = bool(searches) and all(n in searches for n in measured)
+    if searches and not use_search and sort:
+        print(f"🔍 只有 {sum(1 for n in measured if n in searches)}/{len(measured)} 个源有搜索记录，排序不参考搜索耗时")
+
+    def rank_key(name: str):
+        playback = playbacks.get(name)
+        latency = speeds[name]['total_p50'] + (search_cost(searches[name]) if use_search else 0)
+        if playback is None:
+            return 0, latency
+        if not playback['ok']:
+            return 1, latency
+        return 0, latency + playback['startup_ms']
+
+    new_config = dict(config)
+    api_sites = config.get('api_site', {})
+    names = list(api_sites)
+    if sort:
+        names = sorted(measured, key=rank_key) + [n for n in names if n not in speeds]
+    new_sites = {}
+    for name in names:
+        value = dict(api_sites[name])
+        if write_latency and name in speeds:
+            value['latency_ms'] = round(speeds[name]['total_p50'])
+        new_sites[name] = value
+    new_config['api_site'] = new_sites
+    return new_config
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+流式、限量的 API 响应校验。
+
+部分 mac10 风格的 ac=detail 接口会忽略 limit=1，一次返回数 MB 的完整播放列表。
+validate_api_response 实际只关心顶层的 code 与 list 中第一项的 vod_id/vod_name，
+因此这里按块增量读取响应体，只解析顶层结构与第一项，拿到这些字段后立即停止读取，
+并设置读取字节数上限，超过上限时按已读到的部分给出结论。
+
+开启 collect_digest 时还会顺带收集一份内容摘要（分类名称、前几条影片标题与首页指纹），
+供 separate_sources 按内容识别成人源，无需再额外请求一次；测试变体只取 1 项，
+source_index 识别镜像站所需的多项首页指纹由 probe_engine.fetch_fingerprints 另行请求。
+"""
+import codecs
+import hashlib
+import json
+import re
+from typing import Optional
+
+# 单次探测最多读取的字节数与每次读取的块大小
+MAX_PROBE_BYTES = 512 * 1024
+CHUNK_SIZE = 16 * 1024
+
+# validate_api_response 认可的第一项字段（含备选字段名）
+ID_FIELDS = ('vod_id', 'id', 'video_id')
+NAME_FIELDS = ('vod_name', 'name', 'title')
+
+# 内容摘要最多保留的标题数、分类数，以及校验通过后为收集摘要最多继续读取的字节数
+DIGEST_TITLES = 5
+DIGEST_CATEGORIES = 50
+DIGEST_MAX_BYTES = 64 * 1024
+# 生成内容指纹至少需要的首页项数：只有一项时不同站点采集到同一部新片就会撞上，不足以判定镜像
+MIN_FINGERPRINT_ITEMS = 2
+
+_WHITESPACE = ' \t\r\n'
+# 从数字之后到缓冲区末尾只有数字字符（含小数点、指数与正负号）
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+_decoder = json.JSONDecoder()
+
+
+class _InvalidJSON(Exception):
+    pass
+
+
+class StreamingValidator:
+    """
+    增量解析 JSON 响应体，得到一个可交给 validate_api_response 的精简视图（skeleton）：
+
+    - 顶层各键保留原值，'data' 只保留类型（空列表/空字典），'list' 只保留第一项
+    - 第一项只保留已经读到的字段
+
+    用法：循环调用 feed(chunk)，返回 True 时即可停止读取；最后调用 close()，
+    再通过 result 取得精简视图（非 JSON 或顶层不是对象时为 None）。
+
+    collect_digest 为 True 时，校验通过后继续扫描顶层的 class（分类列表）与 list 中的前几项，
+    直到摘要收集完整、响应结束或额外读取超过 DIGEST_MAX_BYTES，结果见 digest：
+    {"categories": [分类名称...], "titles": [影片标题...], "fingerprint": 首页前几项 (id, 标题) 的哈希或 None}；
+    首页不足 MIN_FINGERPRINT_ITEMS 项（如遵守 limit=1 的接口）时 fingerprint 为 None
+    """
+
+    def __init__(self, max_bytes: int = MAX_PROBE_BYTES, collect_digest: bool = False):
+        self.max_bytes = max_bytes
+        self.collect_digest = collect_digest
+        self.digest = {"categories": [], "titles": [], "fingerprint": None}
+        self._page = []
+        self._class_seen = False
+        self._list_done = False
+        self.bytes_read = 0
+        self.truncated = False
+        self.finished = False
+        self.invalid = False
+        self.skeleton: dict = {}
+        self._item: Optional[dict] = None
+        self._text = ''
+        self._pos = 0
+        self._eof = False
+        self._utf8 = codecs.getincrementaldecoder('utf-8-sig')('replace')
+        self._parser = self._parse()
+
+    @property
+    def result(self) -> Optional[dict]:
+        return None if self.invalid else self.skeleton
+
+    def feed(self, chunk: bytes) -> bool:
+        """
+        送入一块响应体，返回 True 表示已得出结论或达到读取上限，应停止读取
+        """
+        if self.finished:
+            return True
+        self.bytes_read += len(chunk)
+        self._text += self._utf8.decode(chunk)
+        self._resume()
+        if not self.finished and self.bytes_read >= self.max_bytes:
+            self.truncated = True
+            # 读到上限时还没看到 list/data，无法得出与完整解析相同的结论，按无效处理
+            if 'list' not in self.skeleton and 'data' not in self.skeleton:
+                self.invalid = True
+            self._finish()
+            return True
+        if not self.finished and self.collect_digest and self.bytes_read >= DIGEST_MAX_BYTES and self._passed():
+            # 校验已通过，摘要只是附带信息，不为它读取过多内容
+            self._finish()
+        return self.finished
+
+    def close(self) -> None:
+        """
+        响应体读取结束（或提前停止）时调用
+        """
+        if self.finished:
+            return
+        self._eof = True
+        self._text += self._utf8.decode(b'', final=True)
+        self._resume()
+        self._finish()
+
+    def _finish(self) -> None:
+        self.finished = True
+        self._parser.close()
+
+    def _resume(self) -> None:
+        try:
+            next(self._parser)
+        except StopIteration:
+            self.finished = True
+        except _InvalidJSON:
+            self.invalid = True
+            self.finished = True
+
+    # --- 以下为基于生成器的可恢复解析器，数据不足时 yield 等待下一块 ---
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._text) and self._text[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._text):
+                return self._text[self._pos]
+            if self._eof:
+                raise _InvalidJSON()
+            yield
+
+    def _expect(self, char: str):
+        c = yield from self._peek()
+        if c != char:
+            raise _InvalidJSON()
+        self._pos += 1
+
+    def _value(self):
+        yield from self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._text, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise _InvalidJSON()
+                yield
+                continue
+            # 数字之后直到缓冲区末尾都是可能属于数字的字符（如块恰好断在 "12." 或 "1e" 之后）时，
+            # 后续数据可能让它变成另一个数字，等到出现数字以外的字符或响应结束再下结论
+            if (not self._eof and isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and _NUMBER_TAIL.match(self._text, end)):
+                yield
+                continue
+            self._pos = end
+            self._compact()
+            return value
+
+    def _compact(self) -> None:
+        # 丢弃已解析的部分，避免缓冲区无限增长
+        if self._pos > CHUNK_SIZE:
+            self._text = self._text[self._pos:]
+            self._pos = 0
+
+    def _object(self, handle_member):
+        """
+        逐个扫描对象成员，handle_member(key) 负责消费成员的值，返回 True 表示可以提前结束
+        """
+        yield from self._expect('{')
+        if (yield from self._peek()) == '}':
+            self._pos += 1
+            return False
+        while True:
+            key = yield from self._value()
+            if not isinstance(key, str):
+                raise _InvalidJSON()
+            yield from self._expect(':')
+            yield from self._peek()
+            if (yield from handle_member(key)):
+                return True
+            c = yield from self._peek()
+            self._pos += 1
+            if c == '}':
+                return False
+            if c != ',':
+                raise _InvalidJSON()
+
+    def _parse(self):
+        if (yield from self._peek()) != '{':
+            # 顶层不是对象（或根本不是 JSON），validate_api_response 必然判定失败，无需继续读取
+            raise _InvalidJSON()
+        yield from self._object(self._top_member)
+
+    def _top_member(self, key: str):
+        if key == 'list' and self._text[self._pos] == '[':
+            return (yield from self._list())
+        value = yield from self._value()
+        if key == 'class' and self.collect_digest:
+            self._class_seen = True
+            if isinstance(value, list):
+                for category in value:
+                    if isinstance(category, dict):
+                        self._add_category(category.get('type_name'))
+        if key in ('data', 'class') and isinstance(value, (list, dict)):
+            value = type(value)()
+        self.skeleton[key] = value
+        return self._should_stop()
+
+    def _list(self):
+        self._pos += 1
+        if (yield from self._peek()) == ']':
+            self._pos += 1
+            self.skeleton['list'] = []
+            self._list_done = True
+            return self._decided()
+        if self._text[self._pos] == '{':
+            self._item = {}
+            self.skeleton['list'] = [self._item]
+            if (yield from self._object(self._item_member)):
+                return True
+        else:
+            self.skeleton['list'] = [(yield from self._value())]
+        self._add_item(self.skeleton['list'][0])
+        if self._should_stop():
+            return True
+        # 跳过列表中的其余项（收集摘要时记录前几项的标题与分类）
+        while True:
+            c = yield from self._peek()
+            self._pos += 1
+            if c == ']':
+                self._list_done = True
+                return self._should_stop()
+            if c != ',':
+                raise _InvalidJSON()
+            item = yield from self._value()
+            self._add_item(item)
+            if self._should_stop():
+                return True
+
+    def _item_member(self, key: str):
+        self._item[key] = yield from self._value()
+        return self._should_stop()
+
+    def _add_category(self, name) -> None:
+        categories = self.digest['categories']
+        if isinstance(name, str) and name and name not in categories and len(categories) < DIGEST_CATEGORIES:
+            categories.append(name)
+
+    def _add_item(self, item) -> None:
+        if not self.collect_digest or not isinstance(item, dict):
+            return
+        self._add_category(item.get('type_name'))
+        titles = self.digest['titles']
+        title = next((item[f] for f in NAME_FIELDS if isinstance(item.get(f), str)), None)
+        if title and len(titles) < DIGEST_TITLES:
+            titles.append(title)
+        # 镜像站共用同一个数据库，首页各项的 id 与标题完全相同
+        item_id = next((item[f] for f in ID_FIELDS if item.get(f) is not None), None)
+        if item_id is not None and title and len(self._page) < DIGEST_TITLES:
+            self._page.append([str(item_id), title])
+            if len(self._page) < MIN_FINGERPRINT_ITEMS:
+                return
+            page = json.dumps(self._page, ensure_ascii=False).encode('utf-8')
+            self.digest['fingerprint'] = hashlib.sha1(page).hexdigest()
+
+    def _should_stop(self) -> bool:
+        """
+        是否可以停止读取：不收集摘要时与 _decided 相同；收集摘要时，校验通过后还要等摘要收集完整
+        """
+        if not self._decided():
+            return False
+        if not self.collect_digest or not self._passed():
+            return True
+        return self._class_seen and (self._list_done or len(self.digest['titles']) >= DIGEST_TITLES)
+
+    def _passed(self) -> bool:
+        """
+        已读到的内容是否足以判定校验通过
+        """
+        code = self.skeleton.get('code')
+        if 'code' not in self.skeleton or (code != 1 and code != 200):
+            return False
+        items = self.skeleton.get('list')
+        if not items or not isinstance(items[0], dict):
+            return False
+        return any(f in items[0] for f in ID_FIELDS) and any(f in items[0] for f in NAME_FIELDS)
+
+    def _decided(self) -> bool:
+        """
+        已读到的内容是否足以得出与完整解析相同的结论
+        """
+        code = self.skeleton.get('code')
+        if 'code' in self.skeleton and code != 1 and code != 200:
+            return True
+        if 'code' not in self.skeleton or 'list' not in self.skeleton:
+            return False
+        items = self.skeleton['list']
+        if not items or not isinstance(items[0], dict):
+            return True
+        return any(f in items[0] for f in ID_FIELDS) and any(f in items[0] for f in NAME_FIELDS)
@@ -1,7 +1,9 @@
+import copy
 import json
+import hashlib
 import requests
 import concurrent.futures
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Optional
 import time
 import os
 import argparse
@@ -10,6 +12,45 @@ import argparse
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+from config_io import write_json_atomic
+from host_scheduler import (
+    DEFAULT_HOST_INTERVAL,
+    DEFAULT_PER_HOST,
+    ConnectionStats,
+    HostPacer,
+    HostSlots,
+    interleave_by_host,
+    make_session,
+)
+from probe_common import (
+    CONNECT_TIMEOUT,
+    FINGERPRINT_VARIANT,
+    REQUEST_TIMEOUT,
+    RETRY_DELAY,
+    TEST_HEADERS,
+    build_test_urls,
+    is_retryable_status,
+    request_total_timeout,
+    validate_api_response,
+)
+from probe_state import (
+    HISTORY_PATH,
+    NOT_TESTED_MESSAGE,
+    PLAN_BACKOFF,
+    PLAN_DEAD,
+    PLAN_FRESH,
+    PLAN_PROBE,
+    STATUS_NOT_TESTED,
+    ProbeHistory,
+    VariantMemory,
+)
+from run_trace import RunTrace, add_trace_arguments
+from source_index import canonical_api_url, find_mirrors, remove_duplicate_apis
+from stream_validator import CHUNK_SIZE, MAX_PROBE_BYTES, StreamingValidator
+
+# 线程池模式下的并发数
+THREAD_WORKERS = 20
+
 def load_apis_from_config(config_path: str) -> Dict[str, dict]:
     """
     从配置文件中加载API列表
@@ -19,231 +60,907 @@ def load_apis_from_config(config_path: str) -> Dict[str, dict]:
     
     return config
 
-def validate_api_response(data: dict) -> bool:
-    """
-    验证API响应数据是否符合预期格式
-    """
-    if not isinstance(data, dict):
-        return False
-    
-    if 'code' in data and data['code'] != 1 and data['code'] != 200:
-        return False
-    
-    if 'list' in data:
-        if not isinstance(data['list'], list):
-            return False
-        if len(data['list']) > 0:
-            first_item = data['list'][0]
-            required_fields = ['vod_id', 'vod_name']
-            for field in required_fields:
-                if field not in first_item:
-                    alt_fields = {
-                        'vod_id': ['id', 'video_id'],
-                        'vod_name': ['name', 'title']
-                    }
-                    found = False
-                    for alt_field in alt_fields.get(field, []):
-                        if alt_field in first_item:
-                            found = True
-                            break
-                    if not found:
-                        return False
-    elif 'data' in data:
-        if not isinstance(data['data'], (list, dict)):
-            return False
-    else:
-        if len(data) == 0:
-            return False
-    
-    return True
+def is_connection_failure(error: Exception) -> bool:
+    """
+    判断是否为连接层面的失败（DNS 解析失败、连接被拒绝、连接超时、TLS 握手失败）。
+    这类失败与 URL 变体无关，继续尝试其余变体或重试没有意义。
+    """
+    if isinstance(error, (requests.exceptions.ConnectTimeout, requests.exceptions.SSLError)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', None)
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+    return False
 
-def remove_duplicate_apis(config: dict) -> Tuple[dict, List[Tuple[str, str]]]:
+def iter_response_body(response: requests.Response):
     """
-    优化版去重核心：标准化对比URL，忽略空格、末尾斜杠及HTTP/HTTPS差异
+    逐块产出已经到达的响应体数据，不等凑满 CHUNK_SIZE（与 aiohttp 的 iter_chunked 一致），
+    这样缓慢发送的响应也能按时检查总时限；urllib3 不支持 read1 时退回 iter_content
     """
-    api_sites = config.get('api_site', {})
-    seen_urls = {}
-    removed_apis = []
-    
-    new_api_sites = {}
-    for name, value in api_sites.items():
-        if 'api' in value and isinstance(value['api'], str):
-            original_url = value['api']
-            
-            # --- 优化点：清洗 URL 用于严格去重对比 ---
-            # 1. 去除首尾多余空格
-            # 2. 去除末尾的斜杠 '/'
-            clean_url = original_url.strip().rstrip('/')
-            
-            # 3. 剥离协议头，抹平 http 和 https 的差异
-            compare_url = clean_url.replace("https://", "").replace("http://", "")
-            
-            if compare_url in seen_urls:
-                # 发现重复的API
-                removed_apis.append((name, original_url))
-                print(f"✂️ 已清理重复 API: [{name}] -> {original_url}")
-                print(f"   (由于内容等同于首次出现的: [{seen_urls[compare_url]}])")
-            else:
-                # 首次出现的API，记录其清洗后的用于后续比对的特征码
-                seen_urls[compare_url] = name
-                new_api_sites[name] = value
-        else:
-            # 没有 api 字段的配置也默认保留
-            new_api_sites[name] = value
-    
-    # 更新配置
-    config['api_site'] = new_api_sites
-    return config, removed_apis
+    read1 = getattr(response.raw, 'read1', None)
+    if read1 is None:
+        yield from response.iter_content(CHUNK_SIZE)
+        return
+    # 与 iter_content 一样把 urllib3 的异常转换为 requests 的异常
+    try:
+        while True:
+            chunk = read1(CHUNK_SIZE, decode_content=True)
+            if not chunk:
+                return
+            yield chunk
+    except urllib3.exceptions.ReadTimeoutError as e:
+        raise requests.exceptions.ConnectionError(e)
+    except urllib3.exceptions.ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e)
+    except urllib3.exceptions.DecodeError as e:
+        raise requests.exceptions.ContentDecodingError(e)
 
-def test_api(api_name: str, api_url: str, max_retries: int = 2) -> Tuple[str, str, bool, int, str]:
+def read_api_response(response: requests.Response, max_bytes: int = MAX_PROBE_BYTES,
+                      collect_digest: bool = False,
+                      until: Optional[float] = None) -> Tuple[Optional[dict], int, dict]:
+    """
+    流式读取响应体并提取校验所需的精简视图，读到足够的字段或达到字节上限即停止。
+    until（time.monotonic() 时间）之后仍未读完时按超时抛出 requests.exceptions.Timeout。
+    返回 (精简视图或 None, 实际读取的字节数, 内容摘要)
+    """
+    validator = StreamingValidator(max_bytes, collect_digest)
+    for chunk in iter_response_body(response):
+        if validator.feed(chunk):
+            break
+        if until is not None and time.monotonic() > until:
+            raise requests.exceptions.Timeout(f"读取响应体超过总时限（已读取 {validator.bytes_read} 字节）")
+    validator.close()
+    return validator.result, validator.bytes_read, validator.digest
+
+def test_api(api_name: str, api_url: str, max_retries: int = 2, timeout: float = REQUEST_TIMEOUT,
+             preferred_variant: Optional[str] = None, max_bytes: int = MAX_PROBE_BYTES,
+             stats: Optional[dict] = None, collect_digest: bool = False,
+             session: Optional[requests.Session] = None,
+             pacer: Optional[HostPacer] = None,
+             deadline: Optional[float] = None) -> Tuple[str, str, bool, int, str]:
     """
     测试单个API的有效性
+
+    - 连接层面的失败（DNS、拒绝连接、连接超时）与等待响应头超时（主机接受连接后挂起）
+      立即判定失败，不再尝试其余变体与重试
+    - 只有出现读取响应体超时、5xx、429 等临时性失败时才进入下一轮重试
+    - 响应体流式读取，最多读取 max_bytes 字节；累计读取量记录在 stats['bytes_read']，
+      探测总耗时记录在 stats['elapsed']，每次请求的状态码、读取量与耗时追加到 stats['attempts']
+    - collect_digest 为 True 时，验证成功的响应的内容摘要记录在 stats['digest']
+    - 传入 session 时复用其连接池，传入 pacer 时每个请求发出前按域名限速
+    - deadline（time.monotonic() 时间）之后不再发出请求，单次请求超时也不超过剩余时间；
+      到期时返回 STATUS_NOT_TESTED
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    }
+    stats = {} if stats is None else stats
+    stats.setdefault('bytes_read', 0)
+    http = session or requests
+    start = time.perf_counter()
+    try:
+        test_urls = build_test_urls(api_url, preferred_variant)
+        status_code = -1
+        last_error = "请求失败"
     
-    test_urls = [
-        f"{api_url}?ac=detail&limit=1",
-        f"{api_url}?ac=list&limit=1",
-        f"{api_url}?limit=1",
-        api_url
-    ]
+        for attempt in range(max_retries):
+            retryable = False
+            for test_url in test_urls:
+                data = None
+                if pacer:
+                    pacer.wait(test_url)
+                request_timeout = timeout
+                if deadline is not None:
+                    request_timeout = min(timeout, deadline - time.monotonic())
+                    if request_timeout <= 0:
+                        return api_name, api_url, False, STATUS_NOT_TESTED, NOT_TESTED_MESSAGE
+                # requests 不提供连接阶段的钩子：ttfb 取 response.elapsed（含建连），其余时间计为响应体
+                record = {"url": test_url, "attempt": attempt + 1, "status": -1, "ok": False, "bytes": 0}
+                stats.setdefault('attempts', []).append(record)
+                request_start = time.perf_counter()
+                # requests 的读取超时针对每次读取，另按总时限截断持续缓慢发送的响应，与异步引擎一致
+                until = time.monotonic() + request_total_timeout(request_timeout)
+                if deadline is not None:
+                    until = min(until, deadline)
+                try:
+                    with http.get(
+                        test_url, 
+                        headers=TEST_HEADERS, 
+                        timeout=(min(CONNECT_TIMEOUT, request_timeout), request_timeout),
+                        verify=False,
+                        stream=True
+                    ) as response:
+                        status_code = response.status_code
+                        record['status'] = status_code
+                        record['ttfb'] = round(response.elapsed.total_seconds(), 6)
+                        if response.status_code == 200:
+                            data, bytes_read, digest = read_api_response(response, max_bytes, collect_digest, until)
+                            stats['bytes_read'] += bytes_read
+                            record['bytes'] = bytes_read
+                except requests.exceptions.RequestException as e:
+                    record['error'] = e.__class__.__name__
+                    if is_connection_failure(e):
+                        return api_name, api_url, False, -1, f"连接失败: {e}"
+                    if isinstance(e, requests.exceptions.ReadTimeout) and record['status'] == -1:
+                        return api_name, api_url, False, -1, f"等待响应头超时: {e}"
+                    last_error = str(e)
+                    retryable = True
+                    continue
+                finally:
+                    record['total'] = round(time.perf_counter() - request_start, 6)
+                    if 'ttfb' in record:
+                        record['body'] = round(max(record['total'] - record['ttfb'], 0.0), 6)
+            
+                if status_code == 200:
+                    if data is not None and validate_api_response(data):
+                        record['ok'] = True
+                        if collect_digest:
+                            stats['digest'] = digest
+                        return api_name, test_url, True, status_code, "有效"
+                elif is_retryable_status(status_code):
+                    retryable = True
+        
+            if not retryable:
+                break
+            if attempt < max_retries - 1:
+                time.sleep(RETRY_DELAY)
     
-    for attempt in range(max_retries):
-        for test_url in test_urls:
+        return api_name, api_url, False, status_code, last_error
+    finally:
+        stats['elapsed'] = time.perf_counter() - start
+
+def print_result(result: Tuple[str, str, bool, int, str], stats: Optional[dict] = None) -> None:
+    """
+    打印单个API的测试结果
+    """
+    name, _, ok, status, msg = result
+    read_info = f" [读取 {stats['bytes_read'] / 1024:.1f} KB]" if stats and 'bytes_read' in stats else ""
+    if ok:
+        print(f"✓ {name}: {status} (状态码: {status}){read_info}")
+    elif status == STATUS_NOT_TESTED:
+        print(f"⏸ {name}: {msg}{read_info}")
+    elif status == -1:
+        print(f"✗ {name}: {msg} (错误: {msg}){read_info}")
+    else:
+        print(f"✗ {name}: {status} (状态码: {status}, 错误: {msg}){read_info}")
+
+def test_apis_with_threads(apis: Dict[str, str], max_workers: int = THREAD_WORKERS, timeout: float = REQUEST_TIMEOUT,
+                           preferred: Optional[Dict[str, str]] = None, max_bytes: int = MAX_PROBE_BYTES,
+                           probe_stats: Optional[Dict[str, dict]] = None, collect_digest: bool = False,
+                           per_host: int = DEFAULT_PER_HOST, host_interval: float = DEFAULT_HOST_INTERVAL,
+                           connection_stats: Optional[ConnectionStats] = None,
+                           priority: Optional[Dict[str, float]] = None,
+                           deadline: Optional[float] = None,
+                           on_result=None) -> List[Tuple[str, str, bool, int, str]]:
+    """
+    使用线程池并发测试所有API（旧版阻塞模式，保留用于对比）。
+    probe_stats 不为 None 时，会为每个源填入 {源名称: 探测统计}；
+    所有线程共用一个按域名复用连接的会话，每个域名最多 per_host 个连接，相邻请求至少间隔 host_interval 秒。
+    按 priority 从高到低提交；到达 deadline（time.monotonic() 时间）后尚未开始或未测完的源记为 STATUS_NOT_TESTED
+    """
+    preferred = preferred or {}
+    probe_stats = {} if probe_stats is None else probe_stats
+    results = []
+    ordered = interleave_by_host(apis, priority)
+    # 连接池按 (协议, 域名, 端口) 区分，容量按源数给足，避免统计数据随池被淘汰而丢失
+    session = make_session(per_host, hosts=len(apis))
+    pacer = HostPacer(host_interval)
+    host_slots = HostSlots(per_host)
+
+    def guarded(name: str, url: str):
+        # 先等待域名槽位再测试，每个域名同时在测的源不超过连接池容量，请求不会在连接池里排队；
+        # 等待槽位不超过剩余预算，到期仍未轮到的源记为未测试
+        slot = host_slots.slot(url)
+        if slot is not None:
+            wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not slot.acquire(timeout=wait):
+                return name, url, False, STATUS_NOT_TESTED, NOT_TESTED_MESSAGE
+        try:
+            return test_api(name, url, timeout=timeout, preferred_variant=preferred.get(name),
+                            max_bytes=max_bytes, stats=probe_stats.setdefault(name, {}),
+                            collect_digest=collect_digest, session=session, pacer=pacer, deadline=deadline)
+        finally:
+            if slot is not None:
+                slot.release()
+
+    with session, concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_api = {executor.submit(guarded, name, url): (name, url) for name, url in ordered.items()}
+        for future in concurrent.futures.as_completed(future_to_api):
+            name, url = future_to_api[future]
             try:
-                response = requests.get(
-                    test_url, 
-                    headers=headers, 
-                    timeout=10,
-                    verify=False
-                )
-                
-                if response.status_code == 200:
-                    try:
-                        data = response.json()
-                        if validate_api_response(data):
-                            return api_name, test_url, True, response.status_code, "有效"
-                        else:
-                            continue
-                    except json.JSONDecodeError:
-                        continue
-                
-                if attempt < max_retries - 1:
-                    time.sleep(0.5)
-                    
+                result = future.result()
             except Exception as e:
-                if attempt < max_retries - 1:
-                    time.sleep(0.5)
-                continue
-    
-    return api_name, api_url, False, response.status_code if 'response' in locals() else -1, str(e) if 'e' in locals() else "请求失败"
+                print(f"测试 {name} 时发生错误: {e}")
+                result = (name, url, False, -1, str(e))
+            results.append(result)
+            if on_result:
+                on_result(result)
+        if connection_stats is not None:
+            connection_stats.collect_from_session(session)
+    return results
 
 def remove_unavailable_apis(config: dict, unavailable_apis: List[str]) -> dict:
     """
     从配置中移除不可用的API
     """
-    new_config = json.loads(json.dumps(config))
+    # 只替换 api_site，各个源的字典本身不会被修改，无需深拷贝
+    new_config = dict(config)
+    new_config['api_site'] = dict(config.get('api_site', {}))
     for api_name in unavailable_apis:
-        if api_name in new_config.get('api_site', {}):
+        if api_name in new_config['api_site']:
             del new_config['api_site'][api_name]
             print(f"🗑️ 已移除测速失效的API: {api_name}")
     return new_config
 
-def main():
-    parser = argparse.ArgumentParser(description="测试并清理配置文件中的API。")
-    parser.add_argument(
-        '-y', '--yes',
-        action='store_true',
-        help="自动对所有提问回答'是'，用于非交互式环境（如GitHub Actions）。"
-    )
-    args = parser.parse_args()
+def confirm(question: str, assume_yes: bool = False) -> bool:
+    """
+    询问用户是否继续，assume_yes 为 True 时直接视为同意
+    """
+    choice = 'y' if assume_yes else input(question)
+    return choice.lower() in ['y', 'yes']
 
-    config_path = 'config.json'
-    
-    if not os.path.exists(config_path):
-        print(f"错误: 找不到配置文件 {config_path}")
-        return
-    
-    config = load_apis_from_config(config_path)
-    
+def dedupe_config(config: dict, assume_yes: bool = False) -> dict:
+    """
+    去重阶段：移除 API 链接重复的源，用户确认后返回去重后的配置，否则返回原配置
+    """
     print("--- 开始进行 API 深度去重处理 ---")
     deduplicated_config, removed_apis = remove_duplicate_apis(config)
-    if removed_apis:
-        print(f"\n✅ 深度去重完成！共精准移除了 {len(removed_apis)} 个冗余 API 节点。")
-        
-        choice = 'y' if args.yes else input(f"\n是否要将去重后的配置保存到 {config_path} ? (y/N): ")
-        if choice.lower() in ['y', 'yes']:
-            backup_path = f"{config_path}.backup.{int(time.time())}"
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-            print(f"原配置已备份至: {backup_path}")
-            
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(deduplicated_config, f, ensure_ascii=False, indent=4) # 优化排版为缩进4格
-            print(f"已将去重后的配置保存到 {config_path}")
-            config = deduplicated_config
-        else:
-            print("未执行去重配置保存操作，将使用原始配置进行测试")
-    else:
+    if not removed_apis:
         print("✅ 未发现重复的 API 链接，源列表已是最佳状态。")
+        return config
     
+    print(f"\n✅ 深度去重完成！共精准移除了 {len(removed_apis)} 个冗余 API 节点。")
+    if confirm("\n是否使用去重后的配置继续测试并保存? (y/N): ", assume_yes):
+        return deduplicated_config
+    print("未执行去重配置保存操作，将使用原始配置进行测试")
+    return config
+
+def add_probe_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    注册测速阶段的命令行参数（pipeline.py 复用）
+    """
+    parser.add_argument(
+        '--engine',
+        choices=['async', 'thread'],
+        default='async',
+        help="测速引擎：async 为 asyncio 异步引擎（默认），thread 为旧版线程池。"
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=None,
+        help="最大并发测速数（async 默认 200，thread 默认 20）。"
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=REQUEST_TIMEOUT,
+        help=f"单次请求超时秒数（默认 {REQUEST_TIMEOUT}）。"
+    )
+    parser.add_argument(
+        '--probe-timeout',
+        type=float,
+        default=None,
+        help="单个源整体测试的超时秒数（仅 async 引擎，默认不限制）。"
+    )
+    parser.add_argument(
+        '--budget', '--run-timeout',
+        dest='budget',
+        type=float,
+        default=None,
+        help="测速阶段（探测与测速）的总时间预算秒数，默认不限制。源按探测历史排优先级（新源与不稳定的源先测），"
+             "预算用尽时取消未完成的探测，没测完的源本轮保留。"
+    )
+    parser.add_argument(
+        '--hedge',
+        action='store_true',
+        help="并行竞速所有 URL 变体，取最先验证成功的一个（仅 async 引擎）。"
+    )
+    parser.add_argument(
+        '--hedge-delay',
+        type=float,
+        default=0.0,
+        help="竞速模式下相邻变体的启动间隔秒数，0 表示同时发出（默认 0）。"
+    )
+    parser.add_argument(
+        '--max-bytes',
+        type=int,
+        default=MAX_PROBE_BYTES,
+        help=f"单次探测最多读取的响应字节数（默认 {MAX_PROBE_BYTES}）。"
+    )
+    parser.add_argument(
+        '--per-host',
+        type=int,
+        default=DEFAULT_PER_HOST,
+        help=f"同一域名最多同时在测的源数/连接数（默认 {DEFAULT_PER_HOST}，0 表示不限制），避免被站点限流。"
+    )
+    parser.add_argument(
+        '--host-interval',
+        type=float,
+        default=DEFAULT_HOST_INTERVAL,
+        help=f"同一域名相邻两次请求的最小间隔秒数（默认 {DEFAULT_HOST_INTERVAL}，0 表示不限制；"
+             "async 引擎仅在 --per-host 大于 0 时生效）。"
+    )
+    parser.add_argument(
+        '--no-digest',
+        action='store_true',
+        help="不收集响应的内容摘要（分类与标题），分类阶段只按名称、键名与域名判断。"
+    )
+    parser.add_argument(
+        '--no-variant-memory',
+        action='store_true',
+        help="不读取也不更新各源上次验证成功的 URL 变体记录。"
+    )
+    parser.add_argument(
+        '--speed-samples',
+        type=int,
+        default=3,
+        help="对通过测试的源测速的采样次数，0 表示不测速（默认 3，需要 aiohttp）。"
+    )
+    parser.add_argument(
+        '--sort-by-latency',
+        action='store_true',
+        help="按测得的 p50 延迟从快到慢对 api_site 排序。"
+    )
+    parser.add_argument(
+        '--write-latency',
+        action='store_true',
+        help="为每个已测速的源写入 latency_ms 字段。"
+    )
+    parser.add_argument(
+        '--max-p90',
+        type=float,
+        default=None,
+        help="p90 总耗时超过该毫秒数的源将被移除（默认不限制）。"
+    )
+    parser.add_argument(
+        '--collapse-mirrors',
+        action='store_true',
+        help=f"额外请求各有效源的首页（{FINGERPRINT_VARIANT}），按前几项的内容指纹识别镜像站，"
+             "每组只保留延迟最低的一个（需要内容摘要，不能与 --no-digest 同用）。"
+    )
+    parser.add_argument(
+        '--playback',
+        action='store_true',
+        help="对通过测试的源做播放测速：取第一个 m3u8，下载部分分片，记录起播延迟与吞吐（需要 aiohttp）。"
+    )
+    parser.add_argument(
+        '--playback-bytes',
+        type=int,
+        default=1024 * 1024,
+        help="播放测速时每个源最多读取的字节数，含详情、播放列表与分片（默认 1048576）。"
+    )
+    parser.add_argument(
+        '--min-throughput',
+        type=float,
+        default=None,
+        help="播放吞吐低于该 KB/s 的源将被移除（默认不限制）。"
+    )
+    parser.add_argument(
+        '--drop-unplayable',
+        action='store_true',
+        help="移除播放列表或视频分片无法获取的源（详情中没有 m3u8 地址或字节预算不足的源不受影响）。"
+    )
+    parser.add_argument(
+        '--history',
+        default=HISTORY_PATH,
+        help=f"探测历史数据库路径（默认 {HISTORY_PATH}）。"
+    )
+    parser.add_argument(
+        '--no-history',
+        action='store_true',
+        help="不使用探测历史：每个源都重新探测，失败一次即移除（旧行为）。"
+    )
+    parser.add_argument(
+        '--ttl',
+        type=float,
+        default=20,
+        help="在该小时数内验证成功过的源跳过探测（默认 20）。"
+    )
+    parser.add_argument(
+        '--backoff',
+        type=float,
+        default=6,
+        help="失败源的初始退避小时数，之后每次连续失败翻倍（默认 6）。"
+    )
+    parser.add_argument(
+        '--remove-after',
+        type=int,
+        default=3,
+        help="连续失败达到该次数才从配置中移除（默认 3）。"
+    )
+
+def check_probe_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """
+    检查 add_probe_arguments 中互相冲突的参数组合，冲突时由 parser.error 报错退出
+    """
+    if args.collapse_mirrors and args.no_digest:
+        parser.error("--collapse-mirrors 需要内容摘要，不能与 --no-digest 同用")
+
+def shard_of(api_url: str, count: int) -> int:
+    """
+    按规范化 API URL 的哈希把源分配到 count 个分片之一，与进程、平台和源的顺序无关
+    """
+    digest = hashlib.sha1(canonical_api_url(api_url).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """
+    解析 --shard 参数 "i/n"（0 <= i < n）
+    """
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/n，例如 0/4: {text}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"分片编号应满足 0 <= i < n: {text}")
+    return index, count
+
+def config_fingerprint(config: dict) -> str:
+    """
+    源列表的指纹：各分片与合并步骤据此确认处理的是同一份（去重后的）配置
+    """
+    return hashlib.sha1(json.dumps(config.get('api_site', {}), ensure_ascii=False, sort_keys=True)
+                        .encode('utf-8')).hexdigest()
+
+def measure_sources(config: dict, args: argparse.Namespace, trace: Optional[RunTrace] = None,
+                    shard: Optional[Tuple[int, int]] = None) -> Dict[str, dict]:
+    """
+    测速阶段的测量部分：按探测历史决定哪些源需要探测，探测、测速并更新探测历史。
+    shard 为 (i, n) 时只处理分到第 i 个分片的源。
+    返回 {源名称: 测量记录}（按 api_site 的顺序），记录只包含可以写入 JSON 的值：
+
+    - plan: 本轮的处理方式（PLAN_*）；本轮探测过的源另有 ok、url、status、msg、elapsed、bytes_read
+    - digest / speed / playback: 本轮或探测历史中最近一次的内容摘要、测速汇总与播放测速结果（没有时为 None）
+    - search: 探测历史中 ttl 内的搜索耗时汇总（由 search_client --record 记录，没有时为 None）
+    - fingerprint: 开启 --collapse-mirrors 时本轮请求首页得到的内容指纹（没有时为 None）
+    - remove: 是否应从配置中移除（本轮失败且连续失败次数达到阈值，或已判定死亡）
+
+    设置了 args.budget 时，整个测量过程不超过该秒数：源按探测历史的优先级排序，
+    预算用尽时未完成的源记为 STATUS_NOT_TESTED，本轮保留且不写入探测历史，测速也只在剩余预算内进行
+    """
+    deadline = time.monotonic() + args.budget if args.budget else None
     api_sites = config.get('api_site', {})
     apis = {key: value['api'] for key, value in api_sites.items() if 'api' in value}
+    if shard:
+        apis = {name: url for name, url in apis.items() if shard_of(url, shard[1]) == shard[0]}
+        print(f"\n分片 {shard[0]}/{shard[1]}: 负责 {len(apis)} 个源")
+    
+    history = None
+    plans = {name: PLAN_PROBE for name in apis}
+    if not args.no_history:
+        history = ProbeHistory(args.history, ttl=args.ttl * 3600, backoff=args.backoff * 3600,
+                               remove_after=args.remove_after)
+        plans = history.plan(apis)
+        skipped = {plan: sum(1 for p in plans.values() if p == plan) for plan in (PLAN_FRESH, PLAN_BACKOFF, PLAN_DEAD)}
+        print(f"\n探测历史: {skipped[PLAN_FRESH]} 个源在 {args.ttl:g} 小时内已验证有效，"
+              f"{skipped[PLAN_BACKOFF]} 个失败源处于退避期，{skipped[PLAN_DEAD]} 个源已连续失败 {args.remove_after} 次，本轮均跳过")
+    
+    all_apis = apis
+    apis = {name: url for name, url in all_apis.items() if plans[name] == PLAN_PROBE}
+    # 新源与不稳定的源先测，长期稳定的源最后测，预算不足时少测的是最不容易变化的源
+    priority = history.priorities(apis) if history else None
     
     print(f"\n加载了 {len(apis)} 个独立 API 进行连通性测试")
     print("=" * 80)
     
-    results = []
-    available_count = 0
-    unavailable_count = 0
+    variant_memory = None if args.no_variant_memory else VariantMemory()
+    preferred = variant_memory.preferred(apis) if variant_memory else {}
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        future_to_api = {executor.submit(test_api, name, url): (name, url) for name, url in apis.items()}
-        for future in concurrent.futures.as_completed(future_to_api):
-            name, url = future_to_api[future]
-            try:
-                result = future.result()
-                results.append(result)
-                if result[2]:
-                    print(f"✓ {name}: {result[3]} (状态码: {result[3]})")
-                    available_count += 1
-                else:
-                    if result[3] == -1:
-                        print(f"✗ {name}: {result[4]} (错误: {result[4]})")
-                    else:
-                        print(f"✗ {name}: {result[3]} (状态码: {result[3]}, 错误: {result[4]})")
-                    unavailable_count += 1
-            except Exception as e:
-                print(f"测试 {name} 时发生错误: {e}")
-                results.append((name, url, False, -1, str(e)))
-                unavailable_count += 1
+    probe_stats: Dict[str, dict] = {}
+    connection_stats = ConnectionStats()
+    
+    def on_result(result):
+        print_result(result, probe_stats.get(result[0]))
+    
+    start_time = time.time()
+    if args.engine == 'async':
+        try:
+            import probe_engine
+        except ImportError as e:
+            print(f"⚠️ 无法加载异步测速引擎 ({e})，回退到线程池模式")
+            args.engine = 'thread'
+    
+    if args.engine == 'async':
+        results = probe_engine.run_probes(
+            apis,
+            concurrency=args.concurrency or probe_engine.DEFAULT_CONCURRENCY,
+            request_timeout=args.timeout,
+            probe_timeout=args.probe_timeout,
+            run_timeout=None if deadline is None else max(deadline - time.monotonic(), 0),
+            preferred=preferred,
+            hedge=args.hedge,
+            hedge_delay=args.hedge_delay,
+            max_bytes=args.max_bytes,
+            probe_stats=probe_stats,
+            collect_digest=not args.no_digest,
+            per_host=args.per_host,
+            host_interval=args.host_interval,
+            connection_stats=connection_stats,
+            priority=priority,
+            on_result=on_result
+        )
+    else:
+        results = test_apis_with_threads(
+            apis,
+            max_workers=args.concurrency or THREAD_WORKERS,
+            timeout=args.timeout,
+            preferred=preferred,
+            max_bytes=args.max_bytes,
+            probe_stats=probe_stats,
+            collect_digest=not args.no_digest,
+            per_host=args.per_host,
+            host_interval=args.host_interval,
+            connection_stats=connection_stats,
+            priority=priority,
+            deadline=deadline,
+            on_result=on_result
+        )
+    
+    total_bytes = sum(stats.get('bytes_read', 0) for stats in probe_stats.values())
+    print(f"\n[{args.engine}] 测速耗时 {time.time() - start_time:.1f} 秒，共读取响应 {total_bytes / 1024:.1f} KB")
+    connection_stats.report()
+    untested = {r[0] for r in results if r[3] == STATUS_NOT_TESTED}
+    if untested:
+        print(f"⏱️ 测速预算 {args.budget:g} 秒已用尽，{len(untested)} 个源未完成测试，本轮保留")
+    if trace:
+        trace.record_probes(apis, results, probe_stats)
+        for name, plan in plans.items():
+            if plan != PLAN_PROBE:
+                trace.emit('probe_skipped', source=name, api=all_apis[name], plan=plan)
+    
+    if variant_memory:
+        for name, test_url, ok, _, _ in results:
+            if ok:
+                variant_memory.remember(apis[name], test_url)
+        variant_memory.save()
+    
+    measurements: Dict[str, dict] = {name: {"plan": plan, "digest": None, "speed": None, "playback": None,
+                                            "search": None, "fingerprint": None, "remove": plan == PLAN_DEAD}
+                                     for name, plan in plans.items()}
+    for name, test_url, ok, status, msg in results:
+        stats = probe_stats.get(name, {})
+        measurements[name].update(ok=ok, url=test_url, status=status, msg=msg, remove=not ok and name not in untested,
+                                  elapsed=stats.get('elapsed'), bytes_read=stats.get('bytes_read', 0))
+    fresh_digests = {name: probe_stats[name]['digest'] for name, _, ok, _, _ in results
+                     if ok and 'digest' in probe_stats.get(name, {})}
+    if history:
+        for name, _, ok, status, _ in results:
+            if name not in untested:
+                history.record(apis[name], ok, status, probe_stats.get(name, {}).get('elapsed'))
+        for name, digest in fresh_digests.items():
+            history.record_digest(apis[name], digest)
+        history.commit()
+        # 本轮跳过探测的源沿用最近一次的内容摘要
+        for name, digest in history.digests(all_apis).items():
+            measurements[name]['digest'] = digest
+        for name, summary in history.searches(all_apis).items():
+            measurements[name]['search'] = summary
+        # 连续失败未达阈值的源先保留，已判定死亡且仍在退避期的源直接移除
+        kept = [name for name, _, ok, _, _ in results
+                if not ok and name not in untested and not history.should_remove(apis[name])]
+        if kept:
+            print(f"\n⏳ {len(kept)} 个源本轮失败但连续失败次数未达 {args.remove_after} 次，暂时保留")
+        for name in kept:
+            measurements[name]['remove'] = False
+    for name, digest in fresh_digests.items():
+        measurements[name]['digest'] = digest
+    
+    speed_test = None
+    if args.speed_samples > 0:
+        try:
+            import speed_test
+        except ImportError as e:
+            print(f"⚠️ 无法加载测速模块 ({e})，跳过测速")
+    remaining = None if deadline is None else deadline - time.monotonic()
+    if speed_test and remaining is not None and remaining <= 0:
+        print("⏱️ 测速预算已用尽，跳过测速")
+        speed_test = None
+    if speed_test:
+        targets = {name: test_url for name, test_url, ok, _, _ in results if ok}
+        print(f"\n--- 开始对 {len(targets)} 个有效源测速（每个源采样 {args.speed_samples} 次）---")
+        speeds = speed_test.run_speed_test(
+            targets,
+            samples=args.speed_samples,
+            concurrency=args.concurrency or speed_test.DEFAULT_CONCURRENCY,
+            request_timeout=args.timeout,
+            max_bytes=args.max_bytes,
+            run_timeout=remaining
+        )
+        speed_test.print_speed_report(speeds)
+        if history:
+            for name, summary in speeds.items():
+                history.record_speed(all_apis[name], summary)
+            history.commit()
+            # 本轮跳过探测的源沿用最近一次的测速结果
+            speeds = {**history.speeds(all_apis), **speeds}
+        for name, summary in speeds.items():
+            measurements[name]['speed'] = summary
+    
+    if args.playback:
+        measure_playback(measurements, all_apis, [name for name, _, ok, _, _ in results if ok], args,
+                         deadline, history, trace)
+    if args.collapse_mirrors:
+        measure_fingerprints(measurements, all_apis, args, deadline)
+    if history:
+        history.close()
+    
+    return {name: measurements[name] for name in api_sites if name in measurements}
+
+def measure_playback(measurements: Dict[str, dict], all_apis: Dict[str, str], names: List[str],
+                     args: argparse.Namespace, deadline: Optional[float], history: Optional[ProbeHistory],
+                     trace: Optional[RunTrace]) -> None:
+    """
+    对本轮验证有效的源做播放测速，结果写入各自测量记录的 playback；
+    使用探测历史时，本轮跳过探测的源沿用最近一次的结果
+    """
+    try:
+        import playback_probe
+    except ImportError as e:
+        print(f"⚠️ 无法加载播放测速模块 ({e})，跳过播放测速")
+        return
+    remaining = None if deadline is None else deadline - time.monotonic()
+    if remaining is not None and remaining <= 0:
+        print("⏱️ 测速预算已用尽，跳过播放测速")
+        return
+    targets = {name: all_apis[name] for name in names}
+    print(f"\n--- 开始对 {len(targets)} 个有效源做播放测速（每个源最多读取 {args.playback_bytes // 1024} KB）---")
+    playbacks = playback_probe.run_playback_test(
+        targets,
+        concurrency=args.concurrency or playback_probe.DEFAULT_CONCURRENCY,
+        request_timeout=args.timeout,
+        max_bytes=args.playback_bytes,
+        run_timeout=remaining
+    )
+    playback_probe.print_playback_report(playbacks)
+    if trace:
+        for name, result in playbacks.items():
+            trace.emit('playback', source=name, api=all_apis[name], **result)
+    if history:
+        for name, result in playbacks.items():
+            history.record_playback(all_apis[name], result)
+        history.commit()
+        playbacks = {**history.playbacks(all_apis), **playbacks}
+    for name, result in playbacks.items():
+        measurements[name]['playback'] = result
+
+def measure_fingerprints(measurements: Dict[str, dict], all_apis: Dict[str, str], args: argparse.Namespace,
+                         deadline: Optional[float]) -> None:
+    """
+    对本轮有效或在 TTL 内验证过的源请求首页并生成内容指纹，结果写入各自测量记录的 fingerprint。
+    指纹每轮重新获取：首页随更新变化，与探测历史中的旧指纹比较会漏掉镜像
+    """
+    try:
+        import probe_engine
+    except ImportError as e:
+        print(f"⚠️ 无法加载异步测速引擎 ({e})，跳过镜像识别")
+        return
+    remaining = None if deadline is None else deadline - time.monotonic()
+    if remaining is not None and remaining <= 0:
+        print("⏱️ 测速预算已用尽，跳过镜像识别")
+        return
+    targets = {name: all_apis[name] for name, m in measurements.items() if m.get('ok') or m['plan'] == PLAN_FRESH}
+    print(f"\n--- 开始获取 {len(targets)} 个有效源的首页指纹用于镜像识别 ---")
+    fingerprints = probe_engine.run_fingerprints(
+        targets,
+        concurrency=args.concurrency or probe_engine.DEFAULT_CONCURRENCY,
+        request_timeout=args.timeout,
+        max_bytes=args.max_bytes,
+        run_timeout=remaining
+    )
+    print(f"🪞 {len(fingerprints)}/{len(targets)} 个源得到首页指纹")
+    for name, fingerprint in fingerprints.items():
+        measurements[name]['fingerprint'] = fingerprint
+
+def apply_measurements(config: dict, measurements: Dict[str, dict], args: argparse.Namespace) -> dict:
+    """
+    测速阶段的决策部分：根据 measure_sources 的测量记录移除无效、过慢与镜像源并按延迟排序，
+    返回更新后的配置（无任何改动时返回原对象）。只依赖测量记录本身，分片合并时与单进程运行的结论一致
+    """
+    probed = {name: m for name, m in measurements.items()
+              if m['plan'] == PLAN_PROBE and m['status'] != STATUS_NOT_TESTED}
+    untested_count = sum(1 for m in measurements.values() if m.get('status') == STATUS_NOT_TESTED)
+    available_count = sum(1 for m in probed.values() if m['ok'])
+    unavailable_api_names = [name for name, m in measurements.items() if m['remove']]
+    speeds = {name: m['speed'] for name, m in measurements.items() if m['speed']}
+    playbacks = {name: m['playback'] for name, m in measurements.items() if m.get('playback')}
+    searches = {name: m['search'] for name, m in measurements.items() if m.get('search')}
+    
+    if args.max_p90 is not None and speeds:
+        too_slow = [name for name, summary in speeds.items()
+                    if summary['total_p90'] > args.max_p90 and name not in unavailable_api_names]
+        if too_slow:
+            print(f"\n🐢 {len(too_slow)} 个源的 p90 耗时超过 {args.max_p90:g} ms，将一并移除: {', '.join(too_slow)}")
+            unavailable_api_names += too_slow
+    
+    if args.min_throughput is not None and playbacks:
+        starved = [name for name, result in playbacks.items()
+                   if result['ok'] and result['throughput_kbps'] is not None
+                   and result['throughput_kbps'] < args.min_throughput and name not in unavailable_api_names]
+        if starved:
+            print(f"\n📉 {len(starved)} 个源的播放吞吐低于 {args.min_throughput:g} KB/s，将一并移除: {', '.join(starved)}")
+            unavailable_api_names += starved
+    if args.drop_unplayable and playbacks:
+        unplayable = [name for name, result in playbacks.items()
+                      if not result['ok'] and result['stage'] != 'detail' and result['reason'] != 'budget_exhausted'
+                      and name not in unavailable_api_names]
+        if unplayable:
+            print(f"\n🚫 {len(unplayable)} 个源的播放列表或视频分片无法获取，将一并移除: {', '.join(unplayable)}")
+            unavailable_api_names += unplayable
+    
+    if args.collapse_mirrors:
+        # 本轮有效或在 TTL 内验证过的源参与镜像识别，同组只保留最快的一个
+        alive = {name for name, m in measurements.items() if m.get('ok') or m['plan'] == PLAN_FRESH}
+        latency = {name: summary['total_p50'] for name, summary in speeds.items()}
+        for name, m in probed.items():
+            if m['elapsed'] is not None:
+                latency.setdefault(name, m['elapsed'] * 1000)
+        fingerprints = {name: m.get('fingerprint') for name, m in measurements.items()
+                        if name in alive and name not in unavailable_api_names}
+        mirrors = find_mirrors(fingerprints, latency)
+        if mirrors:
+            print(f"\n🪞 {len(mirrors)} 个源与其他源的首页内容完全相同，视为镜像并移除（保留最快的一个）:")
+            for name, keep in mirrors.items():
+                print(f"   [{name}] -> 保留 [{keep}]")
+            unavailable_api_names += list(mirrors)
+    unavailable_count = len(unavailable_api_names)
                 
     print("\n" + "=" * 80)
-    print(f"测试完成: {available_count}/{len(results)} 个API有效")
-    
-    available_apis = [r for r in results if r[2]]
-    unavailable_apis = [r for r in results if not r[2]]
+    print(f"测试完成: {available_count}/{len(probed)} 个API有效"
+          + (f"，另有 {untested_count} 个源因预算用尽未完成测试，予以保留" if untested_count else ""))
     
+    updated_config = config
     if unavailable_count > 0:
-        choice = 'y' if args.yes else input(f"\n是否要从 {config_path} 中移除这 {unavailable_count} 个无效的API? (y/N): ")
-        if choice.lower() in ['y', 'yes']:
-            unavailable_api_names = [r[0] for r in unavailable_apis]
+        if confirm(f"\n是否要从配置中移除这 {unavailable_count} 个无效的API? (y/N): ", args.yes):
             updated_config = remove_unavailable_apis(config, unavailable_api_names)
-            
-            backup_path = f"{config_path}.backup.{int(time.time())}"
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-            
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(updated_config, f, ensure_ascii=False, indent=4) # 优化排版为缩进4格
-            
             print(f"🎉 成功！已从配置文件中永久移除 {unavailable_count} 个无效的 API。")
         else:
             print("未执行移除操作")
-    else:
+    elif available_count == len(probed):
         print("\n🎉 所有测试的 API 均有效，无需进一步清理。")
+    else:
+        print("\n本轮没有达到移除条件的 API，无需进一步清理。")
+    
+    if speeds and (args.sort_by_latency or args.write_latency):
+        import speed_test
+        updated_config = speed_test.rank_api_sites(updated_config, speeds, sort=args.sort_by_latency,
+                                                   write_latency=args.write_latency, playbacks=playbacks,
+                                                   searches=searches)
+        actions = [text for flag, text in ((args.sort_by_latency, "按延迟排序"), (args.write_latency, "写入 latency_ms 字段"))
+                   if flag]
+        print(f"⚡ 已根据测速结果{'并'.join(actions)}")
+    
+    return updated_config
+
+def probe_and_prune(config: dict, args: argparse.Namespace, digests: Optional[Dict[str, dict]] = None,
+                    trace: Optional[RunTrace] = None) -> dict:
+    """
+    测速阶段：探测、测速并移除无效源，返回更新后的配置（无任何改动时返回原对象）。
+    digests 不为 None 时填入 {源名称: 内容摘要}（本轮探测所得，或探测历史中最近一次的摘要）；
+    trace 不为 None 时记录每个源的探测结果与逐次请求
+    """
+    measurements = measure_sources(config, args, trace)
+    if digests is not None:
+        digests.update({name: m['digest'] for name, m in measurements.items() if m['digest']})
+    return apply_measurements(config, measurements, args)
+
+def write_shard_results(path: str, config: dict, shard: Tuple[int, int], measurements: Dict[str, dict]) -> None:
+    """
+    写出单个分片的测量结果，附带去重后的完整配置，合并步骤直接使用它而无需重新拉取上游
+    """
+    write_json_atomic(path, {
+        "shard": list(shard),
+        "config_fingerprint": config_fingerprint(config),
+        "config": config,
+        "measurements": measurements,
+    }, indent=None)
+    print(f"📦 分片 {shard[0]}/{shard[1]} 的 {len(measurements)} 条测量结果已写入 {path}")
+
+def load_shard_results(paths: List[str]) -> Tuple[Optional[dict], Dict[str, dict]]:
+    """
+    读取并校验各分片的结果文件：分片数一致、编号不重复且齐全、基于同一份配置。
+    返回 (配置, 按配置顺序合并后的测量记录)；校验失败时返回 (None, {})
+    """
+    partials = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                partials.append(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"错误: 读取分片结果 {path} 失败: {e}")
+            return None, {}
+    counts = {partial['shard'][1] for partial in partials}
+    fingerprints = {partial['config_fingerprint'] for partial in partials}
+    indexes = sorted(partial['shard'][0] for partial in partials)
+    if len(counts) != 1 or len(fingerprints) != 1:
+        print("错误: 分片结果来自不同的分片数或不同的配置，无法合并")
+        return None, {}
+    count = counts.pop()
+    if indexes != list(range(count)):
+        missing = sorted(set(range(count)) - set(indexes))
+        print(f"错误: 分片结果不完整或有重复（共 {count} 片，缺少 {missing}，已有 {indexes}）")
+        return None, {}
+    config = partials[0]['config']
+    merged = {}
+    for partial in partials:
+        merged.update(partial['measurements'])
+    print(f"已合并 {count} 个分片的 {len(merged)} 条测量结果")
+    return config, {name: merged[name] for name in config.get('api_site', {}) if name in merged}
+
+def add_shard_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    注册分片测速与合并的命令行参数（pipeline.py 复用）
+    """
+    parser.add_argument(
+        '--shard',
+        type=parse_shard,
+        default=None,
+        metavar='I/N',
+        help="只测试按规范化 URL 哈希分到第 I 片（共 N 片）的源，把测量结果写入 --shard-output，不修改配置文件。"
+    )
+    parser.add_argument(
+        '--shard-output',
+        default=None,
+        help="分片结果文件路径（默认 probe_results.I-of-N.json）。"
+    )
+    parser.add_argument(
+        '--merge-shards',
+        nargs='+',
+        metavar='FILE',
+        default=None,
+        help="合并各分片的结果文件并据此生成最终配置，不再拉取上游或探测。"
+    )
+
+def shard_output_path(args: argparse.Namespace) -> str:
+    return args.shard_output or f"probe_results.{args.shard[0]}-of-{args.shard[1]}.json"
+
+def main():
+    parser = argparse.ArgumentParser(description="测试并清理配置文件中的API。")
+    parser.add_argument(
+        '-y', '--yes',
+        action='store_true',
+        help="自动对所有提问回答'是'，用于非交互式环境（如GitHub Actions）。"
+    )
+    add_probe_arguments(parser)
+    add_shard_arguments(parser)
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    check_probe_arguments(parser, args)
+
+    config_path = 'config.json'
+    
+    if args.merge_shards:
+        config, measurements = load_shard_results(args.merge_shards)
+        if config is None:
+            return
+        updated_config = apply_measurements(config, measurements, args)
+        write_json_atomic(config_path, updated_config)
+        print(f"已将合并后的配置保存到 {config_path}")
+        return
+    
+    if not os.path.exists(config_path):
+        print(f"错误: 找不到配置文件 {config_path}")
+        return
+    
+    original_config = load_apis_from_config(config_path)
+    # remove_duplicate_apis 会原地修改配置，保留一份未改动的原配置用于比较与备份
+    config = dedupe_config(copy.deepcopy(original_config), args.yes)
+    trace = RunTrace(args.trace)
+    try:
+        if args.shard:
+            write_shard_results(shard_output_path(args), config, args.shard, measure_sources(config, args, trace, args.shard))
+            updated_config = original_config
+        else:
+            updated_config = probe_and_prune(config, args, trace=trace)
+    finally:
+        trace.close()
+    trace.print_summary()
+    if args.metrics:
+        trace.write_prometheus(args.metrics)
+    
+    if updated_config != original_config:
+        backup_path = f"{config_path}.backup.{int(time.time())}"
+        write_json_atomic(backup_path, original_config, indent=2)
+        print(f"原配置已备份至: {backup_path}")
+        write_json_atomic(config_path, updated_config)
+        print(f"已将更新后的配置保存到 {config_path}")
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*-
 import requests
-import base58
 import json
 import time
+import os
+import random
+import hashlib
+import argparse
+import concurrent.futures
+from typing import Optional, Tuple
 from urllib.parse import urlparse  # --- 引入 URL 解析库 ---
 
+from base58_codec import b58decode, sniff_format
+from config_io import load_json_or_none, write_json_atomic
+from probe_state import STATE_DIR
+from run_trace import RunTrace, add_trace_arguments
+from source_index import canonical_api_url
+
 # --- 配置区 ---
 URLS_TO_FETCH = [
     "https://raw.githubusercontent.com/cmliu/cmliu/refs/heads/main/tvapi_config_json",  
@@ -19,101 +30,248 @@ ALLOWED_TOP_LEVEL_KEYS = {"cache_time", "api_site"}
 OUTPUT_FILENAME = "config.json"
 MAX_RETRIES = 3
 RETRY_DELAY = 5
+MAX_RETRY_DELAY = 30
+
+# 上游内容缓存目录：保存每个上游的 ETag/Last-Modified 与解析结果，用于条件请求
+UPSTREAM_CACHE_DIR = os.path.join(STATE_DIR, 'upstream')
+# 缓存目录中记录各流程最近一次成功发布时所用上游内容哈希的文件
+PUBLISHED_FILE = 'published.json'
 
-def fetch_and_decode_url(url):
+class UpstreamCache:
     """
-    从URL获取内容，智能判断是Base58还是明文JSON，然后解码/解析，并根据白名单进行过滤。
+    按 URL 缓存上游的响应校验信息（ETag、Last-Modified、内容哈希）及解析过滤后的结果
+    """
+
+    def __init__(self, cache_dir: str = UPSTREAM_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, url: str) -> Optional[dict]:
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"警告: 读取上游缓存 {path} 失败: {e}")
+            return None
+
+    def save(self, url: str, entry: dict) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._path(url), 'w', encoding='utf-8') as f:
+            json.dump(dict(entry, url=url), f, ensure_ascii=False)
+
+    def published_input(self, producer: str) -> Optional[str]:
+        """
+        producer（如 'update_config'、'pipeline'）最近一次成功写出配置时所用的上游内容哈希
+        """
+        published = load_json_or_none(os.path.join(self.cache_dir, PUBLISHED_FILE)) or {}
+        return published.get(producer)
+
+    def mark_published(self, producer: str, digest: str) -> None:
+        """
+        配置文件全部写出成功后记录本次所用的上游内容哈希；
+        中途失败或被中断时不记录，下次运行不会因为上游“未变化”而沿用半途的结果
+        """
+        path = os.path.join(self.cache_dir, PUBLISHED_FILE)
+        published = load_json_or_none(path) or {}
+        published[producer] = digest
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_json_atomic(path, published)
+
+def upstream_digest(contents) -> str:
+    """
+    各上游过滤后内容（按上游顺序）的哈希，须在 merge_configs 修改内容之前计算
+    """
+    return hashlib.sha256(json.dumps(contents, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def retry_delay(attempt: int) -> float:
+    """
+    带随机抖动的指数退避（full jitter），避免多个上游同时重试
+    """
+    return random.uniform(0, min(RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY))
+
+def decode_content(content):
+    """
+    智能判断内容是Base58还是明文JSON，然后解码/解析，并根据白名单进行过滤。
     """
+    data = None
+    content_format = sniff_format(content)
+    if content_format == 'base58':
+        try:
+            print("...内容只包含 Base58 字符，尝试作为 Base58 解码...")
+            decoded_string = b58decode(content).decode('utf-8')
+            data = json.loads(decoded_string)
+            print("...成功将内容作为 Base58 解码。")
+        except ValueError:
+            print("...Base58 解码失败，尝试直接作为明文 JSON 解析...")
+    if data is None:
+        try:
+            data = json.loads(content)
+            print("...成功将内容作为明文 JSON 解析。")
+        except json.JSONDecodeError as json_e:
+            print(f"错误: 内容既不是有效的Base58，也不是有效的JSON。错误信息: {json_e}")
+            return None
+
+    if isinstance(data, list):
+        print("...检测到内容为列表(Array)格式，正在自动转换为字典格式...")
+        converted_sites = {}
+        for index, item in enumerate(data):
+            if isinstance(item, dict):
+                api_link = item.get("baseUrl") or item.get("api") or item.get("url")
+                
+                if api_link:
+                    site_key = item.get("id") or item.get("key") or item.get("name") or f"site_list_{index}"
+                    
+                    converted_sites[site_key] = {
+                        "name": item.get("name", site_key),
+                        "api": api_link
+                        # 在这里移除了强制写入空 detail 的逻辑，统交由后面的 main 模块处理
+                    }
+        
+        if converted_sites:
+            data = {
+                "api_site": converted_sites
+            }
+            print(f"...成功从列表中提取并转换了 {len(converted_sites)} 个有效源。")
+        else:
+            print("警告: 列表中未找到任何包含 'api', 'url' 或 'baseUrl' 字段的有效源。")
+            return None
+
+    if isinstance(data, dict):
+        filtered_data = {key: data[key] for key in ALLOWED_TOP_LEVEL_KEYS if key in data}
+        if not filtered_data:
+            print("警告: 解析后的内容中未找到任何白名单指定的键 (包含 cache_time, api_site)。")
+            return None
+        print(f"内容已按白名单过滤，保留键: {list(filtered_data.keys())}")
+        return filtered_data
+    else:
+        print("警告: 解析后的内容不是一个可按键过滤的字典。")
+        return None
+
+def fetch_upstream(url, cache: Optional[UpstreamCache] = None,
+                   trace: Optional[RunTrace] = None) -> Tuple[Optional[dict], bool]:
+    """
+    获取并解析单个上游，返回 (过滤后的内容, 是否有变化)。
+
+    有缓存时发送 If-None-Match / If-Modified-Since 条件请求，上游返回 304 或内容哈希未变时
+    直接复用缓存的解析结果，不再重新解码；多次请求失败时回退到缓存内容。
+    trace 不为 None 时记录每次请求的状态码、字节数、耗时、内容格式与结果。
+    """
+    cached = cache.load(url) if cache else None
+    fetch_start = time.perf_counter()
     for attempt in range(MAX_RETRIES):
+        start = time.perf_counter()
+        record = {"url": url, "attempt": attempt + 1, "status": None, "bytes": 0}
+
+        def note(outcome, **fields):
+            if trace:
+                trace.emit('fetch', **record, outcome=outcome, elapsed=round(time.perf_counter() - start, 6), **fields)
+
         try:
             print(f"正在尝试第 {attempt + 1}/{MAX_RETRIES} 次请求链接: {url}")
-            response = requests.get(url, timeout=15)
+            headers = {}
+            if cached and cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached and cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+            response = requests.get(url, headers=headers, timeout=15)
+            record['status'] = response.status_code
+            if response.status_code == 304 and cached:
+                print(f"上游未变化 (304)，复用缓存内容: {url}")
+                note('not_modified')
+                return cached['data'], False
             response.raise_for_status()
+            record['bytes'] = len(response.content)
+            
+            body_hash = hashlib.sha256(response.content).hexdigest()
+            if cached and cached.get('body_hash') == body_hash:
+                print(f"上游内容哈希未变化，复用缓存内容: {url}")
+                note('hash_unchanged')
+                return cached['data'], False
+            
             response.encoding = 'utf-8'
             content = response.text.strip()
             
             if not content:
                 print(f"警告: 从 {url} 获取的内容为空。")
-                return None
-
-            data = None
-            try:
-                print("...尝试将内容作为 Base58 解码...")
-                decoded_bytes = base58.b58decode(content)
-                decoded_string = decoded_bytes.decode('utf-8')
-                data = json.loads(decoded_string)
-                print("...成功将内容作为 Base58 解码。")
-            except Exception:
-                print("...Base58 解码失败，尝试直接作为明文 JSON 解析...")
-                try:
-                    data = json.loads(content)
-                    print("...成功将内容作为明文 JSON 解析。")
-                except json.JSONDecodeError as json_e:
-                    print(f"错误: 内容既不是有效的Base58，也不是有效的JSON。错误信息: {json_e}")
-                    return None
+                note('empty')
+                return None, True
             
-            print(f"成功解析链接内容: {url}")
-
-            if isinstance(data, list):
-                print("...检测到内容为列表(Array)格式，正在自动转换为字典格式...")
-                converted_sites = {}
-                for index, item in enumerate(data):
-                    if isinstance(item, dict):
-                        api_link = item.get("baseUrl") or item.get("api") or item.get("url")
-                        
-                        if api_link:
-                            site_key = item.get("id") or item.get("key") or item.get("name") or f"site_list_{index}"
-                            
-                            converted_sites[site_key] = {
-                                "name": item.get("name", site_key),
-                                "api": api_link
-                                # 在这里移除了强制写入空 detail 的逻辑，统交由后面的 main 模块处理
-                            }
-                
-                if converted_sites:
-                    data = {
-                        "api_site": converted_sites
-                    }
-                    print(f"...成功从列表中提取并转换了 {len(converted_sites)} 个有效源。")
-                else:
-                    print("警告: 列表中未找到任何包含 'api', 'url' 或 'baseUrl' 字段的有效源。")
-                    return None
-
-            if isinstance(data, dict):
-                filtered_data = {key: data[key] for key in ALLOWED_TOP_LEVEL_KEYS if key in data}
-                if not filtered_data:
-                    print("警告: 解析后的内容中未找到任何白名单指定的键 (包含 cache_time, api_site)。")
-                    return None
-                print(f"内容已按白名单过滤，保留键: {list(filtered_data.keys())}")
-                return filtered_data
-            else:
-                print("警告: 解析后的内容不是一个可按键过滤的字典。")
-                return None
+            data = decode_content(content)
+            if data is not None:
+                print(f"成功解析链接内容: {url}")
+                if cache:
+                    cache.save(url, {
+                        "etag": response.headers.get('ETag'),
+                        "last_modified": response.headers.get('Last-Modified'),
+                        "body_hash": body_hash,
+                        "data": data,
+                    })
+            if trace:
+                note('changed' if data is not None else 'invalid', format=sniff_format(content),
+                     sources=len(data.get('api_site') or {}) if data else 0)
+            return data, True
 
         except requests.exceptions.RequestException as req_e:
             print(f"错误：请求链接失败: {req_e}")
+            note('error', error=req_e.__class__.__name__)
         except Exception as e:
             print(f"错误: 处理来自 {url} 的内容时发生未知错误: {e}")
+            note('error', error=e.__class__.__name__)
         
         if attempt < MAX_RETRIES - 1:
-            time.sleep(RETRY_DELAY)
+            time.sleep(retry_delay(attempt))
             
     print(f"错误: 在 {MAX_RETRIES} 次尝试后，仍然无法处理链接: {url}")
-    return None
+    if trace:
+        trace.emit('fetch', url=url, attempt=MAX_RETRIES, status=None, bytes=0,
+                   elapsed=round(time.perf_counter() - fetch_start, 6), outcome='stale_cache' if cached else 'failed')
+    if cached:
+        print(f"警告: 使用上一次缓存的内容代替: {url}")
+        return cached['data'], False
+    return None, False
 
-def main():
+def fetch_and_decode_url(url, trace: Optional[RunTrace] = None):
     """
-    主执行函数
+    从URL获取内容，智能判断是Base58还是明文JSON，然后解码/解析，并根据白名单进行过滤。
+    """
+    return fetch_upstream(url, trace=trace)[0]
+
+def fetch_all_upstreams(urls, cache: Optional[UpstreamCache] = None, trace: Optional[RunTrace] = None):
+    """
+    并发获取所有上游，按 urls 的顺序返回 [(过滤后的内容, 是否有变化), ...]
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(urls))) as executor:
+        return list(executor.map(lambda url: fetch_upstream(url, cache, trace), urls))
+
+def report_changed(changed: bool) -> None:
+    """
+    在 GitHub Actions 中输出 changed=true/false，供后续步骤判断是否需要继续执行
+    """
+    output_path = os.environ.get('GITHUB_OUTPUT')
+    if output_path:
+        with open(output_path, 'a', encoding='utf-8') as f:
+            f.write(f"changed={'true' if changed else 'false'}\n")
+
+def merge_configs(clean_data_buffer, upstream_urls=None, provenance: Optional[dict] = None):
+    """
+    合并各上游的过滤结果：统一提取 detail 字段，规范化后 API 链接相同的源只保留第一次出现的，
+    链接不同但键名冲突的源依次重命名为 key_2、key_3...
+    provenance 不为 None 时填入 {合并后的键名: 来源上游}，upstream_urls 与 clean_data_buffer 一一对应
     """
-    print("--- 开始更新配置文件 ---")
-    clean_data_buffer = [content for url in URLS_TO_FETCH if (content := fetch_and_decode_url(url))]
-    if not clean_data_buffer:
-        print("错误: 所有链接内容均为空或无法按规则过滤，无法生成配置文件。")
-        return
-    print(f"\n过滤完成，共获得 {len(clean_data_buffer)} 组有效内容。准备提取 detail 字段并合并...")
-    
     merged_api_sites = {}
-    for item in clean_data_buffer:
+    # 规范化 API 链接 -> (已保留的键名, 其来源上游的序号)
+    canonical_index = {}
+    skipped = 0
+
+    def upstream_label(index: int) -> str:
+        return upstream_urls[index] if upstream_urls else f"#{index}"
+
+    for index, item in enumerate(clean_data_buffer):
         if "api_site" in item and isinstance(item.get("api_site"), dict):
             for key, value in item["api_site"].items():
                 
@@ -139,6 +297,21 @@ def main():
                         value.setdefault("detail", "")
                 # ==========================================
 
+                canonical = None
+                if isinstance(value, dict) and isinstance(value.get("api"), str):
+                    canonical = canonical_api_url(value["api"])
+                if canonical is not None and canonical in canonical_index:
+                    kept_key, kept_index = canonical_index[canonical]
+                    if kept_key == key:
+                        # 同一个源出现在多个上游（或同一上游出现多次）中，键名与链接都相同
+                        print(f"✂️ 合并时跳过重复源 [{key}] (来自 {upstream_label(index)}，"
+                              f"已保留 {upstream_label(kept_index)} 中的同名源)")
+                    else:
+                        print(f"✂️ 合并时跳过重复源 [{key}] -> {value['api']} (来自 {upstream_label(index)}，"
+                              f"链接等同于 {upstream_label(kept_index)} 中的 [{kept_key}])")
+                    skipped += 1
+                    continue
+
                 new_key = key
                 counter = 2
                 while new_key in merged_api_sites:
@@ -147,19 +320,81 @@ def main():
                 if new_key != key:
                     print(f"发现重复键 '{key}'，已重命名为 '{new_key}'")
                 merged_api_sites[new_key] = value
+                if provenance is not None:
+                    provenance[new_key] = upstream_label(index)
+                if canonical is not None:
+                    canonical_index[canonical] = (new_key, index)
 
+    if skipped:
+        print(f"合并时共跳过 {skipped} 个重复源，保留 {len(merged_api_sites)} 个源")
     first_valid_cache_time = next((item.get("cache_time") for item in clean_data_buffer if "cache_time" in item), 7200)
-    final_config = {
+    return {
         "cache_time": first_valid_cache_time,
         "api_site": merged_api_sites
     }
+
+def add_update_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    注册拉取上游阶段的命令行参数（pipeline.py 复用）
+    """
+    parser.add_argument('--force', action='store_true', help="即使所有上游均未变化也重新生成配置文件。")
+    parser.add_argument('--no-cache', action='store_true', help="不使用上游缓存，每次都完整下载并解析。")
+
+def main():
+    """
+    主执行函数，返回本次是否生成了新的配置文件
+    """
+    parser = argparse.ArgumentParser(description="从上游拉取并合并生成 config.json。")
+    add_update_arguments(parser)
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+
+    trace = RunTrace(args.trace)
+    try:
+        ok = run(args, trace)
+    finally:
+        trace.close()
+    trace.print_summary()
+    if args.metrics:
+        trace.write_prometheus(args.metrics)
+    return ok
+
+def run(args: argparse.Namespace, trace: RunTrace) -> bool:
+    """
+    拉取、合并并写出 config.json，返回本次是否生成了新的配置文件
+    """
+    print("--- 开始更新配置文件 ---")
+    cache = None if args.no_cache else UpstreamCache()
+    fetched = fetch_all_upstreams(URLS_TO_FETCH, cache, trace)
+    clean_data_buffer = [content for content, _ in fetched if content]
+    if not clean_data_buffer:
+        print("错误: 所有链接内容均为空或无法按规则过滤，无法生成配置文件。")
+        report_changed(False)
+        return False
+    
+    # 与上一次成功写出时的上游内容比较，而不是与缓存比较：缓存在拉取时就已更新，
+    # 上次运行在写出前中断时仍会认为上游“未变化”
+    digest = upstream_digest(clean_data_buffer)
+    if (not args.force and cache and os.path.exists(OUTPUT_FILENAME)
+            and cache.published_input('update_config') == digest):
+        print("✅ 所有上游均未变化，沿用现有配置文件，跳过后续流程。")
+        report_changed(False)
+        return False
+    print(f"\n过滤完成，共获得 {len(clean_data_buffer)} 组有效内容。准备提取 detail 字段并合并...")
+    
+    final_config = merge_configs(clean_data_buffer)
     try:
-        with open(OUTPUT_FILENAME, 'w', encoding='utf-8') as f:
-            json.dump(final_config, f, indent=4, ensure_ascii=False)
+        write_json_atomic(OUTPUT_FILENAME, final_config)
         print(f"成功！所有内容已通过重命名方式完整写入文件: {OUTPUT_FILENAME}")
-    except IOError as e:
+    except OSError as e:
         print(f"错误: 写入文件 {OUTPUT_FILENAME} 失败: {e}")
+        report_changed(False)
+        return False
+    if cache:
+        cache.mark_published('update_config', digest)
     print("--- 更新任务结束 ---")
+    report_changed(True)
+    return True
 
 if __name__ == "__main__":
     main()